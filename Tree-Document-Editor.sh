@@ -23,6 +23,7 @@ main_menu() {
     echo ""
     echo "   2) Install Requirements"
     echo ""
+    echo "   3) Validate Documents (headless)"
     echo ""
     echo ""
     echo ""
@@ -31,7 +32,7 @@ main_menu() {
     echo ""
     echo ""
     echo "-------------------------------------------------------------------------------"
-    read -p "Selection; Menu Options = 1-2, Quit Program = Q: " choice
+    read -p "Selection; Menu Options = 1-3, Quit Program = Q: " choice
     
     case "$choice" in
         1|[Ll]aunch)
@@ -40,6 +41,9 @@ main_menu() {
         2|[Ii]nstall)
             install_deps
             ;;
+        3|[Vv]alidate)
+            validate_docs
+            ;;
         [Qq]|[Qq]uit)
             quit_app
             exit 0
@@ -76,6 +80,19 @@ install_deps() {
     read -p "Press Enter to continue..."
 }
 
+validate_docs() {
+    clear
+    echo "==============================================================================="
+    echo "   Validating Documents"
+    echo "==============================================================================="
+    echo ""
+    $PYTHON_CMD "$SCRIPT_DIR/scripts/batch.py" validate "$SCRIPT_DIR"/data/*.json
+    echo ""
+    echo "For convert, format, merge and split run: scripts/batch.py --help"
+    echo ""
+    read -p "Press Enter to continue..."
+}
+
 quit_app() {
     clear
     echo "==============================================================================="
@@ -0,0 +1,71 @@
+"""
+Worker-thread tasks that report back to the GTK main loop.
+"""
+import threading
+import time
+
+from gi.repository import GLib
+
+class Cancelled(Exception):
+    """Raised inside a task's work function once cancel() was requested."""
+
+
+class BackgroundTask:
+    """Runs `work(task)` on a worker thread.
+
+    `on_done(result)`, `on_error(exception)` and `on_progress(fraction)` are
+    always invoked on the main loop through GLib.idle_add. The work function
+    calls task.report() to publish progress and task.check() at safe points
+    to honour cancellation.
+    """
+
+    PROGRESS_INTERVAL = 0.05
+
+    def __init__(self, work, on_done, on_error=None, on_progress=None):
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self._cancel = threading.Event()
+        self._last_report = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self):
+        """Blocks until the worker thread has finished."""
+        self._thread.join()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def report(self, fraction):
+        """Publishes progress, at most once per PROGRESS_INTERVAL seconds."""
+        now = time.monotonic()
+        if self.on_progress and now - self._last_report >= self.PROGRESS_INTERVAL:
+            self._last_report = now
+            GLib.idle_add(self._call, self.on_progress, min(fraction, 1.0))
+
+    def _run(self):
+        try:
+            result = self.work(self)
+        except BaseException as e:
+            if self.on_error:
+                GLib.idle_add(self._call, self.on_error, e)
+            return
+        GLib.idle_add(self._call, self.on_done, result)
+
+    @staticmethod
+    def _call(callback, value):
+        callback(value)
+        return False
@@ -0,0 +1,299 @@
+"""
+Headless batch tool for Tree-Document-Editor documents.
+
+Works on configuration.json / tree.json documents, .tdb binaries and .sqlite
+databases without GTK or a display. Markdown and OPML outlines can be read
+wherever a document is expected, and exported to with the export command;
+format and repair write them as a .json document next to the outline.
+Commands that take several files process them in parallel with a process
+pool.
+
+Usage:
+    batch.py validate FILE... [--max-text N]
+    batch.py repair FILE... [--policy {repair,drop}] [--max-text N] [--output-dir DIR]
+    batch.py convert FILE... --to {json,tdb,sqlite} [--compact] [--output-dir DIR]
+    batch.py format FILE... [--compact] [--output-dir DIR]
+    batch.py merge FILE... --output OUT [--compact]
+    batch.py split FILE --output-dir DIR [--compact]
+    batch.py diff OLD NEW
+    batch.py export FILE... --to {markdown,opml,html,text} [--output-dir DIR]
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.tree_model import ROOT, TreeModel
+from scripts.tree_json import read_document, write_document, write_tree
+from scripts.tree_binary import EXTENSION, is_bare_tree, open_binary, read_binary, write_binary
+from scripts import tree_sqlite
+from scripts.tree_hash import SubtreeHashes, diff_trees, format_difference
+from scripts.tree_validation import LoadValidator, MAX_TEXT, REPAIR, DROP
+from scripts.tree_formats import EXPORTERS, IMPORTERS, export_document, import_document
+from scripts.file_utils import atomic_write
+
+# ------------------------------------------------------------------
+#  Document helpers
+# ------------------------------------------------------------------
+def is_binary(path):
+    return path.lower().endswith(EXTENSION)
+
+def is_outline(path):
+    return os.path.splitext(path)[1].lower() in IMPORTERS
+
+def load_any(path, model, validator=None):
+    """Loads a JSON, .tdb or .sqlite document into `model`; returns (extra, bare).
+
+    A Markdown or OPML outline loads as a bare tree. JSON and SQLite
+    documents report malformed nodes to `validator`.
+    """
+    if is_outline(path):
+        import_document(path, model)
+        return {}, True
+    if tree_sqlite.is_sqlite(path):
+        extra = tree_sqlite.read_sqlite(path, model, validator=validator)
+        return extra, tree_sqlite.is_bare_sqlite(path)
+    if is_binary(path):
+        with open_binary(path) as document:
+            bare = document.bare
+        return read_binary(path, model), bare
+    with open(path, "r", encoding="utf-8") as f:
+        bare = is_bare_tree(f)
+        return read_document(f, model, validator=validator), bare
+
+def save_any(path, model, extra, bare, indent):
+    """Writes `model` as JSON, .tdb or .sqlite depending on the extension of `path`."""
+    if path.lower().endswith(tree_sqlite.EXTENSION):
+        tree_sqlite.write_sqlite(path, model, extra, bare)
+        return
+    if is_binary(path):
+        with atomic_write(path, "wb") as f:
+            write_binary(f, model, extra, bare)
+        return
+    with atomic_write(path) as f:
+        if bare:
+            write_tree(f, model, ROOT, indent)
+        else:
+            write_document(f, model, extra, indent)
+
+def output_path(path, output_dir, extension=None):
+    directory = output_dir or os.path.dirname(path)
+    name = os.path.basename(path)
+    if extension:
+        name = os.path.splitext(name)[0] + extension
+    return os.path.join(directory, name)
+
+# ------------------------------------------------------------------
+#  Per-file jobs (run in worker processes)
+# ------------------------------------------------------------------
+def validate_file(path, max_text):
+    model = TreeModel()
+    validator = LoadValidator(REPAIR, max_text)
+    load_any(path, model, validator)
+    if not validator.ok:
+        raise ValueError(f"{validator.count} problem(s)\n    " + "\n    ".join(validator.summary()))
+    return f"{len(model)} nodes"
+
+def repair_file(path, policy, max_text, output_dir, indent):
+    model = TreeModel()
+    validator = LoadValidator(policy, max_text)
+    extra, bare = load_any(path, model, validator)
+    if validator.ok and not output_dir:
+        return "no problems"
+    # Outlines cannot hold a document, so they are never written over
+    destination = output_path(path, output_dir, ".json" if is_outline(path) else None)
+    save_any(destination, model, extra, bare, indent)
+    return f"{validator.count} problem(s) fixed -> {destination}"
+
+def convert_file(path, target, output_dir, indent):
+    model = TreeModel()
+    extra, bare = load_any(path, model)
+    extension = {"tdb": EXTENSION, "sqlite": tree_sqlite.EXTENSION}.get(target, ".json")
+    destination = output_path(path, output_dir, extension)
+    if os.path.abspath(destination) == os.path.abspath(path):
+        raise ValueError("Conversion would overwrite the source file")
+    save_any(destination, model, extra, bare, indent)
+    return f"-> {destination}"
+
+def format_file(path, output_dir, indent):
+    model = TreeModel()
+    extra, bare = load_any(path, model)
+    destination = output_path(path, output_dir, ".json" if is_outline(path) else None)
+    save_any(destination, model, extra, bare, indent)
+    return f"-> {destination}"
+
+def export_file(path, target, output_dir):
+    model = TreeModel()
+    load_any(path, model)
+    destination = output_path(path, output_dir, EXPORTERS[target][0])
+    if os.path.abspath(destination) == os.path.abspath(path):
+        raise ValueError("Export would overwrite the source file")
+    export_document(destination, model, target, os.path.splitext(os.path.basename(path))[0])
+    return f"-> {destination}"
+
+def _run_job(job):
+    function, path, args = job
+    try:
+        return path, True, function(path, *args)
+    except Exception as e:
+        return path, False, f"{type(e).__name__}: {e}"
+
+def run_parallel(function, paths, args, jobs):
+    """Runs `function(path, *args)` for every path; returns the failure count."""
+    work = [(function, path, args) for path in paths]
+    if jobs == 1 or len(work) == 1:
+        return _report(map(_run_job, work))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Batching small files per worker round-trip keeps the pool overhead low
+        chunksize = max(1, len(work) // (jobs * 4))
+        return _report(executor.map(_run_job, work, chunksize=chunksize))
+
+def _report(results):
+    failures = 0
+    for path, ok, message in results:
+        print(f"{'OK  ' if ok else 'FAIL'} {path}: {message}")
+        failures += not ok
+    return failures
+
+# ------------------------------------------------------------------
+#  Whole-batch commands
+# ------------------------------------------------------------------
+def merge_files(paths, output, indent):
+    """Concatenates the top-level nodes of `paths`; settings come from the first."""
+    model = TreeModel()
+    merged_extra = None
+    for path in paths:
+        part = TreeModel()
+        extra, _ = load_any(path, part)
+        if merged_extra is None:
+            merged_extra = extra
+        for child in part.children(ROOT):
+            graft(model, ROOT, part, child)
+    save_any(output, model, merged_extra or {}, False, indent)
+    print(f"Merged {len(paths)} documents ({len(model)} nodes) -> {output}")
+
+def graft(model, parent, source, node):
+    """Copies the subtree at `node` of `source` below `parent` in `model`."""
+    stack = [(node, parent)]
+    text = source.text
+    while stack:
+        node, parent = stack.pop()
+        copied = model.append(parent, text[node])
+        stack.extend((child, copied) for child in reversed(list(source.children(node))))
+
+def split_file(path, output_dir, indent):
+    """Writes every top-level node of `path` to its own tree.json-style file."""
+    model = TreeModel()
+    load_any(path, model)
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(path))[0]
+    for index, child in enumerate(model.children(ROOT)):
+        part = TreeModel()
+        graft(part, ROOT, model, child)
+        destination = os.path.join(output_dir, f"{base}-{index + 1:04d}.json")
+        save_any(destination, part, {}, True, indent)
+    print(f"Split {path} into {model.child_count(ROOT)} files in {output_dir}")
+
+def diff_files(old_path, new_path):
+    """Prints the structural differences between two documents; returns how many."""
+    old = TreeModel()
+    new = TreeModel()
+    load_any(old_path, old)
+    load_any(new_path, new)
+    count = 0
+    for entry in diff_trees(old, SubtreeHashes(old), new, SubtreeHashes(new)):
+        print(format_difference(entry))
+        count += 1
+    return count
+
+# ------------------------------------------------------------------
+#  Entry point
+# ------------------------------------------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless Tree-Document-Editor batch tool.")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for multi-file commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    validate = commands.add_parser("validate", help="check documents and list their problems")
+    validate.add_argument("files", nargs="+")
+    validate.add_argument("--max-text", type=int, default=MAX_TEXT,
+                          help="longest node text allowed, in characters")
+
+    repair = commands.add_parser("repair", help="rewrite documents with their problems fixed")
+    repair.add_argument("files", nargs="+")
+    repair.add_argument("--policy", choices=(REPAIR, DROP), default=REPAIR,
+                        help="fix malformed nodes or drop them with their subtrees")
+    repair.add_argument("--max-text", type=int, default=MAX_TEXT)
+    repair.add_argument("--compact", action="store_true")
+    repair.add_argument("--output-dir")
+
+    convert = commands.add_parser("convert", help="convert between JSON, .tdb and .sqlite")
+    convert.add_argument("files", nargs="+")
+    convert.add_argument("--to", choices=("json", "tdb", "sqlite"), required=True)
+    convert.add_argument("--compact", action="store_true")
+    convert.add_argument("--output-dir")
+
+    fmt = commands.add_parser("format", help="rewrite documents pretty or compact")
+    fmt.add_argument("files", nargs="+")
+    fmt.add_argument("--compact", action="store_true")
+    fmt.add_argument("--output-dir")
+
+    merge = commands.add_parser("merge", help="concatenate documents into one")
+    merge.add_argument("files", nargs="+")
+    merge.add_argument("--output", "-o", required=True)
+    merge.add_argument("--compact", action="store_true")
+
+    split = commands.add_parser("split", help="write each top-level node to its own file")
+    split.add_argument("file")
+    split.add_argument("--output-dir", required=True)
+    split.add_argument("--compact", action="store_true")
+
+    diff = commands.add_parser("diff", help="list structural differences between two documents")
+    diff.add_argument("old")
+    diff.add_argument("new")
+
+    export = commands.add_parser("export", help="export documents to Markdown, OPML, HTML or text")
+    export.add_argument("files", nargs="+")
+    export.add_argument("--to", choices=tuple(EXPORTERS), required=True)
+    export.add_argument("--output-dir")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    indent = None if getattr(args, "compact", False) else 4
+    jobs = max(1, args.jobs)
+    failures = 0
+    if args.command == "validate":
+        failures = run_parallel(validate_file, args.files, (args.max_text,), jobs)
+    elif args.command == "repair":
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        failures = run_parallel(repair_file, args.files,
+                                (args.policy, args.max_text, args.output_dir, indent), jobs)
+    elif args.command == "convert":
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        failures = run_parallel(convert_file, args.files,
+                                (args.to, args.output_dir, indent), jobs)
+    elif args.command == "format":
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        failures = run_parallel(format_file, args.files, (args.output_dir, indent), jobs)
+    elif args.command == "merge":
+        merge_files(args.files, args.output, indent)
+    elif args.command == "split":
+        split_file(args.file, args.output_dir, indent)
+    elif args.command == "diff":
+        # Like diff(1), differences make the exit status 1
+        failures = diff_files(args.old, args.new)
+    elif args.command == "export":
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        failures = run_parallel(export_file, args.files, (args.to, args.output_dir), jobs)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""
+Benchmark suite for the Tree-Document-Editor.
+
+Builds synthetic documents of several shapes (see tree_generators) and times
+each operation in a fresh process, so the reported peak RSS belongs to that
+operation alone.
+
+Usage:
+    benchmark.py [--sizes N ...] [--shapes SHAPE ...] [--cases CASE ...]
+                 [--repeat N] [--json OUT] [--compare BASELINE] [--threshold F]
+
+Sizes default to 1k-100k nodes; pass e.g. --sizes 1000000 5000000 for large
+runs. --json writes machine-readable results, and --compare checks their
+times and peak RSS against results saved from another commit; the peak RSS
+of the load case is the memory check of the streaming reader.
+
+populate_per_row fills an attached TreeStore one row at a time, the way the
+editor did before StoreView, as the reference for populate. open_binary maps
+a .tdb file and should take about the same time at every size.
+
+The GTK cases (populate, populate_per_row, editor_load, editor_save) need a
+display. Without
+one the suite re-runs itself under xvfb-run, or on a broadwayd backend, and
+skips those cases if neither is installed.
+
+Exits non-zero on a regression against --compare, or when a warm (cached)
+start is not faster than a cold one.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.tree_model import ROOT, NONE, TreeModel
+from scripts.tree_utils import serialize_tree, deserialize_tree
+from scripts.tree_binary import write_binary, open_binary
+from scripts.document_io import load_document, save_document
+from scripts import parallel_json
+from scripts.snapshot_cache import is_fresh, load_cached, store_cache, source_key
+from scripts.tree_generators import SHAPES, generate, max_depth
+from scripts.session import Session
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+CASES = ("serialize", "deserialize", "save", "parallel_save", "load", "binary_save",
+         "open_binary", "warm_load", "populate", "populate_per_row", "editor_load", "editor_save")
+GTK_CASES = ("populate", "populate_per_row", "editor_load", "editor_save")
+# Timings below this are too noisy to call a regression
+NOISE_FLOOR = 0.001
+# Nor are peak RSS increases below this, in MB
+RSS_NOISE_MB = 2.0
+
+# ------------------------------------------------------------------
+#  Measurement helpers (run inside the case's own process)
+# ------------------------------------------------------------------
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def best_time(func, repeat, setup=None):
+    """Shortest of `repeat` timed calls of `func`, each after an untimed `setup()`."""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def generated(shape, size):
+    return generate(TreeModel(), shape, size)
+
+def load_gtk():
+    """Returns the Gtk module, or None when GTK or a display is missing."""
+    try:
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk
+    except (ImportError, ValueError):
+        return None
+    return Gtk if Gtk.init_check(sys.argv)[0] else None
+
+# ------------------------------------------------------------------
+#  Cases
+# ------------------------------------------------------------------
+def prepare(shape, size, directory):
+    """Writes the cold document and a warm copy with its startup cache."""
+    model = generated(shape, size)
+    extra = {"settings": {"warm_start_cache": False}}
+    cold = os.path.join(directory, "cold", "configuration.json")
+    warm = os.path.join(directory, "warm", "configuration.json")
+    os.makedirs(os.path.dirname(cold))
+    os.makedirs(os.path.dirname(warm))
+    save_document(cold, model, extra)
+    shutil.copyfile(cold, warm)
+    store_cache(warm, model, extra, source_key(warm))
+    return {"bytes": os.path.getsize(cold), "depth": max_depth(model)}
+
+def case_serialize(shape, size, directory, repeat):
+    model = generated(shape, size)
+    return best_time(lambda: serialize_tree(model), repeat)
+
+def case_deserialize(shape, size, directory, repeat):
+    data = serialize_tree(generated(shape, size))
+    return best_time(lambda: deserialize_tree(data, TreeModel(), None), repeat)
+
+def case_save(shape, size, directory, repeat):
+    model = generated(shape, size)
+    path = os.path.join(directory, "save.json")
+    return best_time(lambda: save_document(path, model, {"settings": {}}), repeat)
+
+def case_parallel_save(shape, size, directory, repeat):
+    model = generated(shape, size)
+    path = os.path.join(directory, "save.json")
+    # Below the usual threshold too, so small sizes show the pool's overhead
+    parallel_json.PARALLEL_MIN_NODES = 0
+    return best_time(lambda: save_document(path, model, {"settings": {}},
+                                           workers=parallel_json.default_workers()), repeat)
+
+def case_load(shape, size, directory, repeat):
+    path = os.path.join(directory, "cold", "configuration.json")
+    return best_time(lambda: load_document(path, TreeModel()), repeat)
+
+def case_binary_save(shape, size, directory, repeat):
+    model = generated(shape, size)
+    path = os.path.join(directory, "save.tdb")
+
+    def save():
+        with open(path, "wb") as f:
+            write_binary(f, model)
+    return best_time(save, repeat)
+
+def case_open_binary(shape, size, directory, repeat):
+    path = os.path.join(directory, "open.tdb")
+    with open(path, "wb") as f:
+        write_binary(f, generated(shape, size))
+    return best_time(lambda: open_binary(path).close(), repeat)
+
+def case_warm_load(shape, size, directory, repeat):
+    path = os.path.join(directory, "warm", "configuration.json")
+
+    def load():
+        assert is_fresh(path)
+        load_cached(path, TreeModel())
+    return best_time(load, repeat)
+
+def case_populate(shape, size, directory, repeat):
+    Gtk = load_gtk()
+    if Gtk is None:
+        return None
+    from scripts.tree_view import StoreView
+    view = StoreView(generated(shape, size))
+    view.connect_treeview(Gtk.TreeView())
+    return best_time(view.populate, repeat)
+
+def case_populate_per_row(shape, size, directory, repeat):
+    Gtk = load_gtk()
+    if Gtk is None:
+        return None
+    model = generated(shape, size)
+    text = model.text
+    first_child = model.first_child
+    next_sibling = model.next_sibling
+
+    def populate():
+        store = Gtk.TreeStore(str)
+        treeview = Gtk.TreeView(model=store)
+        stack = [(first_child[ROOT], None)]
+        while stack:
+            child, parent_iter = stack.pop()
+            while child != NONE:
+                row = store.append(parent_iter, [text[child]])
+                if first_child[child] != NONE:
+                    stack.append((first_child[child], row))
+                child = next_sibling[child]
+        treeview.destroy()
+    return best_time(populate, repeat)
+
+def _open_editor(directory):
+    """Opens the editor on a private copy of the cold document."""
+    Gtk = load_gtk()
+    if Gtk is None:
+        return None, None
+    from scripts import editor
+    path = os.path.join(directory, "editor", "configuration.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copyfile(os.path.join(directory, "cold", "configuration.json"), path)
+    return Gtk, editor.TreeEditorWindow(Session(), path)
+
+def _run_task(Gtk, window, start):
+    """Times `start()` until the background task it started ends."""
+    def run():
+        start()
+        while window.task is not None:
+            Gtk.main_iteration_do(True)
+    return run
+
+def case_editor_load(shape, size, directory, repeat):
+    Gtk, window = _open_editor(directory)
+    if window is None:
+        return None
+    # The load itself, without the prompt about unsaved edits
+    return best_time(_run_task(Gtk, window, window.reload_document), repeat)
+
+def case_editor_save(shape, size, directory, repeat):
+    Gtk, window = _open_editor(directory)
+    if window is None:
+        return None
+    node = window.model.first_child[ROOT]
+
+    def edit():
+        # An unchanged tree is not written, so every save has an edit to store
+        window.history.set_text(node, window.model.text[node] + "*")
+    return best_time(_run_task(Gtk, window, lambda: window.on_save_clicked(None)), repeat, edit)
+
+def run_case(case, shape, size, directory, repeat):
+    """Entry point of a case process; returns its result record."""
+    seconds = globals()["case_" + case](shape, size, directory, repeat)
+    record = {"shape": shape, "nodes": size, "case": case}
+    if seconds is None:
+        record["skipped"] = "GTK or a display is not available"
+    else:
+        record["seconds"] = seconds
+        record["peak_rss_mb"] = peak_rss_mb()
+    return record
+
+def in_fresh_process(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(func, *args).result()
+
+# ------------------------------------------------------------------
+#  Headless display
+# ------------------------------------------------------------------
+def ensure_display():
+    """Provides a display for the GTK cases; returns a server to stop, if any."""
+    if os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY") \
+            or os.environ.get("GDK_BACKEND"):
+        return None
+    if shutil.which("xvfb-run") and not os.environ.get("TREE_BENCH_XVFB"):
+        os.environ["TREE_BENCH_XVFB"] = "1"
+        os.execvp("xvfb-run", ["xvfb-run", "-a", sys.executable] + sys.argv)
+    if shutil.which("broadwayd"):
+        server = subprocess.Popen(["broadwayd", ":9"], stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        os.environ["GDK_BACKEND"] = "broadway"
+        os.environ["BROADWAY_DISPLAY"] = ":9"
+        time.sleep(0.5)
+        return server
+    return None
+
+# ------------------------------------------------------------------
+#  Reporting
+# ------------------------------------------------------------------
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_record(record):
+    label = f"{record['shape']:>10} {record['nodes']:>9} {record['case']:>16}"
+    if "skipped" in record:
+        print(f"{label}   skipped ({record['skipped']})")
+        return
+    rss = record.get("peak_rss_mb")
+    rss = f"{rss:9.1f} MB" if rss is not None else "      n/a"
+    print(f"{label} {record['seconds']:>10.4f}s {rss}")
+
+def check_warm_start(results):
+    """Counts documents whose cached load was not faster than parsing."""
+    seconds = {(r["shape"], r["nodes"], r["case"]): r.get("seconds") for r in results}
+    failures = 0
+    for (shape, nodes, case), warm in seconds.items():
+        cold = seconds.get((shape, nodes, "load"))
+        if case == "warm_load" and warm is not None and cold is not None and warm >= cold:
+            print(f"REGRESSION: warm start not faster than cold for {shape} {nodes}")
+            failures += 1
+    return failures
+
+def compare(results, baseline_path, threshold):
+    """Prints the change against a baseline; returns the number of regressions.
+
+    A case regresses when its time or its peak RSS grew by more than `threshold`.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["shape"], r["nodes"], r["case"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    regressions = 0
+    for record in results:
+        previous = old.get((record["shape"], record["nodes"], record["case"]), {})
+        before = previous.get("seconds")
+        after = record.get("seconds")
+        if before is None or after is None:
+            continue
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + threshold and after > NOISE_FLOOR:
+            flag = "  REGRESSION"
+        rss_before = previous.get("peak_rss_mb")
+        rss_after = record.get("peak_rss_mb")
+        memory = ""
+        if rss_before is not None and rss_after is not None:
+            memory = f" {rss_before:>9.1f} -> {rss_after:>9.1f} MB"
+            if rss_after > rss_before * (1 + threshold) and rss_after - rss_before > RSS_NOISE_MB:
+                flag += "  MEMORY REGRESSION"
+        regressions += bool(flag)
+        print(f"{record['shape']:>10} {record['nodes']:>9} {record['case']:>16} "
+              f"{before:>10.4f}s -> {after:>10.4f}s {ratio:>6.2f}x{memory}{flag}")
+    return regressions
+
+# ------------------------------------------------------------------
+#  Entry point
+# ------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tree-Document-Editor benchmark suite.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES))
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs per case; the fastest is reported")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="results file from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown ratio above which a case is a regression")
+    args = parser.parse_args(argv)
+
+    server = ensure_display() if set(args.cases) & set(GTK_CASES) else None
+    results = []
+    try:
+        print(f"{'shape':>10} {'nodes':>9} {'case':>16} {'time':>11} {'peak RSS':>12}")
+        for shape in args.shapes:
+            for size in args.sizes:
+                with tempfile.TemporaryDirectory() as directory:
+                    document = in_fresh_process(prepare, shape, size, directory)
+                    for case in args.cases:
+                        record = in_fresh_process(run_case, case, shape, size,
+                                                  directory, max(1, args.repeat))
+                        record.update(document)
+                        results.append(record)
+                        print_record(record)
+    finally:
+        if server is not None:
+            server.terminate()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(),
+                       "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "results": results}, f, indent=4)
+    failures = check_warm_start(results)
+    if args.compare:
+        failures += compare(results, args.compare, args.threshold)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Compact subtree encoding for cut, copy and paste.
+
+A copied branch is held as its texts in pre-order plus an array of depths,
+which is far smaller than the {"text", "children"} dict tree and is turned
+back into nodes with a single TreeModel.create_branch() call. The bodies of
+the copied nodes are kept by pre-order index.
+"""
+from array import array
+
+from scripts.tree_model import NONE
+
+
+class SubtreeClip:
+    """Pre-order texts and relative depths of one copied branch."""
+
+    __slots__ = ("texts", "depths", "bodies")
+
+    def __init__(self, texts, depths, bodies=None):
+        self.texts = texts
+        self.depths = depths
+        # Pre-order index -> body key, or whatever from_model() got for it
+        self.bodies = bodies if bodies is not None else {}
+
+    @classmethod
+    def from_model(cls, model, node, body=None):
+        """Copies the branch at `node`.
+
+        Bodies are kept as their keys, or as `body(key)` if given, e.g. the
+        body texts for a clip that may outlive the document's content store.
+        """
+        texts = []
+        depths = array("i")
+        bodies = {}
+        body_keys = model.body_keys
+        text = model.text
+        first_child = model.first_child
+        next_sibling = model.next_sibling
+        # The top node's siblings are not part of the copy
+        texts.append(text[node])
+        depths.append(0)
+        if node in body_keys:
+            bodies[0] = body_keys[node]
+        stack = [(first_child[node], 1)]
+        while stack:
+            child, depth = stack.pop()
+            while child != NONE:
+                if body_keys and child in body_keys:
+                    bodies[len(texts)] = body_keys[child]
+                texts.append(text[child])
+                depths.append(depth)
+                if first_child[child] != NONE:
+                    stack.append((next_sibling[child], depth))
+                    stack.append((first_child[child], depth + 1))
+                    break
+                child = next_sibling[child]
+        if body is not None:
+            bodies = {index: body(key) for index, key in bodies.items()}
+        return cls(texts, depths, bodies)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def build(self, model, link=None):
+        """Creates a detached copy of the branch in `model`; returns its top.
+
+        The copied nodes get their body keys back, or `link(body)` for what
+        from_model() kept of their bodies if given.
+        """
+        top = model.create_branch(self.texts, self.depths)
+        if self.bodies:
+            bodies = self.bodies
+            # Detached nodes are linked silently; attaching them reports the
+            # keys along with the rest of the branch
+            for index, node in enumerate(model.iter_subtree(top)):
+                if index in bodies:
+                    model.body_keys[node] = link(bodies[index]) if link else bodies[index]
+        return top
@@ -0,0 +1,109 @@
+"""
+Out-of-line storage for node bodies.
+
+Long body texts are kept in an SQLite file next to the document instead of in
+the tree, so loading the tree costs the same whether or not nodes have
+bodies. A body is read when its node is selected and kept in an LRU cache
+bounded by a byte budget.
+"""
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+
+class ContentStore:
+    """Node bodies keyed by integer content keys, see TreeModel.body_keys."""
+
+    def __init__(self, document_path, budget=8 * 1024 * 1024):
+        self.path = document_path + ".bodies"
+        self.budget = budget
+        self._db = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+
+    def _connection(self):
+        # Opened on first use so documents without bodies never touch SQLite
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS bodies "
+                             "(key INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self._cache.clear()
+        self._cached_bytes = 0
+
+    # ------------------------------------------------------------------
+    #  LRU cache
+    # ------------------------------------------------------------------
+    def _remember(self, key, body):
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cached_bytes -= sys.getsizeof(old)
+        self._cache[key] = body
+        self._cached_bytes += sys.getsizeof(body)
+        self.trim()
+
+    def trim(self):
+        """Evicts least recently used bodies until the cache fits the budget."""
+        while self._cached_bytes > self.budget and self._cache:
+            _, body = self._cache.popitem(last=False)
+            self._cached_bytes -= sys.getsizeof(body)
+
+    @property
+    def cached_bytes(self):
+        return self._cached_bytes
+
+    # ------------------------------------------------------------------
+    #  Access
+    # ------------------------------------------------------------------
+    def get(self, key):
+        """Returns the body stored under `key`, or "" if there is none."""
+        body = self._cache.get(key)
+        if body is not None:
+            self._cache.move_to_end(key)
+            return body
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT body FROM bodies WHERE key = ?", (key,)).fetchone()
+        body = row[0] if row else ""
+        self._remember(key, body)
+        return body
+
+    def put(self, key, body):
+        """Stores `body` under `key`, or under a new key if key is None.
+
+        Each call is its own transaction; returns the key.
+        """
+        with self._lock:
+            db = self._connection()
+            with db:
+                if key is None:
+                    key = db.execute("INSERT INTO bodies (body) VALUES (?)", (body,)).lastrowid
+                else:
+                    db.execute("INSERT OR REPLACE INTO bodies (key, body) VALUES (?, ?)",
+                               (key, body))
+        self._remember(key, body)
+        return key
+
+    def retain(self, keys):
+        """Deletes the bodies whose keys are not in the set `keys`; returns how many."""
+        if self._db is None and not os.path.exists(self.path):
+            return 0
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute("CREATE TEMP TABLE IF NOT EXISTS live (key INTEGER PRIMARY KEY)")
+                db.execute("DELETE FROM live")
+                db.executemany("INSERT OR IGNORE INTO live VALUES (?)", ((key,) for key in keys))
+                deleted = db.execute(
+                    "DELETE FROM bodies WHERE key NOT IN (SELECT key FROM live)").rowcount
+        for key in [key for key in self._cache if key not in keys]:
+            self._cached_bytes -= sys.getsizeof(self._cache.pop(key))
+        return deleted
@@ -0,0 +1,83 @@
+"""
+Loading and saving tree documents without GTK.
+
+Both entry points accept an optional `task` with report(fraction) and check()
+methods (see background.BackgroundTask), so they can run on a worker thread
+with progress and cancellation. SQLite documents (see tree_sqlite) go through
+the same entry points as JSON ones.
+"""
+import os
+
+from scripts.tree_model import ROOT
+from scripts.tree_json import read_document, iter_document_chunks, iter_tree_chunks
+from scripts.tree_sqlite import is_sqlite, is_bare_sqlite, read_sqlite, write_sqlite
+from scripts import parallel_json
+from scripts.file_utils import atomic_write
+
+class _ProgressReader:
+    """File wrapper that reports read progress and checks for cancellation."""
+
+    def __init__(self, fp, size, task):
+        self._fp = fp
+        self._size = size or 1
+        self._task = task
+
+    def read(self, size=-1):
+        self._task.check()
+        data = self._fp.read(size)
+        self._task.report(self._fp.tell() / self._size)
+        return data
+
+def is_bare_document(path):
+    """True for a bare node array like tree.json rather than a configuration."""
+    if is_sqlite(path):
+        return is_bare_sqlite(path)
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                return char == "["
+
+def load_document(path, model, task=None, intern=None, validator=None):
+    """Streams the document at `path` into `model`; returns its non-tree keys.
+
+    Node texts go through `intern` if given, see string_pool.StringPool.
+    Malformed nodes are reported to `validator`, a tree_validation
+    LoadValidator, which repairs them by default.
+    """
+    if is_sqlite(path):
+        return read_sqlite(path, model, task, intern, validator)
+    with open(path, "r", encoding="utf-8") as f:
+        if task is not None:
+            f = _ProgressReader(f, os.path.getsize(path), task)
+        return read_document(f, model, intern=intern, validator=validator)
+
+def save_document(path, model, extra, indent=4, task=None, bare=False, workers=1):
+    """Atomically writes `model` and the `extra` keys to `path`.
+
+    With bare=True only the node array is written, as in tree.json. If the
+    task is cancelled the temporary file is discarded and `path` is left
+    untouched. With workers > 1 a large document is encoded by that many
+    processes, see parallel_json; the bytes written are the same.
+
+    An SQLite document is rewritten as a whole here; an open SqliteDocument
+    saves edits as they happen instead.
+    """
+    if is_sqlite(path):
+        write_sqlite(path, model, extra, bare, task)
+        return
+    total = len(model) or 1
+    progress = None
+    if task is not None:
+        def progress(written):
+            task.check()
+            task.report(written / total)
+    with atomic_write(path) as f:
+        if workers > 1 and len(model) >= parallel_json.PARALLEL_MIN_NODES:
+            chunks = parallel_json.iter_parallel_chunks(model, extra, indent, bare, workers, progress)
+        elif bare:
+            chunks = iter_tree_chunks(model, ROOT, indent, 0, progress)
+        else:
+            chunks = iter_document_chunks(model, extra, indent, progress)
+        for chunk in chunks:
+            f.write(chunk)
@@ -1,35 +1,152 @@
+import time
+_STARTED = time.perf_counter()
+
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
-import json
+from gi.repository import Gtk, Gdk, GLib
+import copy
+import itertools
+import logging
 import os
 import sys
+import threading
 
-# Add the 'data' directory to the Python path
+# Ensure the project root and the 'data' directory are on the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data')))
 
 from temporary import CONFIG_FILE
-from scripts.tree_utils import serialize_tree, deserialize_tree
+from scripts.tree_model import ROOT, NONE, TreeModel
+from scripts.document_io import load_document, save_document, is_bare_document
+from scripts.background import BackgroundTask, Cancelled
+from scripts.journal import EditJournal, JournalError, GENERATION_KEY
+from scripts.search_index import SearchIndex, build_postings
+from scripts.undo import UndoHistory
+from scripts.clipboard import SubtreeClip
+from scripts.session import Session
+from scripts.content_store import ContentStore
+from scripts.tree_sqlite import SqliteDocument, is_sqlite
+from scripts.tree_view import StoreView, TEXT_COLUMN, NODE_COLUMN
+from scripts.focus_view import FocusView
+from scripts.profiling import Profiler
+from scripts.tree_hash import SubtreeHashes, HASH_KEY, diff_trees, format_difference
+from scripts.tree_validation import LoadValidator
+from scripts.tree_merge import LocalChanges, diff_ops, apply_ops
+from scripts.file_watch import FileWatcher
+from scripts.parallel_json import default_workers
+from scripts.view_state import VIEW_KEY, make_state, in_document_order, restorable
+from scripts.tree_formats import EXPORTERS, IMPORTERS, format_for, export_document, import_document
+from scripts.snapshot_cache import is_fresh, load_cached, store_cache, discard_cache, source_key
+from scripts.startup_timer import StartupTimer, timing_enabled
+
+# Drag-and-drop target for moving rows within the tree
+DRAG_TARGET = "TREE_DOCUMENT_NODE"
+
+logger = logging.getLogger(__name__)
+
+startup = StartupTimer(_STARTED)
+startup.mark("import")
 
 class TreeEditorWindow(Gtk.Window):
 
-    def __init__(self):
+    def __init__(self, session, path=CONFIG_FILE):
         Gtk.Window.__init__(self, title="Jules-Tree-Document-Editor")
         self.set_default_size(600, 400)
+        # Documents open in this process share the string pool and clipboard
+        self.session = session
+        self.path = path
+        # tree.json-style documents are a bare node array without settings
+        self.bare = False
+        if path != CONFIG_FILE:
+            self.set_title(f"{os.path.basename(path)} - Jules-Tree-Document-Editor")
+        session.add(self)
 
         self.grid = Gtk.Grid()
         self.add(self.grid)
 
-        # Create a TreeStore
-        self.treestore = Gtk.TreeStore(str)
+        # Create the tree model and the TreeStore that views it
+        self.model = TreeModel()
+        self.view = StoreView(self.model)
+        self.treestore = self.view.store
+        # Opt-in timing of the handlers below, see profiling
+        self.profiler = Profiler(self.path, self.model)
+        self.profiler.listener = self.on_profile_record
+        for name in ("on_load_clicked", "on_save_clicked", "on_add_clicked",
+                     "on_remove_clicked", "on_text_edited"):
+            setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        self._draw_start = None
+        # Non-tree parts of the configuration file, such as "settings"
+        self.config_data = {"settings": {}}
+        # Save or load currently running on a worker thread
+        self.task = None
+        # Every edit is journalled; saves compact the journal into a snapshot.
+        # An SQLite document instead writes each edit straight to its rows.
+        self.journal = EditJournal(self.path)
+        self.database = SqliteDocument(self.path) if is_sqlite(self.path) else None
+        if self.database is not None:
+            self.model.observers.append(self.database)
+        else:
+            self.model.observers.append(self.journal)
+        self.last_snapshot = time.monotonic()
+        # Full-text index, built on the first search and updated on every edit
+        self.search_index = SearchIndex(self.model)
+        self.search_results = []
+        self.search_position = 0
+        # Edits go through the undo history, which applies them to the model
+        self.history = UndoHistory(self.model)
+        # Subtree digests tell whether the tree differs from the saved one
+        self.hashes = SubtreeHashes(self.model)
+        # Root digest stored in the file, None for a file saved without one
+        self.saved_hash = None
+        # hashes.version of the tree as loaded or saved, None while it differs
+        # from the file
+        self.saved_version = None
+        # Size and mtime of the file when it was last loaded or saved
+        self.disk_source = None
+        # The tree as last loaded or saved and the edits made here since, to
+        # merge what other programs save to the file; not kept for SQLite
+        self.base = None
+        self.base_hashes = None
+        self.local = LocalChanges()
+        self.model.observers.append(self.local)
+        # Node bodies live out of line and are read when a node is selected
+        self.content = ContentStore(self.path)
+        self.body_node = NONE
         self.treeview = Gtk.TreeView(model=self.treestore)
+        self.view.connect_treeview(self.treeview)
+        self.treeview.connect("key-press-event", self.on_tree_key_press)
+        self.treeview.get_selection().connect("changed", self.on_selection_changed)
+        self.treeview.connect("draw", self.on_tree_draw)
+        self.treeview.connect_after("draw", self.on_tree_drawn)
+        # Hoisting and filtering show a filter over the store instead of it
+        self.focus = FocusView(self.view, self.treeview, self.search_index)
+        self.focus_button = Gtk.Button(label="Focus")
+        self.focus_button.connect("clicked", self.on_focus_clicked)
+        # Live filter of the focused branch
+        self.filter_entry = Gtk.SearchEntry()
+        self.filter_entry.set_placeholder_text("Filter")
+        self.filter_entry.connect("search-changed", self.on_filter_changed)
+
+        # Body of the selected node
+        self.body_view = Gtk.TextView()
+        self.body_view.set_wrap_mode(Gtk.WrapMode.WORD_CHAR)
+        self.body_view.set_sensitive(False)
+        self.body_view.connect("focus-out-event", lambda *args: self.commit_body())
+
+        # Dragging a row moves its whole branch in one model operation
+        targets = [Gtk.TargetEntry.new(DRAG_TARGET, Gtk.TargetFlags.SAME_WIDGET, 0)]
+        self.treeview.enable_model_drag_source(Gdk.ModifierType.BUTTON1_MASK, targets,
+                                               Gdk.DragAction.MOVE)
+        self.treeview.enable_model_drag_dest(targets, Gdk.DragAction.MOVE)
+        self.treeview.connect("drag-data-get", self.on_drag_data_get)
+        self.treeview.connect("drag-data-received", self.on_drag_data_received)
 
         # Create a TreeViewColumn
         renderer_text = Gtk.CellRendererText()
         renderer_text.set_property("editable", True)
         renderer_text.connect("edited", self.on_text_edited)
 
-        column = Gtk.TreeViewColumn("Tree", renderer_text, text=0)
+        column = Gtk.TreeViewColumn("Tree", renderer_text, text=TEXT_COLUMN)
         self.treeview.append_column(column)
 
         # Load initial data
@@ -51,60 +168,929 @@ class TreeEditorWindow(Gtk.Window):
         self.load_button = Gtk.Button(label="Load")
         self.load_button.connect("clicked", self.on_load_clicked)
 
+        self.open_button = Gtk.Button(label="Open")
+        self.open_button.connect("clicked", self.on_open_clicked)
+
+        self.import_button = Gtk.Button(label="Import")
+        self.import_button.connect("clicked", self.on_import_clicked)
+
+        self.export_button = Gtk.Button(label="Export")
+        self.export_button.connect("clicked", self.on_export_clicked)
+
+        self.memory_button = Gtk.Button(label="Memory")
+        self.memory_button.connect("clicked", self.on_memory_clicked)
+
+        self.cut_button = Gtk.Button(label="Cut")
+        self.cut_button.connect("clicked", self.on_cut_clicked)
+
+        self.copy_button = Gtk.Button(label="Copy")
+        self.copy_button.connect("clicked", self.on_copy_clicked)
+
+        self.paste_button = Gtk.Button(label="Paste")
+        self.paste_button.connect("clicked", self.on_paste_clicked)
+
+        self.undo_button = Gtk.Button(label="Undo")
+        self.undo_button.connect("clicked", self.on_undo_clicked)
+
+        self.redo_button = Gtk.Button(label="Redo")
+        self.redo_button.connect("clicked", self.on_redo_clicked)
+
+        # Keyboard shortcuts
+        accel_group = Gtk.AccelGroup()
+        self.add_accel_group(accel_group)
+        self.undo_button.add_accelerator("clicked", accel_group, Gdk.KEY_z,
+                                         Gdk.ModifierType.CONTROL_MASK, Gtk.AccelFlags.VISIBLE)
+        self.redo_button.add_accelerator("clicked", accel_group, Gdk.KEY_z,
+                                         Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK,
+                                         Gtk.AccelFlags.VISIBLE)
+        self.redo_button.add_accelerator("clicked", accel_group, Gdk.KEY_y,
+                                         Gdk.ModifierType.CONTROL_MASK, Gtk.AccelFlags.VISIBLE)
+
+        # Search
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text("Search")
+        self.search_entry.connect("activate", self.on_search_activate)
+        self.search_entry.connect("search-changed", self.on_search_changed)
+        self.search_entry.connect("next-match", self.on_search_activate)
+        self.search_label = Gtk.Label()
+
+        # Progress of background saves and loads, hidden while idle
+        self.progress_bar = Gtk.ProgressBar()
+        self.progress_bar.set_show_text(True)
+        self.progress_bar.set_no_show_all(True)
+
+        self.cancel_button = Gtk.Button(label="Cancel")
+        self.cancel_button.connect("clicked", self.on_cancel_clicked)
+        self.cancel_button.set_no_show_all(True)
+
         # Layout
+        self.grid.attach(self.search_entry, 0, 0, 2, 1)
+        self.grid.attach(self.search_label, 2, 0, 1, 1)
+        self.grid.attach(self.filter_entry, 3, 0, 2, 1)
+        self.grid.attach(self.focus_button, 5, 0, 1, 1)
+        self.grid.attach(self.import_button, 6, 0, 1, 1)
+        self.grid.attach(self.export_button, 7, 0, 1, 1)
+        self.grid.attach(self.open_button, 8, 0, 1, 1)
+        self.grid.attach(self.memory_button, 9, 0, 1, 1)
+
         self.scrollable_treelist = Gtk.ScrolledWindow()
         self.scrollable_treelist.set_vexpand(True)
-        self.grid.attach(self.scrollable_treelist, 0, 0, 5, 1)
         self.scrollable_treelist.add(self.treeview)
 
-        self.grid.attach(self.add_button, 0, 1, 1, 1)
-        self.grid.attach(self.remove_button, 1, 1, 1, 1)
-        self.grid.attach(self.edit_button, 2, 1, 1, 1)
-        self.grid.attach(self.save_button, 3, 1, 1, 1)
-        self.grid.attach(self.load_button, 4, 1, 1, 1)
+        self.scrollable_body = Gtk.ScrolledWindow()
+        self.scrollable_body.add(self.body_view)
+
+        # Latest timings, shown over the tree with the profile_overlay setting
+        self.profile_label = Gtk.Label()
+        self.profile_label.set_halign(Gtk.Align.END)
+        self.profile_label.set_valign(Gtk.Align.START)
+        self.profile_label.set_no_show_all(True)
+        self.tree_overlay = Gtk.Overlay()
+        self.tree_overlay.add(self.scrollable_treelist)
+        self.tree_overlay.add_overlay(self.profile_label)
+        self.tree_overlay.set_overlay_pass_through(self.profile_label, True)
+
+        self.paned = Gtk.Paned(orientation=Gtk.Orientation.VERTICAL)
+        self.paned.pack1(self.tree_overlay, True, False)
+        self.paned.pack2(self.scrollable_body, False, True)
+        self.paned.set_position(280)
+        self.grid.attach(self.paned, 0, 1, 10, 1)
 
+        self.grid.attach(self.add_button, 0, 2, 1, 1)
+        self.grid.attach(self.remove_button, 1, 2, 1, 1)
+        self.grid.attach(self.edit_button, 2, 2, 1, 1)
+        self.grid.attach(self.cut_button, 3, 2, 1, 1)
+        self.grid.attach(self.copy_button, 4, 2, 1, 1)
+        self.grid.attach(self.paste_button, 5, 2, 1, 1)
+        self.grid.attach(self.undo_button, 6, 2, 1, 1)
+        self.grid.attach(self.redo_button, 7, 2, 1, 1)
+        self.grid.attach(self.save_button, 8, 2, 1, 1)
+        self.grid.attach(self.load_button, 9, 2, 1, 1)
+        self.grid.attach(self.progress_bar, 0, 3, 9, 1)
+        self.grid.attach(self.cancel_button, 9, 3, 1, 1)
 
-        self.connect("destroy", Gtk.main_quit)
+
+        self.connect("delete-event", self.on_delete_event)
+        self.connect("destroy", self.on_destroy)
+        self._first_draw = self.connect("draw", self.on_first_draw)
+        self._journal_timer = GLib.timeout_add_seconds(1, self.on_journal_tick)
+        self.watcher = FileWatcher(self.path, self.on_file_changed) \
+            if self.database is None else None
+        startup.mark("window")
 
     def load_initial_data(self):
-        """Loads the initial tree data and ensures all nodes are collapsed."""
-        self.on_load_clicked(None)  # Load the data
-        self.treeview.collapse_all()  # Collapse all nodes
-
-    def on_save_clicked(self, button):
-        tree_data = serialize_tree(self.treestore)
-        # Preserve existing settings
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r") as f:
-                config_data = json.load(f)
-        else:
-            config_data = {"settings": {}} # Default if file doesn't exist
+        """Loads the initial tree data and restores the saved expanded rows."""
+        # The window is not shown yet, so this load runs synchronously
+        if os.path.exists(self.path):
+            loaded = TreeModel()
+            validator = LoadValidator()
+            source = source_key(self.path)
+            # Every edit changes an SQLite document, so it never has a cache
+            cached = self.database is None and is_fresh(self.path)
+            startup.mark("config read")
+            self.bare = is_bare_document(self.path)
+            if cached:
+                config_data = load_cached(self.path, loaded)
+            else:
+                config_data = load_document(self.path, loaded, intern=self.session.pool.intern,
+                                            validator=validator)
+            startup.mark("parse")
+            # Replay edits the loaded model, so the cache is written from a
+            # copy; the copy is also the merge base, as it is what is on disk
+            base = loaded.copy() if self.database is None else None
+            if not cached and self.database is None \
+                    and config_data.get("settings", {}).get("warm_start_cache", True):
+                threading.Thread(target=store_cache, args=(
+                    self.path, base, copy.deepcopy(config_data), source)).start()
+            # Recover edits made after the last snapshot; they are not on disk,
+            # so they count as local changes when merging the file
+            replayed = LocalChanges()
+            loaded.observers.append(replayed)
+            try:
+                self.journal.replay(loaded, config_data.get(GENERATION_KEY, 0))
+            except JournalError as e:
+                self.show_warning("Could not replay the edit journal.", [str(e)])
+            loaded.observers.remove(replayed)
+            self.finish_load((loaded, config_data), base, replayed.reset())
+            self.report_load_problems(validator)
+        startup.mark("model build")
+
+    def on_first_draw(self, widget, context):
+        self.disconnect(self._first_draw)
+        # Only the first window of the process is part of startup
+        if not startup.finished:
+            startup.mark("first paint")
+            if timing_enabled(self.settings):
+                startup.report()
+            startup.finished = True
+        return False
 
-        config_data["tree"] = tree_data
+    @property
+    def settings(self):
+        return self.config_data.setdefault("settings", {})
 
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(config_data, f, indent=4)
+    def on_save_clicked(self, button, overwrite=False):
+        # Settings were cached at load, so only the tree is serialized here.
+        # The worker writes a snapshot, so editing can continue meanwhile.
+        # `overwrite` replaces changes made on disk without asking.
+        if self.task is not None:
+            return
+        self.commit_body()
+        view_state = self.capture_view_state()
+        if self.database is not None:
+            # The nodes were saved as they were edited; only settings remain
+            self.config_data[VIEW_KEY] = view_state
+            self.database.save_extra(self.config_data)
+            self.last_snapshot = time.monotonic()
+            return
+        if self.disk_changed():
+            # Autosaves (button is None) never overwrite another program's
+            # changes; they merge them in and save the result afterwards
+            if button is None:
+                self.merge_from_disk()
+                return
+            if not overwrite:
+                self.confirm_overwrite()
+                return
+        elif self.hashes.version == self.saved_version and self.saved_hash is not None and (
+                self.bare or view_state == self.config_data.get(VIEW_KEY)):
+            # Nothing to write; any journalled edits cancel each other out
+            self.journal.reset(self.config_data.get(GENERATION_KEY, 0))
+            self.last_snapshot = time.monotonic()
+            return
+        indent = None if self.settings.get("compact_json") else 4
+        # 0 uses every core; only large documents are encoded in parallel
+        workers = self.settings.get("save_workers", 0) or default_workers()
+        snapshot = self.model.copy()
+        # The worker hashes the nodes edited since the last save; the snapshot
+        # is the merge base once it is on disk
+        snapshot_hashes = self.hashes.begin_refresh(snapshot)
+        version = self.hashes.version
+        saved_hash = self.saved_hash
+        view_saved = self.bare or view_state == self.config_data.get(VIEW_KEY)
+        changes = self.local.reset()
+        config_data = copy.deepcopy(self.config_data)
+        # Edits made from here on go to a fresh journal on top of this snapshot
+        generation = self.journal.rotate()
+        config_data[GENERATION_KEY] = generation
+        # The cache keeps the snapshot's ids; the file is numbered as it will load
+        config_data[VIEW_KEY] = view_state
+
+        def work(task):
+            tree_hash = snapshot_hashes.hex()
+            if tree_hash == saved_hash and view_saved:
+                # The edits cancel each other out
+                return None, tree_hash
+            config_data[HASH_KEY] = tree_hash
+            document_data = config_data
+            if not self.bare:
+                document_data = dict(config_data)
+                document_data[VIEW_KEY] = in_document_order(snapshot, view_state)
+            save_document(self.path, snapshot, document_data, indent, task, self.bare, workers)
+            source = source_key(self.path)
+            # The saved snapshot becomes the warm-start cache for the next launch
+            if config_data["settings"].get("warm_start_cache", True):
+                store_cache(self.path, snapshot, config_data, source)
+            else:
+                discard_cache(self.path)
+            return source, tree_hash
+
+        def saved(result):
+            source, tree_hash = result
+            self.hashes.finish_refresh(snapshot_hashes)
+            self.saved_version = version
+            self.last_snapshot = time.monotonic()
+            if source is None:
+                # Nothing was written, so the file is still the merge base
+                self.journal.abort_rotation()
+                self.local.restore(changes)
+                return
+            self.config_data[GENERATION_KEY] = generation
+            self.config_data[HASH_KEY] = tree_hash
+            self.config_data[VIEW_KEY] = view_state
+            self.saved_hash = tree_hash
+            self.disk_source = source
+            self.base, self.base_hashes = snapshot, snapshot_hashes
+            self.journal.commit_rotation()
+
+        def failed():
+            self.journal.abort_rotation()
+            self.local.restore(changes)
+        self.start_task("Saving", work, saved, failed)
+
+    def disk_changed(self):
+        """True if another program wrote the file since it was loaded or saved."""
+        return self.disk_source is not None and os.path.exists(self.path) \
+            and source_key(self.path) != self.disk_source
+
+    def confirm_overwrite(self):
+        """Asks whether saving may replace the changes made on disk, and
+        saves if so.
+
+        The file is read and compared with a copy of the tree on a worker
+        thread; the question is asked once that is done.
+        """
+        snapshot = self.model.copy()
+        snapshot_hashes = self.hashes.copy(snapshot)
+
+        def work(task):
+            disk = TreeModel()
+            try:
+                load_document(self.path, disk, task, self.session.pool.intern)
+            except (OSError, ValueError) as e:
+                return f"The file on disk cannot be read: {e}"
+            differences = diff_trees(snapshot, snapshot_hashes, disk, SubtreeHashes(disk))
+            lines = [format_difference(entry) for entry in itertools.islice(differences, 21)]
+            if len(lines) > 20:
+                lines[20] = "..."
+            return "\n".join(lines) or "The tree on disk is the same; only the settings may differ."
+
+        def compared(details):
+            dialog = Gtk.MessageDialog(transient_for=self, message_type=Gtk.MessageType.WARNING,
+                                       buttons=Gtk.ButtonsType.OK_CANCEL,
+                                       text="The document was changed on disk. Overwrite it?")
+            dialog.format_secondary_markup("<tt>" + GLib.markup_escape_text(details) + "</tt>")
+            response = dialog.run()
+            dialog.destroy()
+            if response == Gtk.ResponseType.OK:
+                self.on_save_clicked(self.save_button, overwrite=True)
+        self.start_task("Comparing", work, compared)
+
+    def on_file_changed(self):
+        """Merges what another program saved to the file; True to retry later."""
+        if self.task is not None:
+            # Also our own save: it records the new file once it is done
+            return True
+        if self.disk_changed():
+            self.merge_from_disk()
+        return False
+
+    def merge_from_disk(self):
+        """Applies the changes saved to the file since it was last loaded or
+        saved here, keeping the local edit wherever both sides changed a node.
+
+        The file is read and compared on a worker thread while editing goes
+        on; only the subtrees that differ are then changed in the model, as
+        one undo step.
+        """
+        if self.task is not None or self.base is None:
+            return
+        self.commit_body()
+        base, base_hashes = self.base, self.base_hashes
+        validator = LoadValidator()
+
+        def work(task):
+            source = source_key(self.path)
+            theirs = TreeModel()
+            config_data = load_document(self.path, theirs, task, self.session.pool.intern,
+                                        validator)
+            their_hashes = SubtreeHashes(theirs)
+            ops = diff_ops(base, base_hashes, theirs, their_hashes, task)
+            return ops, config_data, their_hashes.hex(), source
+
+        def merged(result):
+            ops, config_data, their_hash, source = result
+            self.report_load_problems(validator)
+            applied, conflicts = apply_ops(ops, base, self.model, self.local, self.history)
+            if conflicts:
+                lines = conflicts[:20]
+                if len(conflicts) > len(lines):
+                    lines.append(f"... and {len(conflicts) - len(lines)} more")
+                self.show_warning(f"Kept the local version of {len(conflicts)} change(s) "
+                                  "that were also made in the file on disk.", lines)
+            if not self.bare:
+                # The view keeps its own expanded rows and selection
+                if VIEW_KEY in self.config_data:
+                    config_data[VIEW_KEY] = self.config_data[VIEW_KEY]
+                self.config_data = config_data
+            self.saved_hash = their_hash
+            self.config_data[HASH_KEY] = their_hash
+            self.disk_source = source
+            # The journal holds edits to the file as it was; the merged tree is
+            # saved below if it differs from the new file
+            self.journal.reset(config_data.get(GENERATION_KEY, 0))
+            self.config_data[GENERATION_KEY] = self.journal.generation
+            self.base = self.model.copy()
+            self.base_hashes = self.hashes.copy(self.base)
+            # With no local edits the tree is now the one in the file
+            unsaved = bool(self.local)
+            self.local.reset()
+            self.saved_version = None if unsaved else self.hashes.version
+            self.last_snapshot = time.monotonic()
+            if unsaved:
+                self.on_save_clicked(None)
+        self.start_task("Merging", work, merged)
 
     def on_load_clicked(self, button):
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r") as f:
-                config_data = json.load(f)
-            self.treestore.clear()
-            deserialize_tree(config_data.get("tree", []), self.treestore, None)
+        if self.disk_changed():
+            # Pick up the other program's changes without losing ours
+            self.merge_from_disk()
+            return
+        if self.has_unsaved_edits() and not self.confirm_revert():
+            return
+        self.reload_document()
+
+    def has_unsaved_edits(self):
+        """True if reloading would lose edits that are not in the file."""
+        if self.database is not None:
+            # Every edit was written to the database as it was made
+            return False
+        if self.hashes.version == self.saved_version:
+            return False
+        # Without recovered or undoable edits nothing was edited since the load
+        return bool(self.journal.entries) or self.history.can_undo()
+
+    def reload_document(self):
+        """Replaces the tree with the one in the file, on a worker thread."""
+        if os.path.exists(self.path):
+            validator = LoadValidator()
+
+            # Stream the nodes into a fresh model on the worker thread
+            def work(task):
+                loaded = TreeModel()
+                if self.database is None and is_fresh(self.path):
+                    return loaded, load_cached(self.path, loaded)
+                source = source_key(self.path)
+                config_data = load_document(self.path, loaded, task, self.session.pool.intern,
+                                            validator)
+                if self.database is None \
+                        and config_data.get("settings", {}).get("warm_start_cache", True):
+                    store_cache(self.path, loaded, config_data, source)
+                return loaded, config_data
+
+            def loaded(result):
+                # Reloading reverts to the file, dropping journalled edits
+                self.finish_load(result)
+                self.report_load_problems(validator)
+                self.journal.reset(self.config_data.get(GENERATION_KEY, 0))
+                self.last_snapshot = time.monotonic()
+            self.start_task("Loading", work, loaded, lock_view=True)
+
+    def confirm_revert(self):
+        """Asks whether reloading may discard the unsaved edits."""
+        dialog = Gtk.MessageDialog(transient_for=self, message_type=Gtk.MessageType.WARNING,
+                                   buttons=Gtk.ButtonsType.OK_CANCEL,
+                                   text="Discard the unsaved changes and reload the document?")
+        response = dialog.run()
+        dialog.destroy()
+        return response == Gtk.ResponseType.OK
+
+    def show_warning(self, text, details=()):
+        """Logs a warning and shows it without waiting for the user."""
+        logger.warning("%s: %s%s", self.path, text, "".join("\n  " + line for line in details))
+        dialog = Gtk.MessageDialog(transient_for=self, message_type=Gtk.MessageType.WARNING,
+                                   buttons=Gtk.ButtonsType.OK, text=text)
+        if details:
+            dialog.format_secondary_markup(
+                "<tt>" + GLib.markup_escape_text("\n".join(details)) + "</tt>")
+        dialog.connect("response", lambda dialog, response: dialog.destroy())
+        dialog.show()
+
+    def report_load_problems(self, validator):
+        """Warns about the malformed nodes that were repaired while loading."""
+        if validator.ok:
+            return
+        self.show_warning(f"Repaired {validator.count} problem(s) in the document.",
+                          validator.summary())
+        if self.database is not None:
+            # The stored rows are what is broken, so the repaired tree replaces them
+            self.database.rewrite(self.model)
+
+    def finish_load(self, result, base=None, changes=None):
+        """Shows the loaded tree. `base` is the tree as it is on disk, if that
+        differs from the loaded one, and `changes` what LocalChanges.reset()
+        returned for the difference."""
+        loaded, self.config_data = result
+        self.show_body(NONE)
+        self.leave_focus()
+        self.model.adopt(loaded)
+        self.hashes.invalidate()
+        self.local.reset()
+        if changes is not None:
+            self.local.restore(changes)
+        # One copy of the tree is indexed and hashed on a worker thread
+        snapshot = self.model.copy()
+        if self.database is None:
+            self.base = base if base is not None else snapshot
+            # Until then computed on the worker thread of the first merge
+            self.base_hashes = SubtreeHashes(self.base)
+        # Edits recovered from the journal count as changed until saved again;
+        # a file saved without a digest is written once more to add it
+        self.saved_hash = self.config_data.get(HASH_KEY)
+        self.saved_version = None if self.local else self.hashes.version
+        if self.database is None and os.path.exists(self.path):
+            self.disk_source = source_key(self.path)
+        # Bodies of nodes removed before the last save are no longer needed
+        self.content.retain(set(self.model.body_keys.values()))
+        self.content.budget = self.settings.get("body_cache_mb", 8) * 1024 * 1024
+        self.content.trim()
+        self.analyze_in_background(snapshot)
+        self.search_results = []
+        self.history.reset()
+        self.history.budget = self.settings.get("undo_budget_mb", 64) * 1024 * 1024
+        settings = self.settings
+        self.profiler.configure(settings)
+        self.update_profile_overlay()
+        # In lazy mode only the top-level rows are built here
+        self.view.lazy = settings.get("lazy_load", True)
+        self.view.release_collapsed = settings.get("release_collapsed", False)
+        self.view.populate()
+        self.restore_view_state()
+
+    def capture_view_state(self):
+        """Expanded rows and selection, as saved under VIEW_KEY."""
+        return make_state(self.view.expanded_nodes(), self.selected_node())
+
+    def restore_view_state(self):
+        """Expands the saved rows, leaving every other branch unloaded."""
+        expanded, selected = restorable(self.model, self.config_data.get(VIEW_KEY))
+        self.view.expand_nodes(expanded)
+        if selected != NONE:
+            self.reveal_node(selected)
+
+    # ------------------------------------------------------------------
+    #  Background tasks
+    # ------------------------------------------------------------------
+    def start_task(self, label, work, on_done=None, on_failed=None, lock_view=False):
+        """Runs `work(task)` on a worker thread while showing its progress.
+
+        `on_failed` runs on the main loop if the task raised or was cancelled;
+        with lock_view the tree cannot be edited until the task ends.
+        """
+        if self.task is not None:
+            return
+        self.progress_bar.set_text(label)
+        self.progress_bar.set_fraction(0.0)
+        self.progress_bar.show()
+        self.cancel_button.show()
+        self.set_busy(True, lock_view)
+        # Handlers return once the task started, so the task is timed on its own
+        work = self.profiler.wrap(f"{label} task", work)
+
+        def done(result):
+            self.end_task()
+            if on_done:
+                on_done(result)
+
+        def failed(error):
+            self.end_task()
+            if on_failed:
+                on_failed()
+            self.on_task_error(error)
+        self.task = BackgroundTask(work, done, failed,
+                                   self.progress_bar.set_fraction).start()
+
+    def set_busy(self, busy, lock_view=False):
+        self.save_button.set_sensitive(not busy)
+        self.load_button.set_sensitive(not busy)
+        for widget in (self.treeview, self.add_button, self.remove_button, self.edit_button,
+                       self.cut_button, self.copy_button, self.paste_button,
+                       self.undo_button, self.redo_button):
+            widget.set_sensitive(not (busy and lock_view))
+
+    def end_task(self):
+        self.task = None
+        self.progress_bar.hide()
+        self.cancel_button.hide()
+        self.set_busy(False)
+
+    def on_task_error(self, error):
+        if isinstance(error, Cancelled):
+            return
+        dialog = Gtk.MessageDialog(transient_for=self, message_type=Gtk.MessageType.ERROR,
+                                   buttons=Gtk.ButtonsType.OK, text=str(error))
+        dialog.run()
+        dialog.destroy()
+
+    def on_cancel_clicked(self, button):
+        if self.task is not None:
+            self.task.cancel()
+
+    def on_delete_event(self, widget, event):
+        # Let a running save finish rather than leaving it half done
+        if self.task is not None:
+            self.task.wait()
+        self.commit_body()
+        if self.database is not None:
+            # Cheap to store here; a JSON document keeps the state of its last save
+            self.config_data[VIEW_KEY] = self.capture_view_state()
+            self.database.save_extra(self.config_data)
+        self.journal.sync()
+        self.journal.close()
+        return False
+
+    def on_destroy(self, widget):
+        GLib.source_remove(self._journal_timer)
+        if self.watcher is not None:
+            self.watcher.close()
+        self.content.close()
+        if self.database is not None:
+            self.database.close()
+        self.profiler.close()
+        # Release this document's strings before the pool is swept
+        self.history.reset()
+        # An index still being built is not installed once the model is gone
+        self.search_index.invalidate()
+        self.model.clear()
+        if self.session.remove(self):
+            Gtk.main_quit()
+
+    def open_document(self, path):
+        """Shows `path` in its own window, or raises the window it is open in."""
+        window = self.session.find(path)
+        if window is None:
+            window = TreeEditorWindow(self.session, path)
+            window.show_all()
+        window.present()
+
+    def on_open_clicked(self, button):
+        dialog = Gtk.FileChooserDialog(title="Open Document", transient_for=self,
+                                       action=Gtk.FileChooserAction.OPEN)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                           Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
+        json_filter = Gtk.FileFilter()
+        json_filter.set_name("Tree documents")
+        json_filter.add_pattern("*.json")
+        json_filter.add_pattern("*.sqlite")
+        dialog.add_filter(json_filter)
+        response = dialog.run()
+        path = dialog.get_filename()
+        dialog.destroy()
+        if response == Gtk.ResponseType.OK and path:
+            self.open_document(path)
+
+    def on_export_clicked(self, button):
+        """Exports the focused branch, or the whole document, in a chosen format."""
+        if self.task is not None:
+            return
+        dialog = Gtk.FileChooserDialog(title="Export", transient_for=self,
+                                       action=Gtk.FileChooserAction.SAVE)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                           Gtk.STOCK_SAVE, Gtk.ResponseType.OK)
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name(os.path.splitext(os.path.basename(self.path))[0] + ".md")
+        for name, (extension, _) in EXPORTERS.items():
+            file_filter = Gtk.FileFilter()
+            file_filter.set_name(f"{name.capitalize()} (*{extension})")
+            file_filter.add_pattern("*" + extension)
+            dialog.add_filter(file_filter)
+        response = dialog.run()
+        path = dialog.get_filename()
+        dialog.destroy()
+        if response != Gtk.ResponseType.OK or not path:
+            return
+        if format_for(path) is None:
+            path += ".md"
+        snapshot = self.model.copy()
+        root = self.focus.root
+        title = os.path.basename(self.path) if root == ROOT else self.model.text[root]
+        self.start_task("Exporting", lambda task: export_document(
+            path, snapshot, title=title, task=task, node=root))
+
+    def on_import_clicked(self, button):
+        """Adds a Markdown or OPML outline as a new branch below the selection."""
+        if self.task is not None:
+            return
+        dialog = Gtk.FileChooserDialog(title="Import Outline", transient_for=self,
+                                       action=Gtk.FileChooserAction.OPEN)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                           Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
+        outline_filter = Gtk.FileFilter()
+        outline_filter.set_name("Outlines")
+        for extension in IMPORTERS:
+            outline_filter.add_pattern("*" + extension)
+        dialog.add_filter(outline_filter)
+        response = dialog.run()
+        path = dialog.get_filename()
+        dialog.destroy()
+        if response != Gtk.ResponseType.OK or not path:
+            return
+
+        def work(task):
+            # Parsed into a private model, then added as one branch
+            imported = TreeModel()
+            top = imported.append(ROOT, os.path.basename(path))
+            import_document(path, imported, top, self.session.pool.intern)
+            return SubtreeClip.from_model(imported, top)
+
+        def imported(clip):
+            parent = self.selected_node()
+            node = clip.build(self.model)
+            with self.history.transaction("Import"):
+                self.history.attach(node, self.focus.root if parent == NONE else parent)
+            self.reveal_node(node)
+        self.start_task("Importing", work, imported)
+
+    def on_memory_clicked(self, button):
+        dialog = Gtk.MessageDialog(transient_for=self, message_type=Gtk.MessageType.INFO,
+                                   buttons=Gtk.ButtonsType.OK, text="Memory usage")
+        dialog.format_secondary_markup(
+            "<tt>" + GLib.markup_escape_text(self.session.memory_report()) + "</tt>")
+        dialog.run()
+        dialog.destroy()
+
+    def on_journal_tick(self):
+        """Syncs the journal and compacts it into a snapshot when due."""
+        self.journal.sync()
+        interval = self.settings.get("autosave_interval", 300)
+        limit = self.settings.get("journal_compact_entries", 10000)
+        if self.journal.entries and self.task is None:
+            if self.journal.entries >= limit or (
+                    interval and time.monotonic() - self.last_snapshot >= interval):
+                self.on_save_clicked(None)
+        return True
+
+    # ------------------------------------------------------------------
+    #  Profiling
+    # ------------------------------------------------------------------
+    def on_tree_draw(self, widget, context):
+        if self.profiler.enabled:
+            self._draw_start = time.perf_counter()
+        return False
+
+    def on_tree_drawn(self, widget, context):
+        if self._draw_start is not None:
+            self.profiler.record("draw", time.perf_counter() - self._draw_start)
+            self._draw_start = None
+        return False
+
+    def on_profile_record(self, record):
+        # Records may come from a task's thread. Draws are not shown as they
+        # happen, since refreshing the overlay would draw the tree again.
+        if record["op"] != "draw":
+            GLib.idle_add(self.update_profile_overlay)
+
+    def update_profile_overlay(self):
+        if self.profiler.enabled and self.settings.get("profile_overlay"):
+            self.profile_label.set_markup(
+                "<tt>" + GLib.markup_escape_text(self.profiler.overlay_text()) + "</tt>")
+            self.profile_label.show()
+        else:
+            self.profile_label.hide()
+        return False
+
+    # ------------------------------------------------------------------
+    #  Search
+    # ------------------------------------------------------------------
+    def analyze_in_background(self, snapshot):
+        """Builds the search index and the subtree digests of `snapshot`, a copy
+        of the tree just loaded, on a worker thread."""
+        self.search_index.begin_build(snapshot)
+        hashes = self.hashes.begin_refresh(snapshot)
+
+        def analyze():
+            postings, vocabulary = build_postings(snapshot)
+            GLib.idle_add(self.on_search_indexed, snapshot, postings, vocabulary)
+            hashes.hex()
+            GLib.idle_add(self.on_hashed, snapshot, hashes)
+        threading.Thread(target=analyze, daemon=True).start()
+
+    def on_hashed(self, snapshot, hashes):
+        self.hashes.finish_refresh(hashes)
+        if self.base is snapshot:
+            self.base_hashes = hashes
+        return False
+
+    def on_search_indexed(self, snapshot, postings, vocabulary):
+        if self.search_index.finish_build(snapshot, postings, vocabulary):
+            # Run what was asked for while the index was being built
+            if self.focus.query:
+                self.focus.set_query(self.focus.query)
+            if self.search_label.get_text() == "Indexing...":
+                self.on_search_activate(self.search_entry)
+        return False
+
+    def on_search_changed(self, entry):
+        self.search_results = []
+        self.search_label.set_text("")
+
+    def on_search_activate(self, entry):
+        """Jumps to the next node matching the search text."""
+        if not self.search_index.built:
+            self.search_label.set_text("Indexing...")
+            return
+        if not self.search_results:
+            self.search_results = self.search_index.search(entry.get_text())
+            self.search_position = -1
+            if not self.search_results:
+                self.search_label.set_text("No matches")
+                return
+        # Results go stale when nodes are removed after the search ran
+        while self.search_results:
+            self.search_position = (self.search_position + 1) % len(self.search_results)
+            node = self.search_results[self.search_position]
+            if self.model.is_attached(node):
+                break
+            del self.search_results[self.search_position]
+            self.search_position -= 1
+        else:
+            self.search_label.set_text("No matches")
+            return
+        self.search_label.set_text(f"{self.search_position + 1} of {len(self.search_results)}")
+        self.reveal_node(node)
+
+    def reveal_node(self, node):
+        """Expands the ancestors of `node`, then selects and scrolls to it."""
+        path = self.focus.view_path(node)
+        if path is None:
+            # Hidden by the hoist or filter
+            self.leave_focus()
+            path = self.focus.view_path(node)
+        if path.get_depth() > 1:
+            parent_path = path.copy()
+            parent_path.up()
+            # Expanding materializes the rows on the way in lazy mode
+            self.treeview.expand_to_path(parent_path)
+        self.treeview.set_cursor(path, None, False)
+        self.treeview.scroll_to_cell(path, None, True, 0.5, 0.0)
 
     def on_text_edited(self, widget, path, text):
-        self.treestore[path][0] = text
+        node = self.treeview.get_model()[path][NODE_COLUMN]
+        self.history.set_text(node, self.session.pool.intern(text))
 
     def on_add_clicked(self, button):
-        selection = self.treeview.get_selection()
-        model, parent_iter = selection.get_selected()
-        self.treestore.append(parent_iter, ["New Node"])
+        parent = self.selected_node()
+        self.history.insert(self.focus.root if parent == NONE else parent, "New Node")
 
     def on_remove_clicked(self, button):
-        selection = self.treeview.get_selection()
-        model, tree_iter = selection.get_selected()
-        if tree_iter:
-            model.remove(tree_iter)
+        node = self.selected_node()
+        if node != NONE:
+            self.history.remove(node)
+
+    def selected_node(self):
+        """Node of the selected row, or NONE when nothing is selected."""
+        # The TreeView may show the store or a focus filter over it
+        model, tree_iter = self.treeview.get_selection().get_selected()
+        return model.get_value(tree_iter, NODE_COLUMN) if tree_iter else NONE
+
+    # ------------------------------------------------------------------
+    #  Focus
+    # ------------------------------------------------------------------
+    def on_focus_clicked(self, button):
+        """Hoists the selected branch, or returns to the whole document."""
+        if self.focus.root != ROOT:
+            self.focus.unhoist()
+        else:
+            node = self.selected_node()
+            if node == NONE:
+                return
+            self.focus.hoist(node)
+
+    def on_filter_changed(self, entry):
+        self.focus.set_query(entry.get_text())
+
+    def leave_focus(self):
+        self.focus.reset()
+        # Clearing the entry emits search-changed, which finds no query left
+        self.filter_entry.set_text("")
+
+    # ------------------------------------------------------------------
+    #  Node bodies
+    # ------------------------------------------------------------------
+    def on_selection_changed(self, selection):
+        self.commit_body()
+        self.show_body(self.selected_node())
+        # Also emitted when the focus swaps the TreeView's model
+        self.focus_button.set_label("Unfocus" if self.focus.root != ROOT else "Focus")
+
+    def show_body(self, node):
+        """Shows the body of `node` (NONE for none) in the body pane."""
+        self.body_node = node
+        key = self.model.body_keys.get(node)
+        buffer = self.body_view.get_buffer()
+        buffer.set_text(self.content.get(key) if key is not None else "")
+        buffer.set_modified(False)
+        self.body_view.set_sensitive(node != NONE)
+
+    def commit_body(self):
+        """Writes the body pane back to the content store if it was edited."""
+        buffer = self.body_view.get_buffer()
+        node = self.body_node
+        if node == NONE or not buffer.get_modified() or not self.model.is_alive(node):
+            return
+        buffer.set_modified(False)
+        body = buffer.get_text(buffer.get_start_iter(), buffer.get_end_iter(), False)
+        key = self.model.body_keys.get(node)
+        if key is None and not body:
+            return
+        new_key = self.content.put(key, body)
+        if key is None:
+            # Linking the body is a model edit, so the journal records it
+            self.model.set_body_key(node, new_key)
+
+    def copy_branch(self, node):
+        """The branch at `node` as a clip that holds its body texts, which
+        outlive the keys when pasted into another document or after a save."""
+        self.commit_body()
+        return SubtreeClip.from_model(self.model, node, self.content.get)
+
+    def on_copy_clicked(self, button):
+        node = self.selected_node()
+        if node != NONE:
+            self.session.clipboard = self.copy_branch(node)
+
+    def on_cut_clicked(self, button):
+        node = self.selected_node()
+        if node != NONE:
+            self.session.clipboard = self.copy_branch(node)
+            with self.history.transaction("Cut"):
+                self.history.remove(node)
+
+    def on_paste_clicked(self, button):
+        """Pastes the clipboard branch as the last child of the selection."""
+        if self.session.clipboard is None:
+            return
+        parent = self.selected_node()
+        # Every paste stores its own copy of the bodies
+        node = self.session.clipboard.build(self.model,
+                                            lambda body: self.content.put(None, body))
+        with self.history.transaction("Paste"):
+            self.history.attach(node, self.focus.root if parent == NONE else parent)
+        self.reveal_node(node)
+
+    def on_tree_key_press(self, widget, event):
+        # Handled on the tree rather than as window accelerators so that the
+        # usual shortcuts keep working inside the cell editor and search entry
+        if not event.state & Gdk.ModifierType.CONTROL_MASK:
+            return False
+        handler = {Gdk.KEY_x: self.on_cut_clicked,
+                   Gdk.KEY_c: self.on_copy_clicked,
+                   Gdk.KEY_v: self.on_paste_clicked}.get(Gdk.keyval_to_lower(event.keyval))
+        if handler is None:
+            return False
+        handler(None)
+        return True
+
+    def on_drag_data_get(self, treeview, context, selection, info, timestamp):
+        treeview.stop_emission_by_name("drag-data-get")
+        selection.set(selection.get_target(), 8, str(self.selected_node()).encode())
+
+    def on_drag_data_received(self, treeview, context, x, y, selection, info, timestamp):
+        # The TreeStore's own row drag would copy every row of the branch
+        treeview.stop_emission_by_name("drag-data-received")
+        node = int(selection.get_data().decode())
+        drop = treeview.get_dest_row_at_pos(x, y)
+        if drop:
+            path, position = drop
+            target = self.view.drop_target(self.focus.store_path(path), position)
+        else:
+            # Below the last row: the end of the focused branch
+            target = self.focus.root, NONE
+        moved = False
+        if target is not None and self.model.is_attached(node):
+            parent, before = target
+            if not self.model.is_ancestor(node, parent):
+                self.history.move(node, parent, before)
+                moved = True
+        Gtk.drag_finish(context, moved, False, timestamp)
+        if moved:
+            self.reveal_node(node)
+
+    def on_undo_clicked(self, button):
+        self.history.undo()
+
+    def on_redo_clicked(self, button):
+        self.history.redo()
 
     def on_edit_clicked(self, button):
         selection = self.treeview.get_selection()
@@ -116,12 +1102,13 @@ class TreeEditorWindow(Gtk.Window):
 
     def run(self):
         self.show_all()
-        # Collapse all nodes after showing the window
-        self.treeview.collapse_all()
         Gtk.main()
 
 if __name__ == "__main__":
-    # Ensure the script can find the 'data' module
-    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-    editor = TreeEditorWindow()
+    # Documents named on the command line open in windows of their own
+    session = Session()
+    paths = sys.argv[1:] or [CONFIG_FILE]
+    editor = TreeEditorWindow(session, paths[0])
+    for path in paths[1:]:
+        editor.open_document(path)
     editor.run()
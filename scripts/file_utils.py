@@ -0,0 +1,51 @@
+"""
+File helpers for the Tree-Document-Editor.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_write(path, mode="w", encoding="utf-8"):
+    """Writes `path` through a temporary file that replaces it on success.
+
+    The data is fsynced before the rename, so a crash mid-save leaves either
+    the old file or the complete new one, never a truncated file.
+    """
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".",
+                                     suffix=".tmp", dir=directory)
+    try:
+        if "b" in mode:
+            f = os.fdopen(fd, mode)
+        else:
+            f = os.fdopen(fd, mode, encoding=encoding)
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+def fsync_directory(directory):
+    """Makes a rename inside `directory` durable where the OS allows it."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,50 @@
+"""
+Notification of changes to an open document's file.
+
+A Gio.FileMonitor reports changes as the operating system sees them (inotify
+on Linux), so nothing is polled. A save usually shows up as several events,
+e.g. the writes to a temporary file and the rename over the document, so the
+callback only runs once the file has been quiet for a short delay.
+"""
+from gi.repository import Gio, GLib
+
+# Quiet time after the last event before the callback runs, in milliseconds
+SETTLE_MS = 200
+
+
+class FileWatcher:
+    """Calls `callback()` on the main loop after `path` was changed.
+
+    A callback returning True is busy and is called again after the delay.
+    """
+
+    def __init__(self, path, callback, delay=SETTLE_MS):
+        self.callback = callback
+        self.delay = delay
+        self._timer = None
+        self.monitor = Gio.File.new_for_path(path).monitor_file(
+            Gio.FileMonitorFlags.WATCH_MOVES, None)
+        self.monitor.connect("changed", self.on_changed)
+
+    def on_changed(self, monitor, file, other_file, event):
+        if event in (Gio.FileMonitorEvent.ATTRIBUTE_CHANGED,
+                     Gio.FileMonitorEvent.PRE_UNMOUNT, Gio.FileMonitorEvent.UNMOUNTED):
+            return
+        self.schedule()
+
+    def schedule(self):
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+        self._timer = GLib.timeout_add(self.delay, self._settled)
+
+    def _settled(self):
+        self._timer = None
+        if self.callback():
+            self.schedule()
+        return False
+
+    def close(self):
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+        self.monitor.cancel()
@@ -0,0 +1,185 @@
+"""
+Focus mode for the tree view: hoisting a branch and filtering it live.
+
+Both work through a Gtk.TreeModelFilter over the StoreView's store, never a
+copy of it. Hoisting uses the filter's virtual root, so the TreeView only
+sees the rows of the focused branch. A filter shows the nodes matching a
+query plus their ancestors; the matches come from the SearchIndex, so the
+work grows with the number of matches, not with the size of the document.
+"""
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+
+from scripts.tree_model import ROOT, NONE, TreeObserver
+from scripts.tree_view import NODE_COLUMN
+
+
+class FocusView(TreeObserver):
+    """Decides which model the TreeView shows: the store or a filter over it."""
+
+    def __init__(self, view, treeview, search_index):
+        self.view = view
+        self.model = view.model
+        self.treeview = treeview
+        self.search_index = search_index
+        # Hoisted node, or ROOT for the whole document
+        self.root = ROOT
+        self.query = ""
+        # Nodes passing the filter and their ancestors, None without a filter
+        self.shown = None
+        self.ancestors = None
+        self.filter = None
+        # Runs ahead of the StoreView, so rows of new nodes pass the filter
+        self.model.observers.insert(0, self)
+
+    @property
+    def active(self):
+        return self.filter is not None
+
+    def hoist(self, node):
+        """Shows only the branch below `node`."""
+        self.root = node
+        self._update()
+
+    def unhoist(self):
+        self.root = ROOT
+        self._update()
+
+    def set_query(self, query):
+        """Filters the focused branch down to nodes matching `query`."""
+        self.query = query.strip()
+        self._update()
+
+    def reset(self):
+        """Leaves focus mode, e.g. before the store is rebuilt."""
+        self.root = ROOT
+        self.query = ""
+        self.shown = None
+        self.ancestors = None
+        self.filter = None
+        if self.treeview.get_model() is not self.view.store:
+            self.treeview.set_model(self.view.store)
+
+    def _update(self):
+        if self.root == ROOT and not self.query:
+            self.reset()
+            return
+        self.treeview.set_model(None)
+        self._collect()
+        root_path = None
+        if self.root != ROOT:
+            tree_iter = self.view.materialize(self.root)
+            self.view.load_children(tree_iter)
+            root_path = self.view.store.get_path(tree_iter)
+        # A fresh filter builds its levels as the TreeView asks for them,
+        # whereas refilter() would revisit every row of the store
+        self.filter = self.view.store.filter_new(root_path)
+        self.filter.set_visible_func(self._visible)
+        self.treeview.set_model(self.filter)
+        if self.shown is not None:
+            # Only ancestors of matches have visible children to expand
+            self.treeview.expand_all()
+
+    def _collect(self):
+        """Finds the matches inside the focused branch and loads their rows."""
+        if not self.query:
+            self.shown = None
+            self.ancestors = None
+            return
+        parent = self.model.parent
+        root = self.root
+        shown = set()
+        ancestors = set()
+        for node in self.search_index.search(self.query):
+            chain = [node]
+            current = parent[node]
+            while current != root and current != ROOT and current not in ancestors:
+                chain.append(current)
+                current = parent[current]
+            if current == root or current in ancestors:
+                shown.update(chain)
+                ancestors.update(chain[1:])
+        for node in ancestors:
+            self.view.load_children(self.view.materialize(node))
+        self.shown = shown
+        self.ancestors = ancestors
+
+    def _visible(self, store, tree_iter, data):
+        if self.shown is None:
+            return True
+        node = store.get_value(tree_iter, NODE_COLUMN)
+        if node == NONE:
+            # A placeholder keeps the expander of an ancestor of matches
+            parent_iter = store.iter_parent(tree_iter)
+            return parent_iter is not None \
+                and store.get_value(parent_iter, NODE_COLUMN) in self.ancestors
+        return node in self.shown
+
+    # ------------------------------------------------------------------
+    #  Paths
+    # ------------------------------------------------------------------
+    def store_path(self, path):
+        """Store path of the TreeView row at `path`."""
+        if self.filter is None:
+            return path
+        return self.filter.convert_path_to_child_path(path)
+
+    def view_path(self, node):
+        """TreeView path of `node`, or None when the focus hides it.
+
+        Without a filter the rows on the way are left for expand_to_path()
+        to load.
+        """
+        if self.filter is None:
+            return Gtk.TreePath(list(self.model.path(node)))
+        tree_iter = self.view.materialize(node)
+        if tree_iter is None:
+            return None
+        return self.filter.convert_child_path_to_path(self.view.store.get_path(tree_iter))
+
+    # ------------------------------------------------------------------
+    #  TreeObserver
+    # ------------------------------------------------------------------
+    def _inside(self, node):
+        return self.root == ROOT or self.model.is_ancestor(self.root, node)
+
+    def _keep_visible(self, node):
+        if self.shown is None or not self._inside(node):
+            return
+        self.shown.add(node)
+        current = self.model.parent[node]
+        while current != self.root and current != ROOT and current not in self.ancestors:
+            self.shown.add(current)
+            self.ancestors.add(current)
+            current = self.model.parent[current]
+
+    def _drop_hoist(self, node):
+        """Unhoists when `node` holds the hoisted branch, which is losing its row.
+
+        The filter cannot outlive the row of its virtual root. The store is
+        about to change, so a query is applied again once it has.
+        """
+        if self.root == ROOT or not self.model.is_ancestor(node, self.root):
+            return False
+        query = self.query
+        self.reset()
+        if query:
+            self.query = query
+            GLib.idle_add(self._reapply)
+        return True
+
+    def _reapply(self):
+        if self.query and self.filter is None:
+            self._update()
+        return False
+
+    def node_inserted(self, model, node):
+        self._keep_visible(node)
+
+    def node_removing(self, model, node):
+        self._drop_hoist(node)
+
+    def node_moved(self, model, node, old_path):
+        if not self._drop_hoist(node):
+            self._keep_visible(node)
@@ -423,7 +423,20 @@ def create_default_config():
             }
         ],
         "settings": {
-            "theme": "default"
+            "theme": "default",
+            "lazy_load": True,
+            "release_collapsed": False,
+            "compact_json": False,
+            "autosave_interval": 300,
+            "journal_compact_entries": 10000,
+            "undo_budget_mb": 64,
+            "warm_start_cache": True,
+            "startup_timing": False,
+            "body_cache_mb": 8,
+            "profiling": False,
+            "profile_overlay": False,
+            "profile_operation": "",
+            "save_workers": 0
         }
     }
     
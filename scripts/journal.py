@@ -0,0 +1,248 @@
+"""
+Append-only edit journal for crash recovery between full saves.
+
+Each edit made through the TreeModel is appended as one JSON line holding the
+node's path, so an edit costs O(1) I/O instead of a full save. A journal file
+starts with a header naming the snapshot generation it applies to; saving a
+snapshot bumps the generation and rotates the journal, and on startup every
+journal at or after the snapshot's generation is replayed in order.
+"""
+import json
+import os
+
+from scripts.tree_model import TreeObserver, ROOT, NONE
+from scripts.tree_utils import serialize_tree, deserialize_tree
+
+GENERATION_KEY = "journal_generation"
+
+
+class JournalError(ValueError):
+    """Raised when a journal entry does not fit the tree it is replayed on."""
+
+
+class EditJournal(TreeObserver):
+    """Records model edits to `<document>.journal`."""
+
+    def __init__(self, document_path, generation=0):
+        self.path = document_path + ".journal"
+        self.previous_path = self.path + ".1"
+        self.generation = generation
+        self.entries = 0
+        self._file = None
+
+    # ------------------------------------------------------------------
+    #  Writing
+    # ------------------------------------------------------------------
+    def _append(self, entry):
+        self._append_line(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def _append_line(self, line):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            if self._file.tell() == 0:
+                self._file.write(json.dumps({"generation": self.generation}) + "\n")
+        self._file.write(line)
+        # Flushing hands the entry to the OS, so it survives a crash of the editor
+        self._file.flush()
+        self.entries += 1
+
+    def sync(self):
+        """Forces appended entries to disk."""
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def reset(self, generation):
+        """Discards all journalled edits, e.g. after reloading the document."""
+        self.close()
+        for path in (self.path, self.previous_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.generation = generation
+        self.entries = 0
+
+    def rotate(self):
+        """Starts a journal for the next generation; returns that generation.
+
+        Call this when taking the snapshot for a save, then commit_rotation()
+        once the snapshot is on disk or abort_rotation() if it failed.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.replace(self.path, self.previous_path)
+        self.generation += 1
+        self.entries = 0
+        return self.generation
+
+    def commit_rotation(self):
+        if os.path.exists(self.previous_path):
+            os.remove(self.previous_path)
+
+    def abort_rotation(self):
+        """Folds the previous journal back in front of the current one."""
+        self.close()
+        self.generation -= 1
+        if not os.path.exists(self.previous_path):
+            return
+        lines = []
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()[1:]
+        with open(self.previous_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(self.previous_path, self.path)
+        self.entries += len(lines)
+
+    # ------------------------------------------------------------------
+    #  TreeObserver
+    # ------------------------------------------------------------------
+    def node_inserted(self, model, node):
+        entry = {"op": "insert", "path": model.path(node), "text": model.text[node],
+                 "children": serialize_tree(model, node)}
+        if node in model.body_keys:
+            entry["body"] = model.body_keys[node]
+        self._append(entry)
+
+    def node_removing(self, model, node):
+        self._append({"op": "remove", "path": model.path(node)})
+
+    def text_changed(self, model, node, old_text):
+        self._append({"op": "text", "path": model.path(node), "text": model.text[node]})
+
+    def node_moved(self, model, node, old_path):
+        self._append({"op": "move", "path": old_path, "to": model.path(node)})
+
+    def body_linked(self, model, node):
+        self._append({"op": "body", "path": model.path(node), "key": model.body_keys[node]})
+
+    # ------------------------------------------------------------------
+    #  Replay
+    # ------------------------------------------------------------------
+    def replay(self, model, generation):
+        """Applies the journals that follow snapshot `generation` to `model`.
+
+        Returns the number of entries applied. Journals older than the
+        snapshot are obsolete and are deleted; the replayed edits stay in the
+        current journal until the next save.
+
+        Raises JournalError for an entry that does not fit the tree. The
+        journals are then renamed to "<journal>.bad", and a fresh journal for
+        `generation` holds the entries that were applied, so `model` can
+        still be recovered from the document and the new journal.
+        """
+        journals = []
+        for path in (self.previous_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                header = f.readline()
+            try:
+                base = json.loads(header)["generation"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            if base < generation:
+                os.remove(path)
+            else:
+                journals.append((base, path))
+        journals.sort()
+        # Lines of the entries applied so far
+        applied = []
+        expected = generation
+        try:
+            for base, path in journals:
+                if base != expected:
+                    break
+                self._replay_file(model, path, applied)
+                expected += 1
+        except JournalError:
+            self.close()
+            for path in (self.previous_path, self.path):
+                if os.path.exists(path):
+                    os.replace(path, path + ".bad")
+            self.generation = generation
+            self.entries = 0
+            for line in applied:
+                self._append_line(line)
+            raise
+        if os.path.exists(self.previous_path):
+            # A save did not complete; merge both journals back into one
+            self.generation = generation + 1
+            self.abort_rotation()
+        self.generation = generation
+        self.entries = len(applied)
+        return len(applied)
+
+    @staticmethod
+    def _replay_file(model, path, applied):
+        with open(path, "r+", encoding="utf-8") as f:
+            f.readline()
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    entry = json.loads(line) if line.endswith("\n") else None
+                except ValueError:
+                    entry = None
+                if entry is None:
+                    # Drop a torn final line left by a crash mid-write
+                    f.seek(position)
+                    f.truncate()
+                    break
+                try:
+                    apply_entry(model, entry)
+                except (KeyError, IndexError, TypeError) as e:
+                    raise JournalError("Malformed journal entry %r" % (entry,)) from e
+                applied.append(line)
+
+
+def _nth_child_skipping(model, parent, index, skipped):
+    """Like TreeModel.nth_child, but as if `skipped` were not a child."""
+    for child in model.children(parent):
+        if child == skipped:
+            continue
+        if index == 0:
+            return child
+        index -= 1
+    return NONE
+
+def apply_entry(model, entry):
+    """Re-applies one journal entry to `model`."""
+    path = entry["path"]
+    op = entry["op"]
+    if op == "insert":
+        parent = model.node_at(path[:-1])
+        if parent == NONE:
+            raise JournalError("No parent at %r" % (path,))
+        before = model.nth_child(parent, path[-1])
+        node = model.insert(parent, entry["text"], before)
+        if "body" in entry:
+            model.body_keys[node] = entry["body"]
+        deserialize_tree(entry["children"], model, node)
+        return
+    node = model.node_at(path)
+    if node == NONE or not path:
+        raise JournalError("No node at %r" % (path,))
+    if op == "remove":
+        model.remove(node)
+    elif op == "move":
+        # "to" is the path after the move, so it is resolved as if the node
+        # had already been taken out of the tree
+        target = entry["to"]
+        parent = ROOT
+        for index in target[:-1]:
+            parent = _nth_child_skipping(model, parent, index, node)
+            if parent == NONE:
+                raise JournalError("No parent at %r" % (target,))
+        model.move(node, parent, _nth_child_skipping(model, parent, target[-1], node))
+    elif op == "text":
+        model.set_text(node, entry["text"])
+    elif op == "body":
+        model.set_body_key(node, entry["key"])
+    else:
+        raise JournalError("Unknown journal operation %r" % (op,))
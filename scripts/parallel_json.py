@@ -0,0 +1,199 @@
+"""
+Parallel JSON encoding of large documents.
+
+The tree is split at the first depth where there are enough nodes to share
+out: the children of every node one level up are cut into runs of siblings,
+and a process pool encodes each run with tree_json.iter_tree_chunks. The
+parent process writes the few nodes above the split itself and copies the
+encoded runs into place, in document order, so the output is byte-identical
+to the sequential writer.
+
+Workers get the model once, when they start: by inheriting it through
+fork() where that is safe, otherwise as one pickled snapshot of the tables
+they need.
+"""
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from scripts.tree_model import ROOT, NONE, TreeModel
+from scripts.tree_json import iter_tree_chunks, iter_document_chunks
+
+# Smaller documents are encoded faster than a pool starts
+PARALLEL_MIN_NODES = 250000
+# Runs per worker, so workers that finish early take over the rest
+RUNS_PER_WORKER = 8
+# Deepest level the tree is split at
+MAX_SPLIT_DEPTH = 4
+
+# The model a worker encodes from
+_model = None
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def _context():
+    """Start method for the pool.
+
+    fork() shares the model for free, but forking a process that runs other
+    threads, like the editor saving from a worker thread, can deadlock the
+    child; those processes use a fresh interpreter instead.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if "fork" in methods and threading.active_count() == 1:
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _receive(payload):
+    global _model
+    first_child, next_sibling, text, body_keys = pickle.loads(payload)
+    _model = TreeModel()
+    _model.first_child = first_child
+    _model.next_sibling = next_sibling
+    _model.text = text
+    _model.body_keys = body_keys
+
+
+def _close(indent, level):
+    return "]" if indent is None else "\n" + " " * (indent * level) + "]"
+
+
+def _encode_run(parent, first, last, indent, level):
+    """Encodes the siblings `first` to `last` below `parent`, separated by
+    commas, as they appear inside the child array of `parent`."""
+    model = _model
+    first_child = model.first_child
+    next_sibling = model.next_sibling
+    saved = first_child[parent], next_sibling[last]
+    # The worker's copy of the model is its own, so the run can be cut out
+    first_child[parent] = first
+    next_sibling[last] = NONE
+    try:
+        text = "".join(iter_tree_chunks(model, parent, indent, level))
+    finally:
+        first_child[parent], next_sibling[last] = saved
+    return text[1:len(text) - len(_close(indent, level))]
+
+
+def split_runs(model, workers):
+    """Returns the parents whose child arrays are shared out and their runs.
+
+    Parents are listed in document order with the number of runs each was
+    cut into; runs are (parent, first, last) in the same order. Returns None
+    when the tree is too narrow to split.
+    """
+    target = workers * RUNS_PER_WORKER
+    first_child = model.first_child
+    next_sibling = model.next_sibling
+    parents = [ROOT]
+    for depth in range(MAX_SPLIT_DEPTH):
+        count = 0
+        below = []
+        for parent in parents:
+            child = first_child[parent]
+            while child != NONE:
+                count += 1
+                if first_child[child] != NONE:
+                    below.append(child)
+                child = next_sibling[child]
+        if count >= target:
+            break
+        parents = below
+    else:
+        return None
+    size = -(-count // target)
+    counts = []
+    runs = []
+    for parent in parents:
+        before = len(runs)
+        child = first_child[parent]
+        while child != NONE:
+            first = child
+            for _ in range(size - 1):
+                if next_sibling[child] == NONE:
+                    break
+                child = next_sibling[child]
+            runs.append((parent, first, child))
+            child = next_sibling[child]
+        counts.append((parent, depth, len(runs) - before))
+    return counts, runs
+
+
+class _Fragments:
+    """Child arrays of the split parents, assembled from the encoded runs."""
+
+    def __init__(self, counts, results, indent, level, progress, nodes, runs):
+        self.counts = {parent: (depth, runs) for parent, depth, runs in counts}
+        self.results = results
+        self.indent = indent
+        self.level = level
+        self.progress = progress
+        self.nodes = nodes
+        self.runs = runs
+        self.done = 0
+
+    def __contains__(self, node):
+        return node in self.counts
+
+    def __getitem__(self, node):
+        depth, runs = self.counts[node]
+        return self._chunks(runs, self.level + 2 * depth)
+
+    def _chunks(self, runs, level):
+        yield "["
+        for index in range(runs):
+            if index:
+                yield ","
+            yield next(self.results)
+            self.done += 1
+            if self.progress is not None:
+                self.progress(self.done * self.nodes // self.runs)
+        yield _close(self.indent, level)
+
+
+def iter_parallel_chunks(model, extra=None, indent=4, bare=False, workers=None,
+                         progress=None):
+    """Yields the same text as iter_document_chunks (or, with bare=True,
+    iter_tree_chunks) with the encoding shared out to `workers` processes.
+
+    `progress`, if given, is called after each run with an estimate of the
+    number of nodes written, like iter_tree_chunks.
+    """
+    global _model
+    workers = workers or default_workers()
+    level = 0 if bare else 1
+    split = split_runs(model, workers) if workers > 1 else None
+    if split is None:
+        if bare:
+            yield from iter_tree_chunks(model, ROOT, indent, level, progress)
+        else:
+            yield from iter_document_chunks(model, extra, indent, progress)
+        return
+    counts, runs = split
+    context = _context()
+    if context.get_start_method() == "fork":
+        _model = model
+        options = {}
+    else:
+        payload = pickle.dumps((model.first_child, model.next_sibling, list(model.text),
+                                model.body_keys), pickle.HIGHEST_PROTOCOL)
+        options = {"initializer": _receive, "initargs": (payload,)}
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, **options)
+    try:
+        results = executor.map(_encode_run, *zip(*runs), repeat(indent),
+                               repeat(level + 2 * counts[0][1]))
+        fragments = _Fragments(counts, results, indent, level, progress, len(model), len(runs))
+        if bare:
+            yield from iter_tree_chunks(model, ROOT, indent, level, fragments=fragments)
+        else:
+            yield from iter_document_chunks(model, extra, indent, fragments=fragments)
+    finally:
+        # Also reached when the writer stops early, e.g. on cancellation
+        executor.shutdown(wait=True, cancel_futures=True)
+        _model = None
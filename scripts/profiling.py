@@ -0,0 +1,136 @@
+"""
+Opt-in timing of editor operations.
+
+Set TREE_EDITOR_PROFILE=1 (or the "profiling" setting) to time every
+instrumented handler. Each call is appended as one JSON line to a rotating log
+next to the document (<document>.profile.log) with its duration, the node
+count and the memory of the process. With the "profile_overlay" setting the
+latest timings are also shown over the tree.
+
+Set TREE_EDITOR_PROFILE_OP to an operation name, e.g. on_save_clicked or
+"Saving task" (or use the "profile_operation" setting), to write a cProfile
+dump of the next call of that operation to <document>.<operation>.prof.
+"""
+import cProfile
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Rotated log: 1 MB per file, three old files kept
+LOG_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+# Timings listed in the overlay
+OVERLAY_LINES = 6
+
+
+def rss_mb():
+    """Current resident memory of the process, or the peak where unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Profiler:
+    """Times operations on one document and logs them as JSON lines."""
+
+    def __init__(self, document_path, model):
+        self.document_path = document_path
+        self.model = model
+        self.enabled = False
+        self.operation = None
+        # Called with each record, e.g. to refresh an overlay
+        self.listener = None
+        self.recent = deque(maxlen=OVERLAY_LINES)
+        self._logger = None
+        self.configure({})
+
+    def configure(self, settings):
+        """Applies the environment and the document's settings."""
+        self.enabled = os.environ.get("TREE_EDITOR_PROFILE", "") not in ("", "0") \
+            or bool(settings.get("profiling"))
+        self.operation = os.environ.get("TREE_EDITOR_PROFILE_OP") \
+            or settings.get("profile_operation") or None
+
+    def _log(self):
+        if self._logger is None:
+            # One logger per document, so open documents do not share a file
+            self._logger = logging.getLogger(f"tree_editor.profile.{id(self)}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(
+                self.document_path + ".profile.log", maxBytes=LOG_BYTES,
+                backupCount=LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+        return self._logger
+
+    def close(self):
+        if self._logger is not None:
+            for handler in list(self._logger.handlers):
+                self._logger.removeHandler(handler)
+                handler.close()
+            self._logger = None
+
+    def record(self, name, seconds):
+        record = {"time": round(time.time(), 3), "op": name,
+                  "ms": round(seconds * 1000, 3), "nodes": len(self.model),
+                  "rss_mb": rss_mb()}
+        self.recent.append(record)
+        self._log().info(json.dumps(record))
+        if self.listener is not None:
+            self.listener(record)
+
+    def call(self, name, function, *args):
+        """Runs `function(*args)`, timing it when profiling is on."""
+        if self.operation == name:
+            # One dump per request; the setting stays for the next launch
+            self.operation = None
+            return self._profile(name, function, *args)
+        if not self.enabled:
+            return function(*args)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def _profile(self, name, function, *args):
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            seconds = time.perf_counter() - start
+            path = f"{self.document_path}.{name.replace(' ', '_')}.prof"
+            profile.dump_stats(path)
+            logger.info("Profile of %s written to %s", name, path)
+            if self.enabled:
+                self.record(name, seconds)
+
+    def wrap(self, name, function):
+        """Returns `function` instrumented as the operation `name`."""
+        @functools.wraps(function)
+        def instrumented(*args):
+            return self.call(name, function, *args)
+        return instrumented
+
+    def overlay_text(self):
+        return "\n".join(f"{record['op']:<22} {record['ms']:>9.1f} ms"
+                         for record in self.recent)
@@ -0,0 +1,169 @@
+"""
+In-memory full-text index over node text.
+
+Maps lower-cased word tokens to the ids of the nodes containing them. The index
+is built from a copy of the tree on a worker thread when a document loads, see
+SearchIndex.begin_build(), and then kept current as a TreeObserver, so a search
+never walks the tree or the Gtk.TreeStore.
+"""
+import bisect
+import re
+
+from scripts.tree_model import ROOT, TreeObserver
+
+_WORD = re.compile(r"\w+")
+
+def tokenize(text):
+    """Returns the set of case-folded word tokens in `text`."""
+    return set(_WORD.findall(text.casefold())) if text else set()
+
+
+def build_postings(model):
+    """Returns the postings and the sorted vocabulary of every node of `model`.
+
+    Safe on a worker thread as long as nothing edits `model` meanwhile.
+    """
+    postings = {}
+    text = model.text
+    for node in model.iter_subtree(ROOT):
+        if node == ROOT:
+            continue
+        for token in tokenize(text[node]):
+            nodes = postings.get(token)
+            if nodes is None:
+                postings[token] = {node}
+            else:
+                nodes.add(node)
+    return postings, sorted(postings)
+
+
+class SearchIndex(TreeObserver):
+    """Inverted index from tokens to node ids."""
+
+    def __init__(self, model):
+        self.model = model
+        self.postings = None
+        self._vocabulary = []
+        # Copy being indexed elsewhere and the nodes edited since it was taken
+        self._snapshot = None
+        self._edited = None
+        model.observers.append(self)
+
+    @property
+    def built(self):
+        return self.postings is not None
+
+    def invalidate(self):
+        """Drops the index, e.g. after the model was replaced wholesale."""
+        self.postings = None
+        self._vocabulary = []
+        self._snapshot = None
+        self._edited = None
+
+    def build(self):
+        """Indexes the whole model in one go."""
+        self.invalidate()
+        self.postings, self._vocabulary = build_postings(self.model)
+
+    def begin_build(self, snapshot):
+        """Starts over from `snapshot`, a copy of the model just taken, for
+        build_postings() to index on another thread. Edits made meanwhile are
+        recorded and folded in by finish_build().
+        """
+        self.invalidate()
+        self._snapshot = snapshot
+        self._edited = set()
+
+    def finish_build(self, snapshot, postings, vocabulary):
+        """Installs what build_postings() returned for `snapshot`; False if the
+        index was invalidated or rebuilt in the meantime."""
+        if snapshot is not self._snapshot:
+            return False
+        edited = self._edited
+        self.invalidate()
+        self.postings = postings
+        self._vocabulary = vocabulary
+        model = self.model
+        for node in edited:
+            if snapshot.is_attached(node):
+                self._discard(node, snapshot.text[node])
+            if model.is_attached(node):
+                self._add(node, model.text[node])
+        return True
+
+    def _add(self, node, text):
+        for token in tokenize(text):
+            nodes = self.postings.get(token)
+            if nodes is None:
+                self.postings[token] = {node}
+                bisect.insort(self._vocabulary, token)
+            else:
+                nodes.add(node)
+
+    def _discard(self, node, text):
+        for token in tokenize(text):
+            nodes = self.postings.get(token)
+            if nodes is None:
+                continue
+            nodes.discard(node)
+            if not nodes:
+                del self.postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+
+    def _prefix_matches(self, prefix):
+        """Union of the postings of every token starting with `prefix`."""
+        vocabulary = self._vocabulary
+        position = bisect.bisect_left(vocabulary, prefix)
+        matches = set()
+        while position < len(vocabulary) and vocabulary[position].startswith(prefix):
+            matches |= self.postings[vocabulary[position]]
+            position += 1
+        return matches
+
+    def search(self, query, limit=None):
+        """Returns the ids of nodes containing every word of `query`.
+
+        The last word also matches as a prefix, so results narrow while the
+        user types. Results are ordered by node id. Nothing matches until the
+        index is built.
+        """
+        words = _WORD.findall(query.casefold())
+        if not words or not self.built:
+            return []
+        sets = [self.postings.get(word, set()) for word in words[:-1]]
+        sets.append(self._prefix_matches(words[-1]))
+        # Intersecting from the rarest word keeps the work near the result size
+        sets.sort(key=len)
+        result = sets[0]
+        for nodes in sets[1:]:
+            if not result:
+                break
+            result = result & nodes
+        result = sorted(result)
+        return result[:limit] if limit else result
+
+    # ------------------------------------------------------------------
+    #  TreeObserver
+    # ------------------------------------------------------------------
+    def node_inserted(self, model, node):
+        if self.built:
+            text = model.text
+            for child in model.iter_subtree(node):
+                self._add(child, text[child])
+        elif self._edited is not None:
+            self._edited.update(model.iter_subtree(node))
+
+    def node_removing(self, model, node):
+        if self.built:
+            text = model.text
+            for child in model.iter_subtree(node):
+                self._discard(child, text[child])
+        elif self._edited is not None:
+            self._edited.update(model.iter_subtree(node))
+
+    def text_changed(self, model, node, old_text):
+        if self.built:
+            self._discard(node, old_text)
+            self._add(node, model.text[node])
+        elif self._edited is not None:
+            self._edited.add(node)
@@ -0,0 +1,49 @@
+"""
+State shared by all documents open in one editor process.
+"""
+import os
+
+from scripts.string_pool import StringPool, memory_usage
+
+
+class Session:
+    """Open documents, their shared string pool and the clipboard.
+
+    Each entry of `documents` is an object with `path` and `model`
+    attributes, i.e. an editor window.
+    """
+
+    def __init__(self):
+        self.pool = StringPool()
+        self.clipboard = None
+        self.documents = []
+
+    def find(self, path):
+        path = os.path.abspath(path)
+        for document in self.documents:
+            if os.path.abspath(document.path) == path:
+                return document
+        return None
+
+    def add(self, document):
+        self.documents.append(document)
+
+    def remove(self, document):
+        """Forgets `document`; returns True once no document is left open."""
+        self.documents.remove(document)
+        self.pool.sweep()
+        return not self.documents
+
+    def memory_report(self):
+        """Returns a text table of per-document and pooled memory in MB."""
+        lines = [f"{'document':<28} {'nodes':>9} {'tables':>8} {'text':>8} "
+                 f"{'shared':>8} {'mapped':>8}"]
+        for document in self.documents:
+            usage = memory_usage(document.model, self.pool)
+            name = os.path.basename(document.path)[:28]
+            lines.append(f"{name:<28} {len(document.model):>9} "
+                         f"{usage['structure'] / 1e6:>8.1f} {usage['text'] / 1e6:>8.1f} "
+                         f"{usage['shared'] / 1e6:>8.1f} {usage['mapped'] / 1e6:>8.1f}")
+        lines.append(f"String pool: {len(self.pool)} strings, "
+                     f"{self.pool.nbytes() / 1e6:.1f} MB shared by all documents")
+        return "\n".join(lines)
@@ -0,0 +1,60 @@
+"""
+Warm-start cache of a parsed document.
+
+After a document is parsed, its model is written next to it as a .tdb snapshot
+tagged with the document's modification time and size. If the document is
+unchanged on the next start, the snapshot is mapped instead of parsing JSON.
+"""
+import logging
+import os
+
+from scripts.tree_binary import EXTENSION, open_binary, read_binary, write_binary
+from scripts.file_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Key in the snapshot's extra data identifying the document it was made from
+CACHE_KEY = "cache_source"
+
+def cache_path(document_path):
+    return document_path + ".cache" + EXTENSION
+
+def source_key(document_path):
+    """Identifies the current version of `document_path` by mtime and size."""
+    stat = os.stat(document_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+def is_fresh(document_path):
+    """True when the cached snapshot matches the document on disk."""
+    try:
+        with open_binary(cache_path(document_path)) as document:
+            return document.extra.get(CACHE_KEY) == source_key(document_path)
+    except (OSError, ValueError):
+        # Missing, truncated or from another format version
+        return False
+
+def load_cached(document_path, model):
+    """Loads the cached snapshot into `model`; returns the document's extra keys."""
+    extra = read_binary(cache_path(document_path), model)
+    extra.pop(CACHE_KEY, None)
+    return extra
+
+def store_cache(document_path, model, extra, source):
+    """Writes the snapshot of `model` for the document version `source`.
+
+    `source` must be taken with source_key() before the document was read, so
+    a document that changed meanwhile never matches a stale snapshot.
+    """
+    extra = dict(extra)
+    extra[CACHE_KEY] = source
+    try:
+        with atomic_write(cache_path(document_path), "wb") as f:
+            write_binary(f, model, extra)
+    except OSError as e:
+        logger.warning("Could not write the startup cache: %s", e)
+
+def discard_cache(document_path):
+    try:
+        os.remove(cache_path(document_path))
+    except FileNotFoundError:
+        pass
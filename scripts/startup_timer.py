@@ -0,0 +1,37 @@
+"""
+Per-phase timing of editor startup.
+
+Set TREE_EDITOR_TIMING=1 (or the "startup_timing" setting) to print the
+phases to stderr once the window has been painted for the first time.
+"""
+import os
+import sys
+import time
+
+class StartupTimer:
+    """Records how long each startup phase took since the previous one."""
+
+    def __init__(self, start):
+        self.start = start
+        self.last = start
+        self.phases = []
+        # Set once startup is over, e.g. when later windows are opened
+        self.finished = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    @property
+    def total(self):
+        return self.last - self.start
+
+    def report(self, stream=sys.stderr):
+        for phase, seconds in self.phases:
+            print(f"{phase:>14}: {seconds * 1000:9.1f} ms", file=stream)
+        print(f"{'total':>14}: {self.total * 1000:9.1f} ms", file=stream)
+
+def timing_enabled(settings):
+    return os.environ.get("TREE_EDITOR_TIMING", "") not in ("", "0") \
+        or bool(settings.get("startup_timing"))
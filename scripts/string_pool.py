@@ -0,0 +1,76 @@
+"""
+Shared interning of node text across open documents.
+
+Generated outlines repeat the same labels many times, within a document and
+across documents. Loading text through one StringPool makes every copy of a
+label refer to a single string object.
+"""
+import sys
+from array import array
+
+
+class StringPool:
+    """Interning table for node text shared by every open document."""
+
+    def __init__(self):
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def intern(self, text):
+        return self._strings.setdefault(text, text)
+
+    def owns(self, text):
+        return self._strings.get(text) is text
+
+    def sweep(self):
+        """Drops strings that no document refers to any more; returns how many."""
+        getrefcount = sys.getrefcount
+        strings = self._strings
+        # Unused strings are referenced only by the dict key and value, the
+        # snapshot list, `text` and getrefcount's own argument. The snapshot
+        # keeps this safe while a loader thread interns.
+        unused = [text for text in list(strings) if getrefcount(text) <= 5]
+        for text in unused:
+            del strings[text]
+        return len(unused)
+
+    def nbytes(self):
+        """Memory held by the pooled strings and the table itself."""
+        getsizeof = sys.getsizeof
+        return getsizeof(self._strings) + sum(getsizeof(text) for text in self._strings)
+
+
+def memory_usage(model, pool=None):
+    """Estimates the memory of `model` in bytes.
+
+    Returns a dict with "structure" (node tables), "text" (strings only this
+    document refers to), "shared" (pooled strings it refers to, which other
+    documents may share) and "mapped" (file-backed text of a .tdb load).
+    """
+    getsizeof = sys.getsizeof
+    usage = {"structure": 0, "text": 0, "shared": 0, "mapped": 0}
+    for table in (model.parent, model.first_child, model.last_child,
+                  model.next_sibling, model.prev_sibling):
+        if isinstance(table, array):
+            usage["structure"] += table.itemsize * len(table)
+        else:
+            usage["mapped"] += table.nbytes
+    text = model.text
+    if isinstance(text, list):
+        usage["structure"] += getsizeof(text)
+        texts = text
+    else:
+        usage["mapped"] += text.nbytes
+        texts = text.overlay_values()
+    seen = set()
+    for value in texts:
+        if value is None or id(value) in seen:
+            continue
+        seen.add(id(value))
+        if pool is not None and pool.owns(value):
+            usage["shared"] += getsizeof(value)
+        else:
+            usage["text"] += getsizeof(value)
+    return usage
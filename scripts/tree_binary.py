@@ -0,0 +1,286 @@
+"""
+Compact binary container for tree documents (.tdb).
+
+Layout, all little-endian:
+
+    header      magic, version, flags, capacity, node count, free count and the
+                offset of every section below
+    tables      parent, first_child, last_child, next_sibling, prev_sibling
+                as int32 arrays indexed by node id (id 0 is the hidden root)
+    free        int32 ids of unused slots
+    heap        UTF-8 node text, concatenated
+    offsets     int64 heap offsets, capacity + 1 entries
+    extra       UTF-8 JSON of the non-tree keys, e.g. {"settings": {...}}
+
+The tables have the same shape as TreeModel's, so opening a file through mmap
+gives random access to any node without decoding the rest, and loading it into
+a TreeModel is a handful of memory copies. Node text is decoded on first use.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from scripts.tree_model import ROOT, TreeModel
+from scripts.tree_json import read_document, write_document, write_tree
+
+MAGIC = b"TDEB"
+VERSION = 1
+EXTENSION = ".tdb"
+
+# Header flag: the source was a bare node array (tree.json) rather than a
+# configuration object
+FLAG_BARE_TREE = 1
+
+# Extra-data key holding the model's [node, body key] pairs
+_BODY_KEYS = "_body_keys"
+
+_HEADER = struct.Struct("<4sHHqqq9q")
+_TABLES = ("parent", "first_child", "last_child", "next_sibling", "prev_sibling")
+_MISSING = object()
+
+
+class BinaryFormatError(ValueError):
+    """Raised when a file is not a readable .tdb document."""
+
+
+class HeapText:
+    """List-like node text backed by the string heap of a .tdb file.
+
+    Texts are decoded on access; assignments and appended nodes are kept in
+    an overlay, so a model loaded from a file stays fully editable.
+    """
+
+    __slots__ = ("_heap", "_offsets", "_overlay", "_size")
+
+    def __init__(self, heap, offsets, size, free=()):
+        self._heap = heap
+        self._offsets = offsets
+        self._overlay = {ROOT: ""}
+        self._size = size
+        for node in free:
+            self._overlay[node] = None
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, node):
+        value = self._overlay.get(node, _MISSING)
+        if value is _MISSING:
+            if not 0 <= node < self._size:
+                raise IndexError(node)
+            offsets = self._offsets
+            value = str(self._heap[offsets[node]:offsets[node + 1]], "utf-8")
+        return value
+
+    def __setitem__(self, node, value):
+        if not 0 <= node < self._size:
+            raise IndexError(node)
+        self._overlay[node] = value
+
+    def append(self, value):
+        self._overlay[self._size] = value
+        self._size += 1
+
+    def __iter__(self):
+        for node in range(self._size):
+            yield self[node]
+
+    @property
+    def nbytes(self):
+        """Size of the mapped heap and offsets, which the OS pages in on demand."""
+        return self._heap.nbytes + self._offsets.itemsize * len(self._offsets)
+
+    def overlay_values(self):
+        """Texts assigned or appended since loading, held in memory."""
+        return self._overlay.values()
+
+    def copy(self):
+        clone = HeapText(self._heap, self._offsets, self._size)
+        clone._overlay = dict(self._overlay)
+        return clone
+
+
+# ------------------------------------------------------------------
+#  Writing
+# ------------------------------------------------------------------
+def _table_bytes(values):
+    table = array("i", values)
+    if sys.byteorder != "little":
+        table.byteswap()
+    return table.tobytes()
+
+def _align(fp):
+    padding = -fp.tell() % 8
+    if padding:
+        fp.write(b"\0" * padding)
+    return fp.tell()
+
+def write_binary(fp, model, extra=None, bare=False):
+    """Writes `model` (and the non-tree keys `extra`) to the binary file `fp`.
+
+    With bare=True the document converts back to a bare node array.
+    """
+    capacity = model.capacity()
+    free = array("i", sorted(model._free))
+    fp.write(b"\0" * _HEADER.size)
+    sections = []
+    for name in _TABLES:
+        sections.append(_align(fp))
+        fp.write(_table_bytes(getattr(model, name)))
+    sections.append(_align(fp))
+    fp.write(_table_bytes(free))
+
+    # The heap is written in chunks while the offsets are collected
+    heap_start = _align(fp)
+    sections.append(heap_start)
+    offsets = array("q", [0])
+    position = 0
+    chunk = []
+    text = model.text
+    for node in range(capacity):
+        value = text[node]
+        data = value.encode("utf-8") if value else b""
+        position += len(data)
+        offsets.append(position)
+        chunk.append(data)
+        if len(chunk) >= 4096:
+            fp.write(b"".join(chunk))
+            chunk = []
+    fp.write(b"".join(chunk))
+    sections.append(_align(fp))
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    fp.write(offsets.tobytes())
+    sections.append(_align(fp))
+    extra = dict(extra or {})
+    if model.body_keys:
+        extra[_BODY_KEYS] = sorted(model.body_keys.items())
+    fp.write(json.dumps(extra).encode("utf-8"))
+    end = fp.tell()
+
+    fp.seek(0)
+    flags = FLAG_BARE_TREE if bare else 0
+    fp.write(_HEADER.pack(MAGIC, VERSION, flags, capacity, len(model), len(free), *sections))
+    fp.seek(end)
+
+
+# ------------------------------------------------------------------
+#  Reading
+# ------------------------------------------------------------------
+def _parse_header(buffer):
+    if len(buffer) < _HEADER.size:
+        raise BinaryFormatError("File is too short for a .tdb header")
+    fields = _HEADER.unpack_from(buffer, 0)
+    magic, version, flags, capacity, count, free_count = fields[:6]
+    if magic != MAGIC:
+        raise BinaryFormatError("Not a .tdb document")
+    if version != VERSION:
+        raise BinaryFormatError("Unsupported .tdb version %d" % version)
+    return flags, capacity, count, free_count, fields[6:]
+
+def _int_view(view, start, count, typecode):
+    """Zero-copy view of `count` integers, or a swapped copy on big-endian hosts."""
+    size = array(typecode).itemsize
+    data = view[start:start + count * size]
+    if sys.byteorder == "little":
+        return data.cast(typecode)
+    table = array(typecode, data.tobytes())
+    table.byteswap()
+    return table
+
+
+class BinaryDocument(TreeModel):
+    """Read-only TreeModel over a memory-mapped .tdb file."""
+
+    __slots__ = ("extra", "bare", "_mmap", "_view")
+
+    def __init__(self, path):
+        TreeModel.__init__(self)
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        flags, capacity, count, free_count, sections = _parse_header(self._view)
+        self.bare = bool(flags & FLAG_BARE_TREE)
+        for name, start in zip(_TABLES, sections):
+            setattr(self, name, _int_view(self._view, start, capacity, "i"))
+        self._free = list(_int_view(self._view, sections[5], free_count, "i"))
+        offsets = _int_view(self._view, sections[7], capacity + 1, "q")
+        self.text = HeapText(self._view[sections[6]:], offsets, capacity, self._free)
+        self._count = count
+        self.extra = json.loads(str(self._view[sections[8]:], "utf-8") or "{}")
+        self.body_keys = dict(self.extra.pop(_BODY_KEYS, ()))
+
+    def close(self):
+        """Releases the mapping; the document must not be used afterwards."""
+        for name in _TABLES:
+            setattr(self, name, array("i", [-1]))
+        self.text = [""]
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_binary(path):
+    """Maps a .tdb file for random access without decoding it."""
+    return BinaryDocument(path)
+
+def read_binary(path, model):
+    """Loads a .tdb file into the empty, editable `model`; returns its extra keys.
+
+    The structure tables are copied in bulk and the text heap stays mapped,
+    so the cost barely grows with the number of nodes.
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    _, capacity, count, free_count, sections = _parse_header(view)
+    for name, start in zip(_TABLES, sections):
+        table = array("i")
+        table.frombytes(view[start:start + capacity * 4])
+        if sys.byteorder != "little":
+            table.byteswap()
+        setattr(model, name, table)
+    model._free = list(_int_view(view, sections[5], free_count, "i"))
+    offsets = _int_view(view, sections[7], capacity + 1, "q")
+    model.text = HeapText(view[sections[6]:], offsets, capacity, model._free)
+    model._count = count
+    extra = json.loads(str(view[sections[8]:], "utf-8") or "{}")
+    model.body_keys = dict(extra.pop(_BODY_KEYS, ()))
+    return extra
+
+
+# ------------------------------------------------------------------
+#  Conversion
+# ------------------------------------------------------------------
+def is_bare_tree(fp):
+    """True when the JSON text in `fp` starts with an array; rewinds `fp`."""
+    while True:
+        char = fp.read(1)
+        if not char or not char.isspace():
+            fp.seek(0)
+            return char == "["
+
+def json_to_binary(json_path, binary_path):
+    """Converts a configuration.json or tree.json document to .tdb."""
+    model = TreeModel()
+    with open(json_path, "r", encoding="utf-8") as f:
+        bare = is_bare_tree(f)
+        extra = read_document(f, model)
+    with open(binary_path, "wb") as f:
+        write_binary(f, model, extra, bare)
+
+def binary_to_json(binary_path, json_path, indent=4):
+    """Converts a .tdb file back to the JSON document it was made from."""
+    with open_binary(binary_path) as document, \
+            open(json_path, "w", encoding="utf-8") as f:
+        if document.bare:
+            write_tree(f, document, ROOT, indent)
+        else:
+            write_document(f, document, document.extra, indent)
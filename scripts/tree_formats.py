@@ -0,0 +1,277 @@
+"""
+Streaming export to Markdown, OPML, HTML and plain text, and import of
+Markdown and OPML outlines.
+
+Every exporter is a generator over a TreeModel that yields the output in
+chunks, so a document of any size is written with bounded memory and never
+held as one string. The importers read their input incrementally and append
+nodes straight into a TreeModel, like tree_json.read_nodes.
+"""
+import html
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+from scripts.tree_model import ROOT, NONE
+from scripts.file_utils import atomic_write
+
+# Nodes written between two yielded chunks
+CHUNK_NODES = 4096
+
+_OPEN = 0
+_CLOSE = 1
+
+# Characters XML 1.0 cannot represent, not even as references
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+
+def _walk(model, node=ROOT):
+    """Yields (_OPEN, node, depth) in pre-order and (_CLOSE, node, depth)
+    after the children of every node that has some."""
+    first_child = model.first_child
+    next_sibling = model.next_sibling
+    stack = []
+    child = first_child[node]
+    depth = 1
+    while child != NONE:
+        yield _OPEN, child, depth
+        if first_child[child] != NONE:
+            stack.append(child)
+            child = first_child[child]
+            depth += 1
+            continue
+        while next_sibling[child] == NONE and stack:
+            child = stack.pop()
+            depth -= 1
+            yield _CLOSE, child, depth
+        child = next_sibling[child]
+
+
+def _chunks(parts_of, model, node, progress):
+    """Joins the strings `parts_of(event, node, depth)` into chunks."""
+    out = []
+    written = 0
+    for event, child, depth in _walk(model, node):
+        out.extend(parts_of(event, child, depth))
+        if event == _OPEN:
+            written += 1
+            if written % CHUNK_NODES == 0:
+                if progress is not None:
+                    progress(written)
+                yield "".join(out)
+                out = []
+    yield "".join(out)
+
+
+# ------------------------------------------------------------------
+#  Exporters
+# ------------------------------------------------------------------
+def iter_markdown(model, node=ROOT, title=None, progress=None):
+    """Yields a nested Markdown list; continuation lines hold multi-line text."""
+    text = model.text
+    if title:
+        yield f"# {title}\n\n"
+
+    def parts(event, child, depth):
+        if event == _CLOSE:
+            return ()
+        indent = "  " * (depth - 1)
+        lines = text[child].split("\n")
+        return [indent, "- ", lines[0], "\n"] + \
+            [f"{indent}  {line}\n" for line in lines[1:]]
+    yield from _chunks(parts, model, node, progress)
+
+
+def iter_text(model, node=ROOT, title=None, progress=None):
+    """Yields the outline as plain text indented with tabs."""
+    text = model.text
+    if title:
+        yield f"{title}\n\n"
+
+    def parts(event, child, depth):
+        if event == _CLOSE:
+            return ()
+        indent = "\t" * (depth - 1)
+        return [indent, text[child].replace("\n", "\n" + indent + "  "), "\n"]
+    yield from _chunks(parts, model, node, progress)
+
+
+def iter_opml(model, node=ROOT, title=None, progress=None):
+    """Yields an OPML 2.0 document with one <outline> per node.
+
+    Control characters XML cannot hold are written as U+FFFD.
+    """
+    text = model.text
+    first_child = model.first_child
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n<opml version="2.0">\n'
+           f"  <head>\n    <title>{escape(title or '')}</title>\n  </head>\n  <body>\n")
+
+    def parts(event, child, depth):
+        indent = "  " * (depth + 1)
+        if event == _CLOSE:
+            return [indent, "</outline>\n"]
+        attribute = quoteattr(_XML_INVALID.sub("\ufffd", text[child]),
+                              {"\n": "&#10;", "\r": "&#13;", "\t": "&#9;"})
+        close = ">" if first_child[child] != NONE else "/>"
+        return [indent, "<outline text=", attribute, close, "\n"]
+    yield from _chunks(parts, model, node, progress)
+    yield "  </body>\n</opml>\n"
+
+
+def iter_html(model, node=ROOT, title=None, progress=None):
+    """Yields a standalone HTML page with the outline as nested lists."""
+    text = model.text
+    first_child = model.first_child
+    title = html.escape(title or "")
+    yield ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+           f"<title>{title}</title>\n</head>\n<body>\n<ul>\n")
+
+    def parts(event, child, depth):
+        if event == _CLOSE:
+            return ["</ul></li>\n"]
+        item = html.escape(text[child]).replace("\n", "<br>")
+        if first_child[child] != NONE:
+            return ["<li>", item, "\n<ul>\n"]
+        return ["<li>", item, "</li>\n"]
+    yield from _chunks(parts, model, node, progress)
+    yield "</ul>\n</body>\n</html>\n"
+
+
+EXPORTERS = {
+    "markdown": (".md", iter_markdown),
+    "opml": (".opml", iter_opml),
+    "html": (".html", iter_html),
+    "text": (".txt", iter_text),
+}
+
+
+def format_for(path):
+    """Export format named by the extension of `path`, or None."""
+    extension = os.path.splitext(path)[1].lower()
+    for name, (format_extension, _) in EXPORTERS.items():
+        if extension == format_extension:
+            return name
+    return {".markdown": "markdown", ".htm": "html"}.get(extension)
+
+
+def export_document(path, model, fmt=None, title=None, task=None, node=ROOT):
+    """Atomically writes the branch below `node` to `path` in `fmt`.
+
+    The format defaults to the one named by the extension of `path`.
+    """
+    fmt = fmt or format_for(path)
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format for {path}")
+    total = (len(model) if node == ROOT else model.subtree_size(node)) or 1
+    progress = None
+    if task is not None:
+        def progress(written):
+            task.check()
+            task.report(written / total)
+    with atomic_write(path) as f:
+        for chunk in EXPORTERS[fmt][1](model, node, title, progress):
+            f.write(chunk)
+
+
+# ------------------------------------------------------------------
+#  Importers
+# ------------------------------------------------------------------
+_LIST_ITEM = re.compile(r"( *)(?:[-*+]|\d+[.)]) (.*)")
+_HEADING = re.compile(r"(#{1,6}) +(.*?) *#*$")
+
+
+def read_markdown(fp, model, parent=ROOT, intern=None):
+    """Appends the headings and list items of a Markdown outline below `parent`.
+
+    Headings nest by level and list items by indentation, items going below
+    the heading before them. More deeply indented lines continue the text of
+    the previous item. Returns the number of nodes added.
+    """
+    # Open (level, node) pairs; headings are levels 1-6, list items come after
+    ancestors = [(0, parent)]
+    pending = None
+    count = 0
+
+    def flush():
+        nonlocal count
+        level, lines = pending
+        while ancestors[-1][0] >= level:
+            ancestors.pop()
+        value = "\n".join(lines)
+        node = model.append(ancestors[-1][1], value if intern is None else intern(value))
+        ancestors.append((level, node))
+        count += 1
+
+    for line in fp:
+        line = line.rstrip("\r\n")
+        # Tabs count in the indentation only, not in the text
+        stripped = line.lstrip(" \t")
+        expanded = line[:len(line) - len(stripped)].expandtabs(4) + stripped
+        item = _LIST_ITEM.match(expanded)
+        heading = _HEADING.match(line) if item is None else None
+        if item is not None or heading is not None:
+            if pending is not None:
+                flush()
+            if item is not None:
+                pending = (7 + len(item.group(1)), [item.group(2)])
+            else:
+                pending = (len(heading.group(1)), [heading.group(2)])
+        elif line.strip() and pending is not None and pending[0] > 6 \
+                and expanded.startswith(" " * (pending[0] - 7 + 1)):
+            pending[1].append(line.strip())
+        elif line.strip():
+            # A paragraph outside the outline becomes a node of its own
+            if pending is not None:
+                flush()
+            pending = (7, [line.strip()])
+    if pending is not None:
+        flush()
+    return count
+
+
+def read_opml(fp, model, parent=ROOT, intern=None):
+    """Appends the <outline> elements of an OPML document below `parent`.
+
+    Elements are dropped as soon as they have been read, so memory stays
+    bounded by the depth of the outline. Returns the number of nodes added.
+    """
+    stack = [parent]
+    elements = []
+    count = 0
+    for event, element in ElementTree.iterparse(fp, events=("start", "end")):
+        if element.tag != "outline":
+            if event == "start":
+                elements.append(element)
+            else:
+                elements.pop()
+            continue
+        if event == "start":
+            value = element.get("text", "")
+            stack.append(model.append(stack[-1], value if intern is None else intern(value)))
+            elements.append(element)
+            count += 1
+        else:
+            stack.pop()
+            elements.pop()
+            # The finished element is the last child read into its parent
+            if elements:
+                del elements[-1][-1]
+    return count
+
+
+IMPORTERS = {".md": read_markdown, ".markdown": read_markdown, ".opml": read_opml}
+
+
+def import_document(path, model, parent=ROOT, intern=None):
+    """Reads a Markdown or OPML file into `model`; returns the number of nodes added."""
+    reader = IMPORTERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise ValueError(f"Cannot import {path}")
+    if reader is read_opml:
+        # The XML declaration names the encoding
+        f = open(path, "rb")
+    else:
+        f = open(path, "r", encoding="utf-8")
+    with f:
+        return reader(f, model, parent, intern)
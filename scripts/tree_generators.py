@@ -0,0 +1,99 @@
+"""
+Synthetic tree documents for benchmarks.
+
+Each generator appends `node_count` nodes below ROOT of a TreeModel, so
+documents of millions of nodes are built without an intermediate dict tree.
+Output is deterministic for a given seed.
+"""
+import random
+from collections import deque
+
+from scripts.tree_model import ROOT, NONE
+
+# Longest chain the "deep" shape builds before starting a new one. Indented
+# JSON grows with depth times node count (about 2 KB per node at depth 100),
+# so one chain of millions of levels could not be written at all.
+DEEP_CHAIN = 100
+
+SHAPES = ("balanced", "wide", "deep", "long-text", "unicode")
+
+_WORDS = ("tree", "node", "outline", "branch", "leaf", "document", "editor",
+          "alpha", "beta", "gamma", "delta", "review", "draft", "notes", "plan")
+
+# Mixed scripts, combining marks, emoji and characters JSON must escape
+_UNICODE_WORDS = ("Grüße", "ñandú", "Ελληνικά", "русский", "עברית", "العربية",
+                  "हिन्दी", "中文字符", "日本語テキスト", "한국어", "🌳🍃", "👩‍💻",
+                  "é", "tab\there", "quote\"d", "back\\slash", "line\nbreak",
+                  " sep", "\x07bell")
+
+def _balanced(model, node_count, text, fanout=8):
+    queue = deque([ROOT])
+    made = 0
+    while made < node_count:
+        parent = queue.popleft()
+        for _ in range(fanout):
+            if made == node_count:
+                break
+            queue.append(model.append(parent, text(made)))
+            made += 1
+
+def _wide(model, node_count, text):
+    if node_count == 0:
+        return
+    top = model.append(ROOT, text(0))
+    for made in range(1, node_count):
+        model.append(top, text(made))
+
+def _deep(model, node_count, text):
+    parent = ROOT
+    for made in range(node_count):
+        if made % DEEP_CHAIN == 0:
+            parent = ROOT
+        parent = model.append(parent, text(made))
+
+def _label(made):
+    return "Node %d" % made
+
+def _text_pool(rng, words, count, low, high):
+    pool = []
+    for _ in range(count):
+        length = rng.randint(low, high)
+        pool.append(" ".join(rng.choice(words) for _ in range(length)))
+    return pool
+
+def generate(model, shape, node_count, seed=0):
+    """Appends a `shape` document of `node_count` nodes to `model`.
+
+    long-text and unicode draw their texts from a pool of 1024 strings, so
+    generation stays fast and the model does not hold millions of distinct
+    large strings.
+    """
+    rng = random.Random(seed)
+    if shape == "balanced":
+        _balanced(model, node_count, _label)
+    elif shape == "wide":
+        _wide(model, node_count, _label)
+    elif shape == "deep":
+        _deep(model, node_count, _label)
+    elif shape == "long-text":
+        pool = _text_pool(rng, _WORDS, 1024, 100, 800)
+        _balanced(model, node_count, lambda made: pool[made & 1023])
+    elif shape == "unicode":
+        pool = _text_pool(rng, _UNICODE_WORDS, 1024, 1, 12)
+        _balanced(model, node_count, lambda made: pool[made & 1023])
+    else:
+        raise ValueError("Unknown shape %r" % (shape,))
+    return model
+
+def max_depth(model):
+    """Depth of the deepest node, for reporting a document's shape."""
+    deepest = 0
+    stack = [(model.first_child[ROOT], 1)]
+    while stack:
+        child, depth = stack.pop()
+        while child != NONE:
+            deepest = max(deepest, depth)
+            if model.first_child[child] != NONE:
+                stack.append((model.first_child[child], depth + 1))
+            child = model.next_sibling[child]
+    return deepest
@@ -0,0 +1,241 @@
+"""
+Merkle hashes of subtrees for change detection.
+
+The digest of a node covers its text, its body key and the digests of its
+children in order, so the root digest identifies the whole document and two
+subtrees with equal digests are equal. SubtreeHashes keeps the digests of a
+TreeModel as a TreeObserver: an edit only marks the edited node and its
+ancestors stale, and the next query recomputes those few nodes. Comparing the
+root digest with the one recorded at the last save tells whether there is
+anything to save in O(1) when nothing was edited since the last query.
+
+Computing every digest of a large tree takes long enough to block a UI, so
+the editor does it on a worker thread from a copy of the model: see
+begin_refresh() and finish_refresh(). On the main thread it only compares
+`version`, which every edit bumps.
+"""
+import sys
+from array import array
+from difflib import SequenceMatcher
+from hashlib import blake2b
+
+from scripts.tree_model import ROOT, NONE, TreeObserver
+
+# Configuration key holding the root digest of the saved tree
+HASH_KEY = "tree_hash"
+
+
+class SubtreeHashes(TreeObserver):
+    """64-bit digests of every subtree of `model`, refreshed lazily."""
+
+    def __init__(self, model):
+        self.model = model
+        # Bumped by every edit of the model
+        self.version = 0
+        # Digests being refreshed elsewhere and the nodes edited since
+        self._pending = None
+        self._edited = None
+        model.observers.append(self)
+        self.invalidate()
+
+    def invalidate(self):
+        """Forgets every digest, e.g. after the model was replaced wholesale."""
+        capacity = self.model.capacity()
+        self.digests = array("Q", bytes(8 * capacity))
+        # 1 where a digest must be recomputed; a stale node has stale ancestors
+        self.stale = bytearray(b"\1") * capacity
+        self._pending = None
+        self._edited = None
+
+    def copy(self, model):
+        """The digests for `model`, a copy of this one's model.
+
+        The copy does not follow edits of `model`, which is meant to stay
+        unchanged, e.g. a snapshot being saved.
+        """
+        hashes = SubtreeHashes.__new__(SubtreeHashes)
+        hashes.model = model
+        hashes.version = 0
+        hashes._pending = None
+        hashes._edited = None
+        hashes.digests = array("Q", self.digests)
+        hashes.stale = bytearray(self.stale)
+        return hashes
+
+    def begin_refresh(self, model):
+        """Returns a copy() for `model`, a copy of the model just taken, whose
+        digests another thread can compute with hex().
+
+        Edits made from now on are tracked, so that finish_refresh() can take
+        over the digests of every subtree that was not edited meanwhile.
+        """
+        self._pending = self.copy(model)
+        self._edited = bytearray(len(self.stale))
+        return self._pending
+
+    def finish_refresh(self, hashes):
+        """Adopts the digests computed in `hashes`, which begin_refresh()
+        returned; does nothing if another refresh began since."""
+        if hashes is not self._pending:
+            return
+        edited, self._pending, self._edited = self._edited, None, None
+        size = len(hashes.stale)
+        # Flag arrays are combined as big integers, which takes milliseconds
+        # even for millions of nodes
+        stale = int.from_bytes(hashes.stale, "little") \
+            | int.from_bytes(edited[:size], "little")
+        self.digests[:size] = hashes.digests
+        self.stale[:size] = stale.to_bytes(size, "little")
+
+    def _grow(self):
+        missing = self.model.capacity() - len(self.stale)
+        if missing > 0:
+            self.digests.frombytes(bytes(8 * missing))
+            self.stale.extend(b"\1" * missing)
+
+    def _mark(self, node):
+        self._grow()
+        self.version += 1
+        parent = self.model.parent
+        stale = self.stale
+        edited = self._edited
+        if edited is not None:
+            top = node
+            missing = len(stale) - len(edited)
+            if missing > 0:
+                edited.extend(bytes(missing))
+            while top != NONE and not edited[top]:
+                edited[top] = 1
+                top = parent[top]
+        while node != NONE and not stale[node]:
+            stale[node] = 1
+            node = parent[node]
+
+    # ------------------------------------------------------------------
+    #  Digests
+    # ------------------------------------------------------------------
+    def digest(self, node=ROOT):
+        """Digest of the subtree at `node`."""
+        self._grow()
+        if self.stale[node]:
+            self._refresh(node)
+        return self.digests[node]
+
+    def hex(self):
+        """Root digest as a string, as stored under HASH_KEY."""
+        return format(self.digest(ROOT), "016x")
+
+    def _refresh(self, top):
+        """Recomputes the stale nodes of the subtree at `top`, children first."""
+        model = self.model
+        text = model.text
+        body_keys = model.body_keys
+        first_child = model.first_child
+        next_sibling = model.next_sibling
+        digests = self.digests
+        stale = self.stale
+        swap = sys.byteorder != "little"
+        stack = [(top, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if not children_done:
+                stack.append((node, True))
+                child = first_child[node]
+                while child != NONE:
+                    if stale[child]:
+                        stack.append((child, False))
+                    child = next_sibling[child]
+                continue
+            data = text[node].encode("utf-8")
+            h = blake2b(len(data).to_bytes(8, "little"), digest_size=8)
+            h.update(data)
+            key = body_keys.get(node)
+            if key is not None:
+                h.update(b"body %d" % key)
+            children = array("Q")
+            child = first_child[node]
+            while child != NONE:
+                children.append(digests[child])
+                child = next_sibling[child]
+            if swap:
+                children.byteswap()
+            h.update(children.tobytes())
+            digests[node] = int.from_bytes(h.digest(), "little")
+            stale[node] = 0
+
+    # ------------------------------------------------------------------
+    #  TreeObserver
+    # ------------------------------------------------------------------
+    def node_inserted(self, model, node):
+        self._grow()
+        # Reused ids still hold the digests of the nodes they used to be
+        stale = self.stale
+        edited = self._edited
+        for child in model.iter_subtree(node):
+            stale[child] = 1
+        if edited is not None:
+            missing = len(stale) - len(edited)
+            if missing > 0:
+                edited.extend(bytes(missing))
+            for child in model.iter_subtree(node):
+                edited[child] = 1
+        self._mark(model.parent[node])
+
+    def node_removing(self, model, node):
+        self._mark(model.parent[node])
+
+    def node_moving(self, model, node):
+        self._mark(model.parent[node])
+
+    def node_moved(self, model, node, old_path):
+        self._mark(model.parent[node])
+
+    def text_changed(self, model, node, old_text):
+        self._mark(node)
+
+    def body_linked(self, model, node):
+        self._mark(node)
+
+
+def diff_trees(old, old_hashes, new, new_hashes):
+    """Yields the differences between the trees `old` and `new`.
+
+    Entries are ("removed", old path, text), ("added", new path, text) and
+    ("changed", new path, (old text, new text)). Subtrees with equal digests
+    are skipped without being visited.
+    """
+    stack = [(ROOT, ROOT, ())]
+    while stack:
+        old_node, new_node, path = stack.pop()
+        if old_hashes.digest(old_node) == new_hashes.digest(new_node):
+            continue
+        if old_node != ROOT and old.text[old_node] != new.text[new_node]:
+            yield "changed", path, (old.text[old_node], new.text[new_node])
+        old_children = list(old.children(old_node))
+        new_children = list(new.children(new_node))
+        matcher = SequenceMatcher(None, [old_hashes.digest(child) for child in old_children],
+                                  [new_hashes.digest(child) for child in new_children],
+                                  autojunk=False)
+        pairs = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            # Nodes replaced one for one are compared in depth; the rest of a
+            # replaced run counts as removed or added
+            paired = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+            for offset in range(paired):
+                pairs.append((old_children[i1 + offset], new_children[j1 + offset],
+                              path + (j1 + offset,)))
+            for index in range(i1 + paired, i2):
+                yield "removed", path + (index,), old.text[old_children[index]]
+            for index in range(j1 + paired, j2):
+                yield "added", path + (index,), new.text[new_children[index]]
+        stack.extend(reversed(pairs))
+
+
+def format_difference(entry):
+    kind, path, text = entry
+    location = "/".join(str(index) for index in path)
+    if kind == "changed":
+        return f"~ {location}: {text[0]!r} -> {text[1]!r}"
+    return f"{'-' if kind == 'removed' else '+'} {location}: {text!r}"
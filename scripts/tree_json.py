@@ -0,0 +1,456 @@
+"""
+Streaming JSON reader and writer for {"text", "children"} tree documents.
+
+The reader turns a file into a stream of parse events and feeds nodes straight
+into a TreeModel, so a document is never held as nested dicts. The writer walks
+the model and yields the JSON text in chunks. With indent=4 the output is
+byte-identical to json.dump(..., indent=4); with indent=None it is compact.
+"""
+import json
+import re
+from json.decoder import scanstring
+from json.encoder import encode_basestring_ascii
+
+from scripts.tree_model import ROOT, NONE
+from scripts.tree_validation import (LoadValidator, MISSING_TEXT, INVALID_TEXT, OVERSIZED_TEXT,
+                                     INVALID_CHILDREN, INVALID_BODY, INVALID_NODE)
+
+CHUNK_SIZE = 1 << 16
+
+START_MAP = "start_map"
+END_MAP = "end_map"
+MAP_KEY = "map_key"
+START_ARRAY = "start_array"
+END_ARRAY = "end_array"
+VALUE = "value"
+
+_TOKEN = re.compile(r'[ \t\n\r]*(?:([{}\[\]:,])|(")|'
+                    r'(-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?)|'
+                    r'(true|false|null))')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_LITERALS = {"true": True, "false": False, "null": None}
+# Characters that can end a number or literal
+_DELIMITERS = frozenset(' \t\n\r,:]}[{"')
+# What the tokenizer accepts next
+_VALUE = 0          # a value
+_VALUE_OR_END = 1   # a value or "]", right after "["
+_KEY = 2            # a key, after "," in an object
+_KEY_OR_END = 3     # a key or "}", right after "{"
+_COLON = 4          # ":" after a key
+_AFTER = 5          # "," or the end of the enclosing container
+_DONE = 6           # nothing: the top-level value is complete
+# Text of a node whose "text" key has not been read yet
+_NO_TEXT = object()
+
+
+class JsonStreamError(ValueError):
+    """Raised when the input is not well-formed JSON."""
+
+
+# ------------------------------------------------------------------
+#  Reading
+# ------------------------------------------------------------------
+def iter_events(fp, chunk_size=CHUNK_SIZE):
+    """Yields (event, value) parse events read incrementally from `fp`.
+
+    Raises JsonStreamError as soon as the input leaves the JSON grammar,
+    including a missing or misplaced "," or ":" and data after the value.
+    """
+    token = _TOKEN.match
+    containers = []
+    state = _VALUE
+    buf = fp.read(chunk_size)
+    pos = 0
+    eof = not buf
+    while True:
+        match = token(buf, pos)
+        # Refill when a token may continue past the end of the buffer. A
+        # number is complete only once a delimiter follows: "-1.25e" stops
+        # short of the end, before the 1-2 characters of an exponent
+        if not eof and (match is None or match.end() + 2 >= len(buf) and (
+                not match.group(1) and not match.group(2)
+                and (match.end() == len(buf) or buf[match.end()] not in _DELIMITERS))):
+            more = fp.read(chunk_size)
+            buf = buf[pos:] + more
+            pos = 0
+            eof = not more
+            continue
+        if match is None:
+            end = _WHITESPACE.match(buf, pos).end()
+            if end == len(buf):
+                break
+            raise JsonStreamError("Unexpected character %r at offset %d" % (buf[end], end))
+        punct, quote, number, literal = match.groups()
+        if state == _DONE:
+            raise JsonStreamError("Unexpected data after the document")
+        pos = match.end()
+        if punct:
+            if punct == ",":
+                if state != _AFTER or not containers:
+                    raise JsonStreamError("Unexpected ','")
+                state = _KEY if containers[-1] == "{" else _VALUE
+            elif punct == ":":
+                if state != _COLON:
+                    raise JsonStreamError("Unexpected ':'")
+                state = _VALUE
+            elif punct == "{" or punct == "[":
+                if state != _VALUE and state != _VALUE_OR_END:
+                    raise JsonStreamError("Unexpected %r" % punct)
+                containers.append(punct)
+                if punct == "{":
+                    state = _KEY_OR_END
+                    yield START_MAP, None
+                else:
+                    state = _VALUE_OR_END
+                    yield START_ARRAY, None
+            elif punct == "}":
+                if state != _AFTER and state != _KEY_OR_END \
+                        or not containers or containers.pop() != "{":
+                    raise JsonStreamError("Unexpected '}'")
+                state = _AFTER if containers else _DONE
+                yield END_MAP, None
+            else:
+                if state != _AFTER and state != _VALUE_OR_END \
+                        or not containers or containers.pop() != "[":
+                    raise JsonStreamError("Unexpected ']'")
+                state = _AFTER if containers else _DONE
+                yield END_ARRAY, None
+            continue
+        if quote:
+            while True:
+                try:
+                    value, pos = scanstring(buf, pos)
+                    break
+                except json.JSONDecodeError:
+                    more = fp.read(chunk_size) if not eof else ""
+                    if not more:
+                        raise JsonStreamError("Unterminated string")
+                    buf = buf[pos:] + more
+                    pos = 0
+            if state == _KEY or state == _KEY_OR_END:
+                state = _COLON
+                yield MAP_KEY, value
+            elif state == _VALUE or state == _VALUE_OR_END:
+                state = _AFTER if containers else _DONE
+                yield VALUE, value
+            else:
+                raise JsonStreamError("Unexpected string")
+        elif state != _VALUE and state != _VALUE_OR_END:
+            if state == _KEY or state == _KEY_OR_END:
+                raise JsonStreamError("Object keys must be strings")
+            raise JsonStreamError("Unexpected %r" % (number or literal))
+        else:
+            state = _AFTER if containers else _DONE
+            if number:
+                if "." in number or "e" in number or "E" in number:
+                    yield VALUE, float(number)
+                else:
+                    yield VALUE, int(number)
+            else:
+                yield VALUE, _LITERALS[literal]
+        if pos > chunk_size:
+            buf = buf[pos:]
+            pos = 0
+    if containers or state == _COLON:
+        raise JsonStreamError("Unexpected end of document")
+
+
+def read_value(events, event, value):
+    """Builds the Python value that starts with the already-read `event`."""
+    if event == VALUE:
+        return value
+    root = {} if event == START_MAP else []
+    stack = [root]
+    key = None
+    for event, value in events:
+        container = stack[-1]
+        if event == MAP_KEY:
+            key = value
+            continue
+        if event in (END_MAP, END_ARRAY):
+            stack.pop()
+            if not stack:
+                return root
+            continue
+        if event == START_MAP:
+            value = {}
+        elif event == START_ARRAY:
+            value = []
+        if isinstance(container, dict):
+            container[key] = value
+        else:
+            container.append(value)
+        if event in (START_MAP, START_ARRAY):
+            stack.append(value)
+    raise JsonStreamError("Unexpected end of document")
+
+
+def skip_value(events, event):
+    """Consumes the value that starts with the already-read `event`."""
+    if event not in (START_MAP, START_ARRAY):
+        return
+    depth = 1
+    for event, _ in events:
+        if event in (START_MAP, START_ARRAY):
+            depth += 1
+        elif event in (END_MAP, END_ARRAY):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def _describe(event, value):
+    if event == START_MAP:
+        return "an object"
+    if event == START_ARRAY:
+        return "an array"
+    return "null" if value is None else type(value).__name__
+
+
+def _repair_text(model, node, event, value, events, validator):
+    """Text for `node` from a "text" value that is not a string of allowed length."""
+    if event == VALUE and value.__class__ is str:
+        kind, detail = OVERSIZED_TEXT, f"{len(value)} characters"
+        repaired = value[:validator.max_text]
+    else:
+        kind, detail = INVALID_TEXT, _describe(event, value)
+        if event == VALUE:
+            repaired = "" if value is None else json.dumps(value)
+        else:
+            skip_value(events, event)
+            repaired = ""
+    if validator.report(kind, model, node, detail):
+        validator.doomed.add(node)
+    return repaired
+
+
+def read_nodes(events, model, parent, intern=None, validator=None):
+    """Streams a node array, whose START_ARRAY was already read, into `model`.
+
+    Nodes are appended to `parent`; keys other than "text" and "children" are
+    skipped. This is a bulk load, so text is stored without notifying
+    observers; callers load into a muted model and refresh their views.
+    Texts are passed through `intern`, e.g. StringPool.intern, if given.
+
+    Malformed nodes are handled by `validator` (see tree_validation), which
+    by default repairs them.
+    """
+    if validator is None:
+        validator = LoadValidator()
+    max_text = validator.max_text
+    doomed = validator.doomed
+    append = model.append
+    text = model.text
+    body_keys = model.body_keys
+    node_parent = model.parent
+    stack = [parent]
+    node = NONE
+    for event, value in events:
+        if event == START_MAP:
+            node = append(stack[-1], _NO_TEXT)
+        elif event == MAP_KEY:
+            event, child = next(events)
+            if value == "text":
+                if event != VALUE or child.__class__ is not str or len(child) > max_text:
+                    child = _repair_text(model, node, event, child, events, validator)
+                text[node] = child if intern is None else intern(child)
+            elif value == "children" and event == START_ARRAY:
+                stack.append(node)
+            elif value == "children":
+                if validator.report(INVALID_CHILDREN, model, node, _describe(event, child)):
+                    doomed.add(node)
+                skip_value(events, event)
+            elif value == "body":
+                if event == VALUE and child.__class__ is int and child >= 0:
+                    body_keys[node] = child
+                else:
+                    if validator.report(INVALID_BODY, model, node, _describe(event, child)):
+                        doomed.add(node)
+                    skip_value(events, event)
+            else:
+                skip_value(events, event)
+        elif event == END_MAP:
+            if text[node] is _NO_TEXT:
+                text[node] = ""
+                if validator.report(MISSING_TEXT, model, node):
+                    doomed.add(node)
+            complete = node
+            node = node_parent[node]
+            if doomed and complete in doomed:
+                doomed.discard(complete)
+                model.remove(complete)
+        elif event == END_ARRAY:
+            node = stack.pop()
+            if not stack:
+                return
+        else:
+            # Only objects belong in a node array; a string can still become a node
+            drop = validator.report(INVALID_NODE, model, stack[-1], _describe(event, value))
+            if event == VALUE and value.__class__ is str and not drop:
+                value = value[:max_text]
+                append(stack[-1], value if intern is None else intern(value))
+            else:
+                skip_value(events, event)
+    raise JsonStreamError("Unexpected end of document")
+
+
+def read_document(fp, model, parent=None, intern=None, validator=None):
+    """Loads a configuration.json or tree.json document from `fp`.
+
+    Tree nodes are streamed into `model` below `parent` (the root when None);
+    pass model=None to skip the tree. Returns the other top-level keys of a
+    configuration document, e.g. {"settings": {...}}. Malformed nodes are
+    reported to `validator`, see read_nodes.
+    """
+    if parent is None:
+        parent = ROOT
+    events = iter_events(fp)
+    extra = {}
+    event, value = next(events, (None, None))
+    if event == START_ARRAY:
+        if model is None:
+            skip_value(events, event)
+        else:
+            read_nodes(events, model, parent, intern, validator)
+    elif event == START_MAP:
+        for event, key in events:
+            if event == END_MAP:
+                break
+            event, value = next(events)
+            if key == "tree" and event == START_ARRAY and model is not None:
+                read_nodes(events, model, parent, intern, validator)
+            elif key == "tree":
+                skip_value(events, event)
+            else:
+                extra[key] = read_value(events, event, value)
+    elif event is not None:
+        raise JsonStreamError("Expected an object or an array")
+    if next(events, None) is not None:
+        raise JsonStreamError("Unexpected data after the document")
+    return extra
+
+
+# ------------------------------------------------------------------
+#  Writing
+# ------------------------------------------------------------------
+def _layout(indent):
+    """Returns (newline-and-indent function, item separator, key separator)."""
+    if indent is None:
+        return (lambda level: ""), ",", ":"
+    pads = {}
+
+    def pad(level):
+        if level not in pads:
+            pads[level] = "\n" + " " * (indent * level)
+        return pads[level]
+    return pad, ",", ": "
+
+
+def iter_tree_chunks(model, node=ROOT, indent=4, level=0, progress=None,
+                     chunk_size=CHUNK_SIZE, fragments=None):
+    """Yields the JSON text of the children of `node` as a node array.
+
+    `level` is the indentation level of the line the array starts on, so a
+    subtree can be written in place inside a larger document. `progress`, if
+    given, is called with the number of nodes written before each chunk.
+
+    `fragments` may map nodes to chunks holding the finished text of their
+    child arrays, which are copied instead of being encoded here; see
+    parallel_json.
+    """
+    if fragments is not None and node in fragments:
+        yield from fragments[node]
+        return
+    pad, comma, colon = _layout(indent)
+    text = model.text
+    body_keys = model.body_keys
+    first_child = model.first_child
+    next_sibling = model.next_sibling
+    text_key = '"text"' + colon
+    body_key = '"body"' + colon
+    children_key = '"children"' + colon
+    child = first_child[node]
+    if child == NONE:
+        yield "[]"
+        return
+    out = ["["]
+    size = 0
+    written = 0
+    stack = []
+    while True:
+        size += 1
+        if size >= chunk_size // 16:
+            written += size
+            if progress is not None:
+                progress(written)
+            yield "".join(out)
+            out = []
+            size = 0
+        out.append(pad(level + 1))
+        out.append("{")
+        out.append(pad(level + 2))
+        out.append(text_key)
+        out.append(encode_basestring_ascii(text[child]))
+        out.append(comma)
+        if body_keys and child in body_keys:
+            out.append(pad(level + 2))
+            out.append(body_key)
+            out.append("%d" % body_keys[child])
+            out.append(comma)
+        out.append(pad(level + 2))
+        out.append(children_key)
+        if first_child[child] == NONE:
+            out.append("[]")
+        elif fragments is None or child not in fragments:
+            out.append("[")
+            stack.append((child, level))
+            level += 2
+            child = first_child[child]
+            continue
+        else:
+            yield "".join(out)
+            out = []
+            yield from fragments[child]
+        out.append(pad(level + 1))
+        out.append("}")
+        while next_sibling[child] == NONE:
+            out.append(pad(level))
+            out.append("]")
+            if not stack:
+                yield "".join(out)
+                return
+            child, level = stack.pop()
+            out.append(pad(level + 1))
+            out.append("}")
+        out.append(comma)
+        child = next_sibling[child]
+
+
+def _dump_value(value, indent, level):
+    if indent is None:
+        return json.dumps(value, separators=(",", ":"))
+    return json.dumps(value, indent=indent).replace("\n", "\n" + " " * (indent * level))
+
+
+def iter_document_chunks(model, extra=None, indent=4, progress=None, fragments=None):
+    """Yields a configuration document: the tree first, then `extra` keys."""
+    pad, comma, colon = _layout(indent)
+    yield "{" + pad(1) + '"tree"' + colon
+    yield from iter_tree_chunks(model, ROOT, indent, 1, progress, fragments=fragments)
+    for key, value in (extra or {}).items():
+        if key == "tree":
+            continue
+        yield comma + pad(1) + encode_basestring_ascii(key) + colon + _dump_value(value, indent, 1)
+    yield pad(0) + "}"
+
+
+def write_document(fp, model, extra=None, indent=4):
+    """Writes a configuration document for `model` to the text file `fp`."""
+    for chunk in iter_document_chunks(model, extra, indent):
+        fp.write(chunk)
+
+
+def write_tree(fp, model, node=ROOT, indent=4):
+    """Writes the children of `node` as a bare node array, like tree.json."""
+    for chunk in iter_tree_chunks(model, node, indent):
+        fp.write(chunk)
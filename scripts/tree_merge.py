@@ -0,0 +1,254 @@
+"""
+Three-way merge of a document changed on disk into the open one.
+
+The merge base is a copy of the tree as it was last loaded or saved, so it
+shares the node ids of the open model. diff_ops() compares the base with the
+tree now on disk the way tree_hash.diff_trees does, skipping every subtree
+whose digest did not change, and describes the differences as operations on
+base ids. apply_ops() replays them on the open model through the undo
+history, so the view and the other observers update only the rows that
+changed and the whole merge is one undo step.
+
+LocalChanges records which base nodes were edited here since the base was
+taken. Where both sides changed the same thing the local edit is kept and
+the operation is reported as a conflict:
+
+    text        changed on both sides to different texts
+    removal     of a branch that was edited, moved or added to here
+    addition    below a node that was removed here
+"""
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+
+from scripts.tree_model import ROOT, NONE, TreeObserver
+from scripts.clipboard import SubtreeClip
+
+# Operation kinds
+TEXT = "text"
+REMOVE = "remove"
+ADD = "add"
+
+# Least difflib ratio between the texts of a node and its edited version
+SIMILAR_TEXT = 0.6
+# Most text comparisons spent pairing the children of one replaced run
+PAIRING_BUDGET = 10000
+
+
+class LocalChanges(TreeObserver):
+    """Nodes edited in the open model since the merge base was taken."""
+
+    def __init__(self):
+        self.recording = True
+        # Ids linked in here; they may reuse the ids of removed base nodes
+        self.added = set()
+        # Edited nodes and their ancestors at the time of the edit
+        self.touched = set()
+
+    def reset(self):
+        """Starts over from a new base; returns what was recorded so far."""
+        previous = self.added, self.touched
+        self.added = set()
+        self.touched = set()
+        return previous
+
+    def restore(self, previous):
+        """Adds back what reset() returned, e.g. when a save failed."""
+        added, touched = previous
+        self.added |= added
+        self.touched |= touched
+
+    def __bool__(self):
+        return bool(self.touched)
+
+    @contextmanager
+    def paused(self):
+        """Edits made inside the block are not local changes."""
+        self.recording = False
+        try:
+            yield self
+        finally:
+            self.recording = True
+
+    def _touch(self, model, node):
+        parent = model.parent
+        touched = self.touched
+        # The node may be touched already under another parent, having been
+        # moved or having reused the id of a removed node
+        touched.add(node)
+        node = parent[node]
+        while node != NONE and node not in touched:
+            touched.add(node)
+            node = parent[node]
+
+    # ------------------------------------------------------------------
+    #  TreeObserver
+    # ------------------------------------------------------------------
+    def node_inserted(self, model, node):
+        if self.recording:
+            self.added.update(model.iter_subtree(node))
+            self._touch(model, node)
+
+    def node_removing(self, model, node):
+        if self.recording:
+            self._touch(model, node)
+
+    def node_moving(self, model, node):
+        if self.recording:
+            self._touch(model, node)
+
+    def node_moved(self, model, node, old_path):
+        if self.recording:
+            self._touch(model, node)
+
+    def text_changed(self, model, node, old_text):
+        if self.recording:
+            self._touch(model, node)
+
+    def body_linked(self, model, node):
+        if self.recording:
+            self._touch(model, node)
+
+
+def diff_ops(base, base_hashes, theirs, their_hashes, task=None):
+    """Returns the operations that turn the tree `base` into `theirs`.
+
+    Operations are (TEXT, node, new text), (REMOVE, node, None) and
+    (ADD, parent, (anchor, clip)), which adds the SubtreeClip `clip` below
+    `parent` before the base child `anchor`, or last for NONE. Nodes are ids
+    of `base`. Unchanged subtrees are skipped without being visited, so the
+    work grows with the size of the difference rather than of the tree once
+    both sets of digests are known.
+    """
+    ops = []
+    stack = [(ROOT, ROOT)]
+    while stack:
+        if task is not None:
+            task.check()
+        old_node, new_node = stack.pop()
+        if base_hashes.digest(old_node) == their_hashes.digest(new_node):
+            continue
+        if old_node != ROOT and base.text[old_node] != theirs.text[new_node]:
+            ops.append((TEXT, old_node, theirs.text[new_node]))
+        old_children = list(base.children(old_node))
+        new_children = list(theirs.children(new_node))
+        matcher = SequenceMatcher(None, [base_hashes.digest(child) for child in old_children],
+                                  [their_hashes.digest(child) for child in new_children],
+                                  autojunk=False)
+        pairs = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            old_run = old_children[i1:i2]
+            new_run = new_children[j1:j2]
+            # Only children that are the same node on both sides are merged in
+            # depth; pairing by position would graft edits onto other branches
+            run_pairs = _pair_run(base, base_hashes, old_run, theirs, their_hashes, new_run)
+            paired_old = {i for i, _ in run_pairs}
+            for index, child in enumerate(old_run):
+                if index not in paired_old:
+                    ops.append((REMOVE, child, None))
+            # New children go before the next paired child, or before the
+            # child after the run, which both trees share
+            anchors = [old_children[i2] if i2 < len(old_children) else NONE] * len(new_run)
+            start = 0
+            for i, j in run_pairs:
+                anchors[start:j] = [old_run[i]] * (j - start)
+                start = j + 1
+            paired_new = {j for _, j in run_pairs}
+            for index, child in enumerate(new_run):
+                if index not in paired_new:
+                    ops.append((ADD, old_node, (anchors[index],
+                                                SubtreeClip.from_model(theirs, child))))
+            pairs.extend((old_run[i], new_run[j]) for i, j in run_pairs)
+        stack.extend(reversed(pairs))
+    return ops
+
+
+def _pair_run(base, base_hashes, old, theirs, their_hashes, new):
+    """Pairs of indices into `old` and `new`, the children of a replaced run,
+    that are the same node edited on one side; in order on both sides.
+
+    Children with equal texts are paired first. Between those, a child pairs
+    with the first later one whose text is similar or whose children are the
+    same. The others are not paired.
+    """
+    old_texts = [base.text[node] for node in old]
+    new_texts = [theirs.text[node] for node in new]
+    matcher = SequenceMatcher(None, old_texts, new_texts, autojunk=False)
+    pairs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            pairs.extend(zip(range(i1, i2), range(j1, j2)))
+        elif tag == "replace" and (i2 - i1) * (j2 - j1) <= PAIRING_BUDGET:
+            start = j1
+            for i in range(i1, i2):
+                old_digests = None
+                for j in range(start, j2):
+                    texts = SequenceMatcher(None, old_texts[i], new_texts[j], autojunk=False)
+                    if texts.real_quick_ratio() >= SIMILAR_TEXT \
+                            and texts.quick_ratio() >= SIMILAR_TEXT \
+                            and texts.ratio() >= SIMILAR_TEXT:
+                        break
+                    if old_digests is None:
+                        old_digests = [base_hashes.digest(child)
+                                       for child in base.children(old[i])]
+                    if old_digests and old_digests == [their_hashes.digest(child)
+                                                       for child in theirs.children(new[j])]:
+                        break
+                else:
+                    continue
+                pairs.append((i, j))
+                start = j + 1
+    return pairs
+
+
+def apply_ops(ops, base, model, local, history, label="External changes"):
+    """Applies diff_ops() output to `model` as one undo step.
+
+    `base` is the tree the operations were computed from and `local` the
+    LocalChanges of `model` since then. Returns the number of operations
+    applied and a description of each conflict, where the local side was kept.
+    """
+    capacity = base.capacity()
+
+    def same(node):
+        """True if base node `node` is still in the document here."""
+        if node == ROOT:
+            return True
+        return node < capacity and node not in local.added and model.is_attached(node)
+
+    def where(node):
+        return "/".join(str(index) for index in base.path(node)) or "top level"
+
+    applied = 0
+    conflicts = []
+    with local.paused(), history.transaction(label):
+        for kind, node, value in ops:
+            if kind == TEXT:
+                if not same(node):
+                    conflicts.append(f"{where(node)}: changed there, removed here")
+                elif model.text[node] == base.text[node]:
+                    history.set_text(node, value)
+                    applied += 1
+                elif model.text[node] != value:
+                    conflicts.append(f"{where(node)}: changed on both sides")
+            elif kind == REMOVE:
+                if not same(node):
+                    # Removed on both sides
+                    continue
+                if node in local.touched:
+                    conflicts.append(f"{where(node)}: removed there, changed here")
+                    continue
+                history.remove(node)
+                applied += 1
+            else:
+                anchor, clip = value
+                if not same(node):
+                    conflicts.append(f"{where(node)}: added to there, removed here")
+                    continue
+                # Fall back to the next base sibling still in place, then to the end
+                while anchor != NONE and not (same(anchor) and model.parent[anchor] == node):
+                    anchor = base.next_sibling[anchor]
+                history.attach(clip.build(model), node, anchor)
+                applied += 1
+    return applied, conflicts
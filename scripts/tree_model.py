@@ -0,0 +1,378 @@
+"""
+In-memory tree model for the Tree-Document-Editor.
+
+Nodes are integer ids indexing parallel parent / first-child / last-child /
+next-sibling / previous-sibling tables, so walking or building a tree never
+recurses and never touches GTK. Id 0 is a hidden root whose children are the
+top-level nodes of the document.
+"""
+from array import array
+from contextlib import contextmanager
+
+ROOT = 0
+NONE = -1
+
+
+class TreeObserver:
+    """Base class for objects that follow edits made through a TreeModel."""
+
+    def node_inserted(self, model, node):
+        """Called after `node` (and any subtree below it) was linked in."""
+
+    def node_removing(self, model, node):
+        """Called while `node` is still linked, just before it is removed."""
+
+    def text_changed(self, model, node, old_text):
+        """Called after the text of `node` changed from `old_text`."""
+
+    def node_moving(self, model, node):
+        """Called before the subtree at `node` is relinked elsewhere."""
+
+    def node_moved(self, model, node, old_path):
+        """Called after the subtree at `node` was moved away from `old_path`."""
+
+    def body_linked(self, model, node):
+        """Called after `node` was given the content store key of a body."""
+
+
+class TreeModel:
+    """Array-backed ordered tree of text nodes."""
+
+    __slots__ = ("parent", "first_child", "last_child", "next_sibling",
+                 "prev_sibling", "text", "body_keys", "observers", "_free", "_count")
+
+    def __init__(self):
+        self.parent = array("i", [NONE])
+        self.first_child = array("i", [NONE])
+        self.last_child = array("i", [NONE])
+        self.next_sibling = array("i", [NONE])
+        self.prev_sibling = array("i", [NONE])
+        self.text = [""]
+        # Content store keys of the few nodes that have a body
+        self.body_keys = {}
+        self.observers = []
+        self._free = []
+        self._count = 0
+
+    def __len__(self):
+        """Number of live nodes, not counting the hidden root."""
+        return self._count
+
+    def clear(self):
+        """Removes every node without notifying observers."""
+        for table in (self.parent, self.first_child, self.last_child,
+                      self.next_sibling, self.prev_sibling):
+            del table[1:]
+        self.first_child[ROOT] = NONE
+        self.last_child[ROOT] = NONE
+        self.text = [""]
+        self.body_keys = {}
+        self._free = []
+        self._count = 0
+
+    def copy(self):
+        """Returns an independent snapshot of the nodes, without observers."""
+        clone = TreeModel()
+        clone.parent = array("i", self.parent)
+        clone.first_child = array("i", self.first_child)
+        clone.last_child = array("i", self.last_child)
+        clone.next_sibling = array("i", self.next_sibling)
+        clone.prev_sibling = array("i", self.prev_sibling)
+        clone.text = self.text.copy()
+        clone.body_keys = dict(self.body_keys)
+        clone._free = list(self._free)
+        clone._count = self._count
+        return clone
+
+    def adopt(self, other):
+        """Takes over the nodes of `other` without copying or notifying."""
+        self.parent = other.parent
+        self.first_child = other.first_child
+        self.last_child = other.last_child
+        self.next_sibling = other.next_sibling
+        self.prev_sibling = other.prev_sibling
+        self.text = other.text
+        self.body_keys = other.body_keys
+        self._free = other._free
+        self._count = other._count
+
+    @contextmanager
+    def muted(self):
+        """Suspends observer notifications, e.g. while bulk loading."""
+        observers = self.observers
+        self.observers = []
+        try:
+            yield self
+        finally:
+            self.observers = observers
+
+    def capacity(self):
+        """Size of the node tables, including freed slots and the root."""
+        return len(self.text)
+
+    def is_alive(self, node):
+        return 0 < node < len(self.text) and self.text[node] is not None
+
+    def is_attached(self, node):
+        """True if `node` is alive and linked into the document."""
+        if not self.is_alive(node):
+            return False
+        parent = self.parent
+        while node != ROOT:
+            node = parent[node]
+            if node == NONE:
+                return False
+        return True
+
+    def is_ancestor(self, ancestor, node):
+        """True if `node` lies in the subtree at `ancestor` (or is it)."""
+        parent = self.parent
+        while node != NONE:
+            if node == ancestor:
+                return True
+            node = parent[node]
+        return False
+
+    # ------------------------------------------------------------------
+    #  Navigation
+    # ------------------------------------------------------------------
+    def has_children(self, node):
+        return self.first_child[node] != NONE
+
+    def children(self, node=ROOT):
+        """Yields the direct children of `node` in order."""
+        child = self.first_child[node]
+        next_sibling = self.next_sibling
+        while child != NONE:
+            yield child
+            child = next_sibling[child]
+
+    def child_count(self, node=ROOT):
+        count = 0
+        for _ in self.children(node):
+            count += 1
+        return count
+
+    def iter_subtree(self, node=ROOT):
+        """Yields `node` and all of its descendants in pre-order."""
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        parent = self.parent
+        yield node
+        current = first_child[node]
+        while current != NONE:
+            yield current
+            if first_child[current] != NONE:
+                current = first_child[current]
+                continue
+            while current != node and next_sibling[current] == NONE:
+                current = parent[current]
+            if current == node:
+                break
+            current = next_sibling[current]
+
+    def depth(self, node):
+        """Depth of `node`, top-level nodes being depth 1."""
+        depth = 0
+        parent = self.parent
+        while node != ROOT:
+            node = parent[node]
+            depth += 1
+        return depth
+
+    def index_of(self, node):
+        """Position of `node` among its siblings."""
+        index = 0
+        prev_sibling = self.prev_sibling
+        node = prev_sibling[node]
+        while node != NONE:
+            index += 1
+            node = prev_sibling[node]
+        return index
+
+    def nth_child(self, node, index):
+        for position, child in enumerate(self.children(node)):
+            if position == index:
+                return child
+        return NONE
+
+    def path(self, node):
+        """Sibling indices from the root down to `node`, like a Gtk.TreePath."""
+        indices = []
+        parent = self.parent
+        while node != ROOT:
+            indices.append(self.index_of(node))
+            node = parent[node]
+        indices.reverse()
+        return tuple(indices)
+
+    def node_at(self, path):
+        """Inverse of `path`; returns NONE if the path does not exist."""
+        node = ROOT
+        for index in path:
+            node = self.nth_child(node, index)
+            if node == NONE:
+                break
+        return node
+
+    # ------------------------------------------------------------------
+    #  Editing
+    # ------------------------------------------------------------------
+    def _allocate(self, text):
+        if self._free:
+            node = self._free.pop()
+            self.text[node] = text
+            self.first_child[node] = NONE
+            self.last_child[node] = NONE
+        else:
+            node = len(self.text)
+            self.text.append(text)
+            self.parent.append(NONE)
+            self.first_child.append(NONE)
+            self.last_child.append(NONE)
+            self.next_sibling.append(NONE)
+            self.prev_sibling.append(NONE)
+        self._count += 1
+        return node
+
+    def _link(self, node, parent, before):
+        """Links a detached `node` under `parent`, ahead of `before` or last."""
+        self.parent[node] = parent
+        if before == NONE:
+            prev = self.last_child[parent]
+            self.last_child[parent] = node
+        else:
+            prev = self.prev_sibling[before]
+            self.prev_sibling[before] = node
+        self.prev_sibling[node] = prev
+        self.next_sibling[node] = before
+        if prev == NONE:
+            self.first_child[parent] = node
+        else:
+            self.next_sibling[prev] = node
+
+    def _unlink(self, node):
+        parent = self.parent[node]
+        prev = self.prev_sibling[node]
+        nxt = self.next_sibling[node]
+        if prev == NONE:
+            self.first_child[parent] = nxt
+        else:
+            self.next_sibling[prev] = nxt
+        if nxt == NONE:
+            self.last_child[parent] = prev
+        else:
+            self.prev_sibling[nxt] = prev
+        self.parent[node] = NONE
+        self.prev_sibling[node] = NONE
+        self.next_sibling[node] = NONE
+
+    def append(self, parent, text):
+        """Adds a last child to `parent` and returns its id."""
+        node = self._allocate(text)
+        self._link(node, parent, NONE)
+        for observer in self.observers:
+            observer.node_inserted(self, node)
+        return node
+
+    def insert(self, parent, text, before=NONE):
+        """Adds a child to `parent` ahead of the sibling `before`."""
+        node = self._allocate(text)
+        self._link(node, parent, before)
+        for observer in self.observers:
+            observer.node_inserted(self, node)
+        return node
+
+    def remove(self, node):
+        """Removes `node` and its whole subtree, freeing their ids."""
+        self.detach(node)
+        self.free(node)
+
+    def subtree_size(self, node):
+        count = 0
+        for _ in self.iter_subtree(node):
+            count += 1
+        return count
+
+    def detach(self, node):
+        """Unlinks the subtree at `node` but keeps its ids and text.
+
+        A detached subtree can be linked back with attach(), which is how
+        undo restores removed branches without copying them.
+        """
+        for observer in self.observers:
+            observer.node_removing(self, node)
+        self._unlink(node)
+        self._count -= self.subtree_size(node)
+
+    def attach(self, node, parent, before=NONE):
+        """Links a detached subtree under `parent`, ahead of `before` or last."""
+        self._link(node, parent, before)
+        self._count += self.subtree_size(node)
+        for observer in self.observers:
+            observer.node_inserted(self, node)
+
+    def move(self, node, parent, before=NONE):
+        """Relinks the subtree at `node` under `parent`, ahead of `before` or last.
+
+        Only the links around `node` change, so the cost does not depend on
+        the size of the subtree.
+        """
+        if before == node:
+            return
+        if self.is_ancestor(node, parent):
+            raise ValueError("Cannot move a node into its own subtree")
+        old_path = self.path(node) if self.observers else None
+        for observer in self.observers:
+            observer.node_moving(self, node)
+        self._unlink(node)
+        self._link(node, parent, before)
+        for observer in self.observers:
+            observer.node_moved(self, node, old_path)
+
+    def create_branch(self, texts, depths):
+        """Builds a detached branch from pre-order `texts` and `depths`.
+
+        Depths are relative to the first node, which must be 0 and is the
+        returned top of the branch; link it in with attach().
+        """
+        ancestors = []
+        for text, depth in zip(texts, depths):
+            node = self._allocate(text)
+            del ancestors[depth:]
+            if ancestors:
+                self._link(node, ancestors[-1], NONE)
+            else:
+                self.parent[node] = NONE
+                self.prev_sibling[node] = NONE
+                self.next_sibling[node] = NONE
+            ancestors.append(node)
+        # Detached nodes are counted once attached
+        self._count -= len(texts)
+        return ancestors[0]
+
+    def free(self, node):
+        """Releases the ids of the detached subtree at `node` for reuse."""
+        freed = list(self.iter_subtree(node))
+        text = self.text
+        for child in freed:
+            text[child] = None
+        if self.body_keys:
+            for child in freed:
+                self.body_keys.pop(child, None)
+        self._free.extend(freed)
+
+    def set_body_key(self, node, key):
+        """Links `node` to the body stored under `key` in the content store."""
+        self.body_keys[node] = key
+        for observer in self.observers:
+            observer.body_linked(self, node)
+
+    def get_text(self, node):
+        return self.text[node]
+
+    def set_text(self, node, text):
+        old_text = self.text[node]
+        self.text[node] = text
+        for observer in self.observers:
+            observer.text_changed(self, node, old_text)
@@ -0,0 +1,364 @@
+"""
+SQLite storage for tree documents (.sqlite).
+
+Schema:
+
+    nodes   id INTEGER PRIMARY KEY    the TreeModel node id (the hidden root,
+                                      id 0, is not stored)
+            parent_id INTEGER         0 for top-level nodes
+            position REAL             orders siblings; only relative order counts
+            text TEXT
+            body INTEGER              content store key, see content_store
+    meta    key TEXT PRIMARY KEY      "extra" holds the non-tree keys as JSON,
+            value TEXT                "bare" is "1" for a converted tree.json
+
+Node ids are kept as they are in the model, so an open SqliteDocument can
+mirror every model edit as a small transaction on the affected rows instead of
+rewriting the document, and any subtree can be read without loading the rest.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+from array import array
+
+from scripts.tree_model import ROOT, NONE, TreeObserver
+from scripts.tree_validation import (LoadValidator, INVALID_TEXT, OVERSIZED_TEXT, INVALID_BODY,
+                                     is_body_key)
+from scripts.file_utils import fsync_directory
+
+EXTENSION = ".sqlite"
+MAGIC = b"SQLite format 3\0"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER NOT NULL,
+    position REAL NOT NULL,
+    text TEXT NOT NULL,
+    body INTEGER
+);
+CREATE INDEX IF NOT EXISTS nodes_children ON nodes (parent_id, position);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+# Rows fetched per round trip while loading
+_BATCH = 10000
+
+
+def is_sqlite(path):
+    """True for an SQLite document, or a path that should become one."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return path.lower().endswith(EXTENSION)
+
+
+def _connect(path):
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.executescript(_SCHEMA)
+    return db
+
+
+def _rows(model, node, position):
+    """Yields the rows of the subtree at `node`, placed at `position`."""
+    text = model.text
+    body_keys = model.body_keys
+    parent = model.parent
+    next_sibling = model.next_sibling
+    first_child = model.first_child
+    yield node, parent[node], position, text[node], body_keys.get(node)
+    stack = [first_child[node]]
+    while stack:
+        child = stack.pop()
+        index = 0
+        while child != NONE:
+            yield child, parent[child], index, text[child], body_keys.get(child)
+            if first_child[child] != NONE:
+                stack.append(first_child[child])
+            child = next_sibling[child]
+            index += 1
+
+
+# ------------------------------------------------------------------
+#  Whole-document import and export
+# ------------------------------------------------------------------
+def write_sqlite(path, model, extra, bare=False, task=None):
+    """Writes `model` and the `extra` keys to a new SQLite document at `path`.
+
+    The database is built in a temporary file that replaces `path` once
+    complete, like file_utils.atomic_write.
+    """
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".",
+                                     suffix=".tmp", dir=directory)
+    os.close(fd)
+    total = len(model) or 1
+    try:
+        db = _connect(temp_path)
+        try:
+            with db:
+                rows = []
+                written = 0
+                for index, child in enumerate(model.children(ROOT)):
+                    for row in _rows(model, child, index):
+                        rows.append(row)
+                        if len(rows) >= _BATCH:
+                            db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?)", rows)
+                            written += len(rows)
+                            rows = []
+                            if task is not None:
+                                task.check()
+                                task.report(written / total)
+                db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?)", rows)
+                db.executemany("INSERT INTO meta VALUES (?, ?)",
+                               [("extra", json.dumps(extra)), ("bare", "1" if bare else "0")])
+        finally:
+            db.close()
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+
+def read_sqlite(path, model, task=None, intern=None, validator=None):
+    """Loads the SQLite document at `path` into the empty `model`; returns its extra keys.
+
+    Node ids are preserved, so an SqliteDocument on the same file can follow
+    later edits of `model`.
+    """
+    document = SqliteDocument(path)
+    try:
+        return document.read(model, task, intern, validator)
+    finally:
+        document.close()
+
+
+def is_bare_sqlite(path):
+    document = SqliteDocument(path)
+    try:
+        return document.meta("bare") == "1"
+    finally:
+        document.close()
+
+
+# ------------------------------------------------------------------
+#  Open documents
+# ------------------------------------------------------------------
+class SqliteDocument(TreeObserver):
+    """An open SQLite document.
+
+    Added to a model's observers, it writes each edit through as its own
+    transaction touching only the rows of the edited nodes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = _connect(path)
+        # Edits are written one by one, where the write-ahead log is fastest
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    def close(self):
+        self.db.close()
+
+    def meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def save_extra(self, extra):
+        """Stores the non-tree keys; the nodes are already up to date."""
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('extra', ?)",
+                            (json.dumps(extra),))
+
+    # ------------------------------------------------------------------
+    #  Reading
+    # ------------------------------------------------------------------
+    def read(self, model, task=None, intern=None, validator=None):
+        """Loads every node into the empty `model`; returns the extra keys.
+
+        Malformed rows, and nodes the root cannot reach through their parent
+        ids, are reported to `validator` (see tree_validation).
+        """
+        if validator is None:
+            validator = LoadValidator()
+        max_text = validator.max_text
+        db = self.db
+        # Parent ids of missing rows still need a slot, and negative ones get
+        # the spare last slot, which no row uses
+        highest = db.execute("SELECT max(max(id), max(parent_id)) FROM nodes").fetchone()[0]
+        capacity = (highest or 0) + 2
+        total = db.execute("SELECT count(*) FROM nodes").fetchone()[0] or 1
+        parent = array("i", [NONE]) * capacity
+        first_child = array("i", [NONE]) * capacity
+        last_child = array("i", [NONE]) * capacity
+        next_sibling = array("i", [NONE]) * capacity
+        prev_sibling = array("i", [NONE]) * capacity
+        text = [None] * capacity
+        text[ROOT] = ""
+        body_keys = {}
+        count = 0
+        # The index returns each parent's children together and in order, so
+        # every row is linked as the last child of its parent
+        cursor = db.execute("SELECT id, CASE WHEN parent_id >= 0 THEN parent_id ELSE ? END, "
+                            "text, body FROM nodes ORDER BY parent_id, position",
+                            (capacity - 1,))
+        while True:
+            if task is not None:
+                task.check()
+            rows = cursor.fetchmany(_BATCH)
+            if not rows:
+                break
+            for node, parent_id, value, body in rows:
+                if value.__class__ is not str or len(value) > max_text:
+                    value = self._repair_text(model, node, value, validator)
+                text[node] = intern(value) if intern is not None else value
+                if body is not None:
+                    if is_body_key(body):
+                        body_keys[node] = body
+                    elif validator.report(INVALID_BODY, None, node,
+                                          f"node {node}, {type(body).__name__}"):
+                        validator.doomed.add(node)
+                parent[node] = parent_id
+                prev = last_child[parent_id]
+                prev_sibling[node] = prev
+                if prev == NONE:
+                    first_child[parent_id] = node
+                else:
+                    next_sibling[prev] = node
+                last_child[parent_id] = node
+            count += len(rows)
+            if task is not None:
+                task.report(count / total)
+        model.parent = parent
+        model.first_child = first_child
+        model.last_child = last_child
+        model.next_sibling = next_sibling
+        model.prev_sibling = prev_sibling
+        model.text = text
+        model.body_keys = body_keys
+        model._free = [node for node in range(capacity - 1, 0, -1) if text[node] is None]
+        model._count = count
+        validator.check_links(model)
+        for node in validator.doomed:
+            if model.is_attached(node):
+                model.remove(node)
+        validator.doomed.clear()
+        return json.loads(self.meta("extra", "{}"))
+
+    @staticmethod
+    def _repair_text(model, node, value, validator):
+        # The node is not linked yet, so it is reported without a path
+        if value.__class__ is str:
+            kind, detail = OVERSIZED_TEXT, f"node {node}, {len(value)} characters"
+            repaired = value[:validator.max_text]
+        elif isinstance(value, bytes):
+            kind, detail = INVALID_TEXT, f"node {node}, blob"
+            repaired = value.decode("utf-8", "replace")[:validator.max_text]
+        else:
+            kind, detail = INVALID_TEXT, f"node {node}, {type(value).__name__}"
+            repaired = "" if value is None else str(value)
+        if validator.report(kind, None, node, detail):
+            validator.doomed.add(node)
+        return repaired
+
+    def rewrite(self, model):
+        """Replaces every stored node with those of `model`, e.g. once a load
+        repaired the document, in one transaction."""
+        with self.db:
+            self.db.execute("DELETE FROM nodes")
+            for index, child in enumerate(model.children(ROOT)):
+                self.db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?)",
+                                    _rows(model, child, index))
+
+    def children(self, node=ROOT):
+        """Returns (id, text) of the children of `node` without loading anything else."""
+        return self.db.execute("SELECT id, text FROM nodes WHERE parent_id = ? "
+                               "ORDER BY position", (node,)).fetchall()
+
+    def read_subtree(self, node, model, parent=ROOT):
+        """Copies the stored subtree at `node` below `parent` in `model`.
+
+        Only the rows of that subtree are read. Returns the new node.
+        """
+        db = self.db
+        row = db.execute("SELECT text FROM nodes WHERE id = ?", (node,)).fetchone()
+        if row is None:
+            raise KeyError(node)
+        top = model.append(parent, row[0])
+        stack = [(node, top)]
+        while stack:
+            node, copied = stack.pop()
+            for child, value in self.children(node):
+                stack.append((child, model.append(copied, value)))
+        return top
+
+    # ------------------------------------------------------------------
+    #  Positions
+    # ------------------------------------------------------------------
+    def _position(self, node_id):
+        row = self.db.execute("SELECT position FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        return row[0] if row else None
+
+    def _place(self, model, node):
+        """Returns a position for `node` between its current model siblings."""
+        prev = model.prev_sibling[node]
+        nxt = model.next_sibling[node]
+        low = self._position(prev) if prev != NONE else None
+        high = self._position(nxt) if nxt != NONE else None
+        if low is None and high is None:
+            return 0.0
+        if high is None:
+            return low + 1.0
+        if low is None:
+            return high - 1.0
+        middle = (low + high) / 2
+        if low < middle < high:
+            return middle
+        # Repeated inserts at one spot exhausted the float precision
+        self._renumber(model, model.parent[node], node)
+        return float(model.index_of(node))
+
+    def _renumber(self, model, parent, skip):
+        self.db.executemany("UPDATE nodes SET position = ? WHERE id = ?",
+                            [(float(index), child)
+                             for index, child in enumerate(model.children(parent))
+                             if child != skip])
+
+    # ------------------------------------------------------------------
+    #  TreeObserver
+    # ------------------------------------------------------------------
+    def node_inserted(self, model, node):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)",
+                                _rows(model, node, self._place(model, node)))
+
+    def node_removing(self, model, node):
+        with self.db:
+            self.db.executemany("DELETE FROM nodes WHERE id = ?",
+                                ((child,) for child in model.iter_subtree(node)))
+
+    def text_changed(self, model, node, old_text):
+        with self.db:
+            self.db.execute("UPDATE nodes SET text = ? WHERE id = ?", (model.text[node], node))
+
+    def node_moved(self, model, node, old_path):
+        with self.db:
+            self.db.execute("UPDATE nodes SET parent_id = ?, position = ? WHERE id = ?",
+                            (model.parent[node], self._place(model, node), node))
+
+    def body_linked(self, model, node):
+        with self.db:
+            self.db.execute("UPDATE nodes SET body = ? WHERE id = ?",
+                            (model.body_keys[node], node))
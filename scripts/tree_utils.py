@@ -1,32 +1,99 @@
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+import json
 
-def serialize_tree(treestore):
-    data = []
-    tree_iter = treestore.get_iter_first()
-    while tree_iter:
-        node = {"text": treestore.get_value(tree_iter, 0), "children": []}
-        if treestore.iter_has_child(tree_iter):
-            child_iter = treestore.iter_children(tree_iter)
-            node["children"] = serialize_children(treestore, child_iter)
-        data.append(node)
-        tree_iter = treestore.iter_next(tree_iter)
-    return data
+from scripts.tree_model import ROOT, NONE
+from scripts.tree_validation import (LoadValidator, MISSING_TEXT, INVALID_TEXT, OVERSIZED_TEXT,
+                                     INVALID_CHILDREN, INVALID_BODY, INVALID_NODE,
+                                     is_body_key)
+
+def serialize_tree(model, node=ROOT):
+    """Returns the children of `node` as nested {"text", "children"} dicts.
 
-def serialize_children(treestore, tree_iter):
+    Nodes with a body also get its content store key as "body".
+    """
+    return serialize_children(model, model.first_child[node])
+
+def serialize_children(model, child):
+    """Serializes the sibling chain starting at `child` without recursion."""
+    text = model.text
+    body_keys = model.body_keys
+    first_child = model.first_child
+    next_sibling = model.next_sibling
     data = []
-    while tree_iter:
-        node = {"text": treestore.get_value(tree_iter, 0), "children": []}
-        if treestore.iter_has_child(tree_iter):
-            child_iter = treestore.iter_children(tree_iter)
-            node["children"] = serialize_children(treestore, child_iter)
-        data.append(node)
-        tree_iter = treestore.iter_next(tree_iter)
+    stack = [(child, data)]
+    while stack:
+        child, out = stack.pop()
+        while child != NONE:
+            if child in body_keys:
+                node = {"text": text[child], "body": body_keys[child], "children": []}
+            else:
+                node = {"text": text[child], "children": []}
+            out.append(node)
+            if first_child[child] != NONE:
+                stack.append((next_sibling[child], out))
+                stack.append((first_child[child], node["children"]))
+                break
+            child = next_sibling[child]
     return data
 
-def deserialize_tree(data, treestore, parent):
-    for node in data:
-        new_iter = treestore.append(parent, [node["text"]])
-        if "children" in node:
-            deserialize_tree(node["children"], treestore, new_iter)
+def deserialize_tree(data, model, parent, validator=None):
+    """Appends the nested dicts in `data` below `parent` (None for the root).
+
+    Malformed nodes are reported to `validator` (see tree_validation), which
+    repairs them by default.
+    """
+    if parent is None:
+        parent = ROOT
+    if validator is None:
+        validator = LoadValidator()
+    max_text = validator.max_text
+    append = model.append
+    stack = [(iter(data), parent)]
+    while stack:
+        nodes, parent = stack[-1]
+        for node in nodes:
+            if node.__class__ is not dict:
+                drop = validator.report(INVALID_NODE, model, parent, type(node).__name__)
+                if node.__class__ is str and not drop:
+                    append(parent, node[:max_text])
+                continue
+            text = node.get("text")
+            if text.__class__ is str and len(text) <= max_text:
+                new_node = append(parent, text)
+            else:
+                new_node = append(parent, "")
+                if _repair_text(model, new_node, node, validator):
+                    model.remove(new_node)
+                    continue
+            if "body" in node:
+                body = node["body"]
+                if is_body_key(body):
+                    model.body_keys[new_node] = body
+                elif validator.report(INVALID_BODY, model, new_node,
+                                      "null" if body is None else type(body).__name__):
+                    model.remove(new_node)
+                    continue
+            children = node.get("children")
+            if children.__class__ is not list and children is not None:
+                if validator.report(INVALID_CHILDREN, model, new_node, type(children).__name__):
+                    model.remove(new_node)
+            elif children:
+                stack.append((iter(children), new_node))
+                break
+        else:
+            stack.pop()
+
+def _repair_text(model, node, data, validator):
+    """Sets the text of `node` from the dict `data` whose text is not valid;
+    True if the node is to be dropped."""
+    text = data.get("text")
+    if "text" not in data:
+        kind, detail = MISSING_TEXT, None
+        repaired = ""
+    elif text.__class__ is str:
+        kind, detail = OVERSIZED_TEXT, f"{len(text)} characters"
+        repaired = text[:validator.max_text]
+    else:
+        kind, detail = INVALID_TEXT, "null" if text is None else type(text).__name__
+        repaired = "" if text is None or isinstance(text, (dict, list)) else json.dumps(text)
+    model.text[node] = repaired
+    return validator.report(kind, model, node, detail)
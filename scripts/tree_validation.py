@@ -0,0 +1,158 @@
+"""
+Validation and repair of tree documents while they load.
+
+The readers check every node as they build it and call a LoadValidator only
+when something is wrong, so a clean document costs a few type checks per
+node and is never read twice. Each problem is recorded with the path of the
+node it concerns, and the validator's policy decides what becomes of it:
+
+    repair  keep the node and fix it: missing text becomes "", other JSON
+            values are written out as text, oversized text is truncated, a
+            "children" value that is not a list and a "body" value that is not
+            a content store key are ignored, and nodes cut off
+            from the root by a parent cycle or a missing parent move to the
+            top level
+    drop    remove the node with its subtree instead
+    strict  raise DocumentProblem at the first problem
+"""
+from scripts.tree_model import ROOT
+
+REPAIR = "repair"
+DROP = "drop"
+STRICT = "strict"
+POLICIES = (REPAIR, DROP, STRICT)
+
+# Problem kinds
+MISSING_TEXT = "missing_text"
+INVALID_TEXT = "invalid_text"
+OVERSIZED_TEXT = "oversized_text"
+INVALID_CHILDREN = "invalid_children"
+INVALID_BODY = "invalid_body"
+INVALID_NODE = "invalid_node"
+UNREACHABLE = "unreachable"
+
+# Longest node text kept, in characters
+MAX_TEXT = 1 << 20
+# Problems kept in full; any further ones are only counted
+MAX_PROBLEMS = 1000
+
+
+def is_body_key(value):
+    """True for a content store key: an int >= 0, and not a bool."""
+    return value.__class__ is int and value >= 0
+
+
+class Problem:
+    """One problem found in a document."""
+
+    __slots__ = ("kind", "path", "detail")
+
+    def __init__(self, kind, path, detail=None):
+        self.kind = kind
+        # Sibling indices of the node, or None where it has no path yet
+        self.path = path
+        self.detail = detail
+
+    def __repr__(self):
+        return f"Problem({self.kind!r}, {self.path!r}, {self.detail!r})"
+
+    def __str__(self):
+        kind = self.kind.replace("_", " ")
+        if self.path is None:
+            return f"{kind}: {self.detail}"
+        location = "/".join(str(index) for index in self.path) or "top level"
+        return f"{location}: {kind} ({self.detail})" if self.detail else f"{location}: {kind}"
+
+
+class DocumentProblem(ValueError):
+    """Raised for the first problem found under the strict policy."""
+
+    def __init__(self, problem):
+        super().__init__(str(problem))
+        self.problem = problem
+
+
+class LoadValidator:
+    """Collects the problems found while loading one document."""
+
+    def __init__(self, policy=REPAIR, max_text=MAX_TEXT):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}")
+        self.policy = policy
+        self.max_text = max_text
+        self.problems = []
+        self.count = 0
+        # Nodes the readers remove once they are complete
+        self.doomed = set()
+
+    @property
+    def ok(self):
+        return self.count == 0
+
+    def report(self, kind, model, node, detail=None):
+        """Records a problem with `node`; True if the policy drops the node.
+
+        Pass model=None for a node without a path.
+        """
+        if self.policy == STRICT or len(self.problems) < MAX_PROBLEMS:
+            path = model.path(node) if model is not None else None
+            problem = Problem(kind, path, detail)
+            if self.policy == STRICT:
+                raise DocumentProblem(problem)
+            self.problems.append(problem)
+        self.count += 1
+        return self.policy == DROP
+
+    def summary(self, limit=20):
+        """Lines describing the first `limit` problems."""
+        lines = [str(problem) for problem in self.problems[:limit]]
+        if self.count > len(lines):
+            lines.append(f"... and {self.count - len(lines)} more")
+        return lines
+
+    # ------------------------------------------------------------------
+    #  Structure
+    # ------------------------------------------------------------------
+    def check_links(self, model):
+        """Finds the nodes that `model` holds but the root cannot reach.
+
+        Loaders that link nodes by parent id, like tree_sqlite, call this once
+        the tables are built: a parent cycle (e.g. left by merging two
+        databases) or a missing parent leaves its nodes unreachable. Every
+        parent id must index a slot of the tables. A clean document costs one
+        walk over the tree.
+        """
+        reachable = -1
+        for _ in model.iter_subtree(ROOT):
+            reachable += 1
+        if reachable == len(model):
+            return
+        text = model.text
+        parent = model.parent
+        reached = bytearray(model.capacity())
+        for node in model.iter_subtree(ROOT):
+            reached[node] = 1
+        for node in range(1, model.capacity()):
+            if text[node] is None or reached[node]:
+                continue
+            # Climb to the top of the cut-off branch
+            top = node
+            seen = {top}
+            while True:
+                up = parent[top]
+                if text[up] is None:
+                    detail = f"node {top}, missing parent"
+                    break
+                if up in seen:
+                    detail = f"node {top}, parent cycle"
+                    break
+                seen.add(up)
+                top = up
+            drop = self.report(UNREACHABLE, None, top, detail)
+            model.detach(top)
+            for child in model.iter_subtree(top):
+                reached[child] = 1
+            if drop:
+                model.free(top)
+            else:
+                model.attach(top, ROOT)
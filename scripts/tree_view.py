@@ -0,0 +1,233 @@
+"""
+Gtk.TreeStore view over a TreeModel.
+
+The store holds two columns, the node text and the node id, and mirrors the
+structure of the model so that a model path is also a valid store path.
+
+In lazy mode only rows that have been expanded get their children; a row with
+unloaded children holds a single placeholder child whose node id is NONE.
+"""
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
+from scripts.tree_model import ROOT, NONE, TreeObserver
+
+TEXT_COLUMN = 0
+NODE_COLUMN = 1
+_COLUMNS = [TEXT_COLUMN, NODE_COLUMN]
+
+
+class StoreView(TreeObserver):
+    """Keeps a Gtk.TreeStore in step with a TreeModel."""
+
+    def __init__(self, model, lazy=False, release_collapsed=False):
+        self.model = model
+        self.lazy = lazy
+        self.release_collapsed = release_collapsed
+        self.store = Gtk.TreeStore(str, int)
+        self.treeview = None
+        model.observers.append(self)
+
+    def connect_treeview(self, treeview):
+        """Fills rows on expansion and, optionally, empties them on collapse."""
+        self.treeview = treeview
+        treeview.connect("test-expand-row", self.on_test_expand_row)
+        treeview.connect("row-collapsed", self.on_row_collapsed)
+
+    def populate(self):
+        """Rebuilds the store from the model without recursion.
+
+        The store is detached from the TreeView while it is filled, so the
+        view does not process a row-inserted signal for every row.
+        """
+        treeview = self.treeview
+        if treeview is not None:
+            treeview.set_model(None)
+        self.store.clear()
+        self._append_children(self.model.first_child[ROOT], None)
+        if treeview is not None:
+            treeview.set_model(self.store)
+
+    def _append_children(self, child, parent_iter):
+        if self.lazy:
+            self._append_rows(child, parent_iter)
+        else:
+            self._append_subtrees(child, parent_iter)
+
+    def _append_rows(self, child, parent_iter):
+        """Appends one level of rows, giving each parent a placeholder."""
+        model = self.model
+        text = model.text
+        first_child = model.first_child
+        next_sibling = model.next_sibling
+        insert = self.store.insert_with_valuesv
+        while child != NONE:
+            row = insert(parent_iter, -1, _COLUMNS, [text[child], child])
+            if first_child[child] != NONE:
+                insert(row, -1, _COLUMNS, ["", NONE])
+            child = next_sibling[child]
+
+    def _append_subtrees(self, child, parent_iter):
+        model = self.model
+        text = model.text
+        first_child = model.first_child
+        next_sibling = model.next_sibling
+        insert = self.store.insert_with_valuesv
+        stack = [(child, parent_iter)]
+        while stack:
+            child, parent_iter = stack.pop()
+            while child != NONE:
+                row = insert(parent_iter, -1, _COLUMNS, [text[child], child])
+                if first_child[child] != NONE:
+                    stack.append((next_sibling[child], parent_iter))
+                    stack.append((first_child[child], row))
+                    break
+                child = next_sibling[child]
+
+    def node_for(self, tree_iter):
+        return self.store.get_value(tree_iter, NODE_COLUMN)
+
+    def is_loaded(self, tree_iter):
+        """True once the child rows of `tree_iter` mirror the model."""
+        child = self.store.iter_children(tree_iter)
+        return child is None or self.node_for(child) != NONE
+
+    def load_children(self, tree_iter):
+        """Replaces the placeholder below `tree_iter` with real rows."""
+        placeholder = self.store.iter_children(tree_iter)
+        if placeholder is None or self.node_for(placeholder) != NONE:
+            return
+        self.store.remove(placeholder)
+        self._append_children(self.model.first_child[self.node_for(tree_iter)], tree_iter)
+
+    def release_children(self, tree_iter):
+        """Drops the child rows of `tree_iter` in favour of a placeholder."""
+        child = self.store.iter_children(tree_iter)
+        if child is None:
+            return
+        while self.store.remove(child):
+            pass
+        self.store.append(tree_iter, ["", NONE])
+
+    def iter_for(self, node):
+        """Store iter of `node`, or None for the root or an unloaded row."""
+        return self._iter_at(self.model.path(node))
+
+    def materialize(self, node):
+        """Loads the rows down to `node`; returns its iter, None for the root."""
+        tree_iter = None
+        for index in self.model.path(node):
+            self.load_children(tree_iter)
+            tree_iter = self.store.iter_nth_child(tree_iter, index)
+        return tree_iter
+
+    def expanded_nodes(self):
+        """Nodes whose rows are expanded in the TreeView."""
+        nodes = []
+        shown = self.treeview.get_model()
+        if shown is not None:
+            self.treeview.map_expanded_rows(
+                lambda treeview, path: nodes.append(shown[path][NODE_COLUMN]))
+        return nodes
+
+    def expand_nodes(self, nodes):
+        """Expands the rows of `nodes` and of their ancestors.
+
+        In lazy mode this loads only the rows on those branches. The TreeView
+        must be showing the store.
+        """
+        for node in nodes:
+            tree_iter = self.materialize(node)
+            self.treeview.expand_to_path(self.store.get_path(tree_iter))
+
+    def _iter_at(self, path):
+        tree_iter = None
+        for index in path:
+            if not self.is_loaded(tree_iter):
+                return None
+            tree_iter = self.store.iter_nth_child(tree_iter, index)
+            if tree_iter is None:
+                return None
+        return tree_iter
+
+    def _loaded_iter(self, node):
+        """Returns (True, iter) when the rows below `node` are materialized."""
+        if node == ROOT:
+            return True, None
+        tree_iter = self.iter_for(node)
+        if tree_iter is None or not self.is_loaded(tree_iter):
+            return False, None
+        return True, tree_iter
+
+    def drop_target(self, path, position):
+        """Maps a TreeView drop row and position to (parent, before) nodes.
+
+        `path` is None for a drop below the last row. Returns None when the
+        drop lands on a placeholder row.
+        """
+        if path is None:
+            return ROOT, NONE
+        target = self.node_for(self.store.get_iter(path))
+        if target == NONE:
+            return None
+        if position in (Gtk.TreeViewDropPosition.INTO_OR_BEFORE,
+                        Gtk.TreeViewDropPosition.INTO_OR_AFTER):
+            return target, NONE
+        parent = self.model.parent[target]
+        if position == Gtk.TreeViewDropPosition.BEFORE:
+            return parent, target
+        return parent, self.model.next_sibling[target]
+
+    def _store_iter(self, treeview, tree_iter):
+        # The TreeView may show a filter over the store, see focus_view
+        model = treeview.get_model()
+        if model is self.store:
+            return tree_iter
+        return model.convert_iter_to_child_iter(tree_iter)
+
+    def on_test_expand_row(self, treeview, tree_iter, path):
+        self.load_children(self._store_iter(treeview, tree_iter))
+        return False
+
+    def on_row_collapsed(self, treeview, tree_iter, path):
+        if self.lazy and self.release_collapsed:
+            self.release_children(self._store_iter(treeview, tree_iter))
+
+    # ------------------------------------------------------------------
+    #  TreeObserver
+    # ------------------------------------------------------------------
+    def node_inserted(self, model, node):
+        self._insert_row(model, node, self.lazy)
+
+    def _insert_row(self, model, node, lazy):
+        loaded, parent_iter = self._loaded_iter(model.parent[node])
+        if not loaded:
+            return
+        position = model.index_of(node)
+        row = self.store.insert(parent_iter, position, [model.text[node], node])
+        if lazy:
+            if model.first_child[node] != NONE:
+                self.store.append(row, ["", NONE])
+        else:
+            self._append_subtrees(model.first_child[node], row)
+
+    def node_removing(self, model, node):
+        tree_iter = self.iter_for(node)
+        if tree_iter is not None:
+            self.store.remove(tree_iter)
+
+    def text_changed(self, model, node, old_text):
+        tree_iter = self.iter_for(node)
+        if tree_iter is not None:
+            self.store.set_value(tree_iter, TEXT_COLUMN, model.text[node])
+
+    def node_moved(self, model, node, old_path):
+        # The store still has the row at its old path. Gtk.TreeStore cannot
+        # move rows between parents, so the row is re-inserted at the new one
+        # with its children left unloaded until it is expanded, which keeps
+        # moving a large branch as cheap as in the model.
+        tree_iter = self._iter_at(old_path)
+        if tree_iter is not None:
+            self.store.remove(tree_iter)
+        self._insert_row(model, node, lazy=True)
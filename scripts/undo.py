@@ -0,0 +1,228 @@
+"""
+Undo/redo history built from reversible operation records.
+
+Removing a branch only detaches it from the TreeModel, so the record keeps the
+branch itself rather than a copy, and undo/redo cost is proportional to the size
+of the change. Records are grouped into transactions, and the oldest
+transactions are dropped once the history exceeds its memory budget.
+"""
+from contextlib import contextmanager
+
+from scripts.tree_model import NONE
+
+# Rough bytes per node held by a record, on top of its text
+NODE_COST = 64
+
+
+class InsertRecord:
+    """A node (with any subtree) that was linked into the tree."""
+
+    def __init__(self, model, node):
+        self.node = node
+        self.parent = model.parent[node]
+        self.before = model.next_sibling[node]
+        # An attached branch (paste, import, merge) is held whole once undone
+        text = model.text
+        self.cost = sum(NODE_COST + len(text[child]) for child in model.iter_subtree(node))
+
+    def undo(self, model):
+        model.detach(self.node)
+
+    def redo(self, model):
+        model.attach(self.node, self.parent, self.before)
+
+    def release(self, model, undone):
+        # An undone insert holds its branch detached until redone
+        if undone:
+            model.free(self.node)
+
+
+class RemoveRecord:
+    """A branch that was detached from the tree, kept for undo."""
+
+    def __init__(self, model, node):
+        self.node = node
+        self.parent = model.parent[node]
+        self.before = model.next_sibling[node]
+        text = model.text
+        self.cost = sum(NODE_COST + len(text[child]) for child in model.iter_subtree(node))
+
+    def undo(self, model):
+        model.attach(self.node, self.parent, self.before)
+
+    def redo(self, model):
+        model.detach(self.node)
+
+    def release(self, model, undone):
+        if not undone:
+            model.free(self.node)
+
+
+class MoveRecord:
+    """A branch relinked elsewhere; only its position is recorded."""
+
+    def __init__(self, model, node):
+        self.node = node
+        self.parent = model.parent[node]
+        self.before = model.next_sibling[node]
+        self.new_parent = NONE
+        self.new_before = NONE
+        self.cost = NODE_COST
+
+    def moved(self, model):
+        self.new_parent = model.parent[self.node]
+        self.new_before = model.next_sibling[self.node]
+
+    def undo(self, model):
+        model.move(self.node, self.parent, self.before)
+
+    def redo(self, model):
+        model.move(self.node, self.new_parent, self.new_before)
+
+    def release(self, model, undone):
+        pass
+
+
+class TextRecord:
+    """A change of node text."""
+
+    def __init__(self, node, old_text, new_text):
+        self.node = node
+        self.old_text = old_text
+        self.new_text = new_text
+        self.cost = NODE_COST + len(old_text) + len(new_text)
+
+    def undo(self, model):
+        model.set_text(self.node, self.old_text)
+
+    def redo(self, model):
+        model.set_text(self.node, self.new_text)
+
+    def release(self, model, undone):
+        pass
+
+
+class Transaction:
+    """Records undone and redone together, e.g. the steps of a paste."""
+
+    def __init__(self, label):
+        self.label = label
+        self.records = []
+        self.cost = 0
+
+    def add(self, record):
+        self.records.append(record)
+        self.cost += record.cost
+
+
+class UndoHistory:
+    """Applies edits to a TreeModel and records how to reverse them."""
+
+    def __init__(self, model, budget=64 * 1024 * 1024):
+        self.model = model
+        self.budget = budget
+        self.undo_stack = []
+        self.redo_stack = []
+        self.cost = 0
+        self._open = None
+
+    # ------------------------------------------------------------------
+    #  Recording edits
+    # ------------------------------------------------------------------
+    @contextmanager
+    def transaction(self, label):
+        """Groups the edits made inside the block into one undo step."""
+        if self._open is not None:
+            yield self._open
+            return
+        self._open = Transaction(label)
+        try:
+            yield self._open
+        finally:
+            transaction, self._open = self._open, None
+            if transaction.records:
+                self._push(transaction)
+
+    def _record(self, label, record):
+        with self.transaction(label) as transaction:
+            transaction.add(record)
+
+    def _push(self, transaction):
+        self._release(self.redo_stack, undone=True)
+        self.undo_stack.append(transaction)
+        self.cost += transaction.cost
+        # Drop the oldest steps once the history is over budget
+        while self.cost > self.budget and len(self.undo_stack) > 1:
+            oldest = self.undo_stack.pop(0)
+            self.cost -= oldest.cost
+            for record in oldest.records:
+                record.release(self.model, undone=False)
+
+    def _release(self, stack, undone):
+        for transaction in stack:
+            self.cost -= transaction.cost
+            for record in transaction.records:
+                record.release(self.model, undone)
+        stack.clear()
+
+    def insert(self, parent, text, before=NONE):
+        node = self.model.insert(parent, text, before)
+        self._record("Add", InsertRecord(self.model, node))
+        return node
+
+    def attach(self, node, parent, before=NONE):
+        """Links an already built, detached branch into the tree."""
+        self.model.attach(node, parent, before)
+        self._record("Insert", InsertRecord(self.model, node))
+
+    def remove(self, node):
+        record = RemoveRecord(self.model, node)
+        self.model.detach(node)
+        self._record("Remove", record)
+
+    def move(self, node, parent, before=NONE):
+        record = MoveRecord(self.model, node)
+        self.model.move(node, parent, before)
+        record.moved(self.model)
+        self._record("Move", record)
+
+    def set_text(self, node, text):
+        old_text = self.model.text[node]
+        if text == old_text:
+            return
+        self.model.set_text(node, text)
+        self._record("Edit", TextRecord(node, old_text, text))
+
+    # ------------------------------------------------------------------
+    #  Undo and redo
+    # ------------------------------------------------------------------
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        """Reverts the last transaction; returns it, or None if there is none."""
+        if not self.undo_stack:
+            return None
+        transaction = self.undo_stack.pop()
+        for record in reversed(transaction.records):
+            record.undo(self.model)
+        self.redo_stack.append(transaction)
+        return transaction
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        transaction = self.redo_stack.pop()
+        for record in transaction.records:
+            record.redo(self.model)
+        self.undo_stack.append(transaction)
+        return transaction
+
+    def reset(self):
+        """Forgets all history without touching the model, e.g. after a load."""
+        self.undo_stack = []
+        self.redo_stack = []
+        self.cost = 0
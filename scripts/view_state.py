@@ -0,0 +1,50 @@
+"""
+Expanded rows and selection saved with a document.
+
+The state is kept under VIEW_KEY next to "settings" as two lists of node ids,
+{"expanded": [...], "selected": [...]}, so restoring it touches only those
+nodes. The ids are the ones the document has when it is next loaded: an
+SQLite document and the warm-start cache keep the ids of the saved model,
+while a JSON document read from scratch numbers its nodes in document order,
+so the state written into a JSON file is renumbered that way first.
+"""
+from scripts.tree_model import ROOT, NONE
+
+VIEW_KEY = "view_state"
+
+
+def make_state(expanded, selected=NONE):
+    return {"expanded": sorted(set(expanded)),
+            "selected": [] if selected == NONE else [selected]}
+
+
+def in_document_order(model, state):
+    """`state` with the ids a fresh load of `model` from JSON would give."""
+    wanted = set(state["expanded"]) | set(state["selected"])
+    numbers = {}
+    if wanted:
+        # Loading appends nodes in document order, from id 1 up
+        for number, node in enumerate(model.iter_subtree(ROOT)):
+            if node in wanted:
+                numbers[node] = number
+                if len(numbers) == len(wanted):
+                    break
+    return {"expanded": sorted(numbers[node] for node in state["expanded"] if node in numbers),
+            "selected": [numbers[node] for node in state["selected"] if node in numbers]}
+
+
+def restorable(model, state):
+    """Returns (expanded nodes, selected node) of `state` that still exist in `model`.
+
+    Ids from a stale or hand-edited state are skipped, not trusted.
+    """
+    if not isinstance(state, dict):
+        return [], NONE
+
+    def valid(ids):
+        if not isinstance(ids, list):
+            return []
+        return [node for node in ids if type(node) is int and model.is_attached(node)]
+    expanded = [node for node in valid(state.get("expanded")) if model.has_children(node)]
+    selected = valid(state.get("selected"))
+    return expanded, selected[0] if selected else NONE
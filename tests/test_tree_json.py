@@ -0,0 +1,85 @@
+"""Tests of the streaming JSON reader against the json module."""
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.tree_json import iter_events, read_value, read_document, JsonStreamError
+from scripts.tree_model import TreeModel
+
+MALFORMED = [
+    '{"text" "a"}',
+    '[1 2 3]',
+    '[{"text":"a"},,]',
+    '[{"text":"a"} {"text":"b"}]',
+    '{"a":1 "b":2}',
+    '[1,]',
+    '{"a":1,}',
+    '[,1]',
+    '{,"a":1}',
+    '{"a"}',
+    '{"a":}',
+    '{:1}',
+    '[1:2]',
+    '{"a"::1}',
+    '[1] [2]',
+    '[1]]',
+    '{"a":1}}',
+    '[}',
+    '{]',
+    '{1:2}',
+    '[',
+    '{"a":',
+    '-',
+    '[1.]',
+    '[tru]',
+]
+
+WELL_FORMED = [
+    '[]',
+    '{}',
+    '[-1.25e-3, 0, 10, 2E+5, true, false, null, "x"]',
+    '{"tree": [{"text": "a", "children": [{"text": "b"}]}], "settings": {"n": [1, {"m": -0.5}]}}',
+    '  [ 1 , [ ] , { } ]  ',
+]
+
+
+def parse(text, chunk_size):
+    events = iter_events(io.StringIO(text), chunk_size)
+    event, value = next(events)
+    result = read_value(events, event, value)
+    # Draining the rest raises for anything after the value
+    for _ in events:
+        pass
+    return result
+
+
+@pytest.mark.parametrize("text", MALFORMED)
+@pytest.mark.parametrize("chunk_size", [1, 2, 4, 8, 1 << 16])
+def test_rejects_what_json_rejects(text, chunk_size):
+    with pytest.raises(ValueError):
+        json.loads(text)
+    with pytest.raises(JsonStreamError):
+        parse(text, chunk_size)
+
+
+@pytest.mark.parametrize("text", WELL_FORMED)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 8, 1 << 16])
+def test_matches_json_loads(text, chunk_size):
+    assert parse(text, chunk_size) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 4, 8])
+def test_number_split_at_chunk_boundary(chunk_size):
+    for prefix in ("", " ", "  ", "   "):
+        text = prefix + "[-1.25e-3, 123456789, true]"
+        assert parse(text, chunk_size) == json.loads(text)
+
+
+def test_read_document_rejects_missing_commas():
+    with pytest.raises(JsonStreamError):
+        read_document(io.StringIO('{"tree": [{"text": "a"} {"text": "b"}]}'), TreeModel())
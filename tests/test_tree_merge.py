@@ -0,0 +1,162 @@
+"""Tests of the three-way merge of a document changed on disk."""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.tree_hash import SubtreeHashes
+from scripts.tree_merge import LocalChanges, diff_ops, apply_ops
+from scripts.tree_model import TreeModel, ROOT
+from scripts.tree_utils import deserialize_tree, serialize_tree
+from scripts.undo import UndoHistory
+
+
+def outline(*items):
+    """Nested dicts from texts and (text, [children]) tuples."""
+    data = []
+    for item in items:
+        if isinstance(item, tuple):
+            data.append({"text": item[0], "children": outline(*item[1])})
+        else:
+            data.append({"text": item})
+    return data
+
+
+def build(data):
+    model = TreeModel()
+    deserialize_tree(data, model, ROOT)
+    return model
+
+
+def texts(model, node=ROOT):
+    """The tree as nested lists of texts, for readable comparisons."""
+    result = []
+    for child in model.children(node):
+        if model.has_children(child):
+            result.append((model.text[child], texts(model, child)))
+        else:
+            result.append(model.text[child])
+    return result
+
+
+class Document:
+    """An open model with the bookkeeping the editor keeps for merging."""
+
+    def __init__(self, data):
+        self.model = build(data)
+        self.hashes = SubtreeHashes(self.model)
+        self.local = LocalChanges()
+        self.model.observers.append(self.local)
+        self.history = UndoHistory(self.model)
+        self.base = self.model.copy()
+        self.hashes.hex()
+        self.base_hashes = self.hashes.copy(self.base)
+
+    def merge(self, data):
+        theirs = build(data)
+        ops = diff_ops(self.base, self.base_hashes, theirs, SubtreeHashes(theirs))
+        return apply_ops(ops, self.base, self.model, self.local, self.history)
+
+
+def test_no_local_changes_takes_theirs():
+    document = Document(outline("A", ("B", ["B1", "B2"]), "C"))
+    theirs = outline("X", ("B", ["B1", "B2 edited", "B3"]), "C")
+    applied, conflicts = document.merge(theirs)
+    assert applied
+    assert conflicts == []
+    assert serialize_tree(document.model) == serialize_tree(build(theirs))
+    assert not document.local
+
+
+def test_rename_after_sibling_removed_on_both_sides():
+    document = Document(outline("Apples", "Bananas", "Cherries"))
+    document.history.remove(document.model.node_at((0,)))
+    applied, conflicts = document.merge(outline("Bananas!", "Cherries"))
+    assert texts(document.model) == ["Bananas!", "Cherries"]
+    assert conflicts == []
+
+
+def test_text_edited_on_both_sides_after_removed_sibling():
+    document = Document(outline("Apples", "Bananas", "Cherries"))
+    document.history.set_text(document.model.node_at((1,)), "Bananas here")
+    applied, conflicts = document.merge(outline("Bananas there", "Cherries"))
+    assert texts(document.model) == ["Bananas here", "Cherries"]
+    assert len(conflicts) == 1
+
+
+def test_insert_before_edited_node_is_not_a_duplicate():
+    document = Document(outline(("Plan", ["Step 1", "Step 2"]), "Notes"))
+    document.history.set_text(document.model.node_at((0, 1)), "Step 2 here")
+    applied, conflicts = document.merge(outline("Intro", ("Plan!", ["Step 1", "Step 2"]), "Notes"))
+    assert texts(document.model) == ["Intro", ("Plan!", ["Step 1", "Step 2 here"]), "Notes"]
+    assert conflicts == []
+
+
+def test_renamed_branch_is_paired_by_its_children():
+    document = Document(outline(("Alpha", ["a1", "a2"]), ("Beta", ["b1"])))
+    document.history.insert(document.model.node_at((1,)), "b2")
+    applied, conflicts = document.merge(outline(("Zeta", ["b1"])))
+    assert texts(document.model) == [("Zeta", ["b1", "b2"])]
+    assert conflicts == []
+
+
+def test_removal_of_edited_branch_keeps_it():
+    document = Document(outline(("A", ["A1", "A2"]), "B"))
+    document.history.set_text(document.model.node_at((0, 1)), "A2 here")
+    applied, conflicts = document.merge(outline("B"))
+    assert texts(document.model) == [("A", ["A1", "A2 here"]), "B"]
+    assert len(conflicts) == 1
+
+
+def test_added_branch_keeps_its_bodies():
+    document = Document(outline("A"))
+    theirs = [{"text": "A", "children": []},
+              {"text": "B", "body": 3, "children": [{"text": "B1", "body": 4, "children": []}]}]
+    document.merge(theirs)
+    assert serialize_tree(document.model) == theirs
+
+
+def test_merge_is_one_undo_step():
+    data = outline("A", ("B", ["B1"]), "C")
+    document = Document(data)
+    document.merge(outline("C", ("B", ["B1", "B2"]), "D"))
+    document.history.undo()
+    assert serialize_tree(document.model) == serialize_tree(build(data))
+
+
+def random_edits(model, rng, count, label):
+    for index in range(count):
+        nodes = [node for node in model.iter_subtree(ROOT) if node != ROOT]
+        node = rng.choice(nodes)
+        roll = rng.random()
+        if roll < 0.3:
+            model.set_text(node, "%s%d" % (label, index))
+        elif roll < 0.6 and len(nodes) > 2:
+            model.remove(node)
+        else:
+            model.insert(rng.choice([ROOT] + nodes), "%s%d" % (label, index))
+
+
+def test_random_merges():
+    data = [{"text": str(i), "children": [{"text": "%d.%d" % (i, j)} for j in range(3)]}
+            for i in range(6)]
+    rng = random.Random(1)
+    for _ in range(300):
+        edited = build(data)
+        random_edits(edited, rng, 5, "t")
+        theirs = serialize_tree(edited)
+        # Without local changes the merge gives their tree
+        document = Document(data)
+        assert document.merge(theirs)[1] == []
+        assert serialize_tree(document.model) == theirs
+        # Texts edited here are never lost to a conflict
+        document = Document(data)
+        random_edits(document.model, rng, 3, "l")
+        kept = {document.model.text[node] for node in document.local.touched
+                if node != ROOT and document.model.is_attached(node)
+                and document.model.text[node].startswith("l")}
+        document.merge(theirs)
+        merged = {document.model.text[node] for node in document.model.iter_subtree(ROOT)
+                  if node != ROOT}
+        assert kept <= merged